@@ -3,14 +3,37 @@ Application factory module
 Creates and configures the bot app
 """
 
+import hmac
+import json
+import math
 import logging
 import asyncio
 from aiohttp import web
-from aiogram import Bot, Dispatcher
+from aiogram import Dispatcher
 from aiogram.contrib.fsm_storage.memory import MemoryStorage
 
-from bot.config import API_TOKEN, IS_WINDOWS
-from bot.database.connection import init_db, close_db, set_app, db_fetch_with_retry
+from bot.config import (
+    API_TOKEN, IS_WINDOWS, CHECK_WATCH_TIMEOUT, CHECK_SSE_KEEPALIVE, CHECK_BATCH_MAX,
+    CHECK_WORKERS, CHECK_SNAPSHOT_PATH, STATS_TOKEN, DB_UPDATE_BUDGET, DB_SLOW_QUERY_LOG
+)
+from bot.database.connection import init_db, close_db, set_app, check_db_ready, get_pool_stats, get_breaker_stats
+from bot.database.queries import load_allowlists, refresh_allowlists_loop, get_singleflight_stats
+from bot.database.loader import access_loader
+from bot.database.migrations import migration_stats
+from bot.database.querystats import get_query_stats
+from bot.database.profiles import profile_writer_loop, stop_profile_writer
+from bot.middleware.preload import AccessPreloadMiddleware
+from bot.middleware.budget import DbBudgetMiddleware
+from bot.middleware.deliverability import DeliverabilityMiddleware
+from bot.middleware.profiles import ProfileCaptureMiddleware
+from bot.httputil import etag_matches, accepts_gzip
+from bot.snapshot import snapshot_writer_loop
+from bot.outbound import ScheduledBot, outbound, stop_outbound
+from bot.broadcast import broadcast_loop, stop_broadcast_worker
+from bot.resolver import profile_resolver
+from bot.models.allowlist import allowlist
+from bot.models.cache import undeliverable_chats
+from bot.models.profiles import profile_store
 
 if IS_WINDOWS:
     asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
@@ -29,6 +52,12 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Slow queries also go to their own file if configured
+if DB_SLOW_QUERY_LOG:
+    _slow_handler = logging.FileHandler(DB_SLOW_QUERY_LOG, encoding='utf-8')
+    _slow_handler.setFormatter(logging.Formatter('%(asctime)s - %(message)s'))
+    logging.getLogger("slow_queries").addHandler(_slow_handler)
+
 # Critical validation
 if not API_TOKEN:
     logger.critical("❌ ОШИБКА: Проверь переменные окружения!")
@@ -43,13 +72,21 @@ def create_app():
     """
     # Create components
     storage = MemoryStorage()
-    bot = Bot(token=API_TOKEN)
+    # Chat-bound sends are paced by the outbound scheduler
+    bot = ScheduledBot(token=API_TOKEN)
     dp = Dispatcher(bot, storage=storage)
     app = web.Application()
     
     # Pass app reference to database module
     set_app(app)
     
+    # Cap the total DB time of each update, then batch access lookups of concurrent updates
+    dp.middleware.setup(DbBudgetMiddleware(DB_UPDATE_BUDGET))
+    dp.middleware.setup(DeliverabilityMiddleware())
+    # Usernames for admin listings, taken from updates instead of get_chat
+    dp.middleware.setup(ProfileCaptureMiddleware())
+    dp.middleware.setup(AccessPreloadMiddleware())
+    
     # Register all handlers
     logger.info("Регистрация обработчиков...")
     register_user_handlers(dp)
@@ -63,10 +100,20 @@ def create_app():
     
     # Setup routes
     app.router.add_get('/check', handle_check)
+    # Not under /check/: any segment there is a nickname (players named Watch, Batch, ...)
+    app.router.add_get('/check-watch', handle_check_watch)
+    app.router.add_get('/check-batch', handle_check_batch)
+    app.router.add_post('/check-batch', handle_check_batch)
+    app.router.add_get('/check/{nickname}', handle_check_nickname)
+    app.router.add_get('/stats', handle_stats)
     app.router.add_get('/', lambda r: web.Response(text="OK"))
     
     # Setup startup and cleanup hooks
     app.on_startup.append(on_startup)
+    app.on_shutdown.append(release_watchers)
+    app.on_shutdown.append(stop_broadcast_worker)
+    app.on_shutdown.append(stop_outbound)
+    app.on_shutdown.append(stop_profile_writer)
     app.on_cleanup.append(close_db)
     
     # Store bot and dispatcher in app for global access
@@ -76,58 +123,255 @@ def create_app():
     return app, bot, dp
 
 
+async def ensure_allowlist(app):
+    """
+    Make sure the allow-lists are loaded (first request may beat startup)
+    
+    Returns:
+        bool: True if the allow-lists can be served
+    """
+    if allowlist.loaded:
+        return True
+    return 'db_pool' in app and await load_allowlists()
+
+
 async def handle_check(request):
     """Health check endpoint that returns access list"""
-    app = request.app
-    if 'db_pool' not in app:
+    if not await ensure_allowlist(request.app):
         return web.json_response({"error": "DB Error"}, status=500)
         
-    try:
-        # Get requested script (default to 'mine' for backward compatibility)
-        script_type = request.query.get('script', 'mine')
-        
-        # Get all approved users
-        res = await db_fetch_with_retry(
-            "SELECT nickname, approved FROM access_list WHERE approved IS NOT NULL AND approved != '0'",
-            fetch="all",
-            action_desc="Ошибка проверки БД"
-        )
+    # Get requested script (default to 'mine' for backward compatibility)
+    script_type = request.query.get('script', 'mine')
+    
+    # Served from memory, kept in sync by the access handlers
+    payload = allowlist.payload(script_type)
+    
+    # Delta sync: ?since=<version from X-Allowlist-Version>
+    since = request.query.get('since')
+    if since is not None:
+        try:
+            since = int(since)
+        except ValueError:
+            return web.json_response({"error": "Invalid since"}, status=400)
+        return check_delta_response(script_type, since, payload)
+    
+    headers = {
+        'ETag': payload.etag,
+        'Cache-Control': 'no-cache',
+        'Vary': 'Accept-Encoding',
+        'X-Allowlist-Version': str(allowlist.version),
+    }
+    
+    # Client already has this version
+    if etag_matches(request.headers.get('If-None-Match'), payload.etag):
+        return web.Response(status=304, headers=headers)
+    
+    if payload.gzipped is not None and accepts_gzip(request.headers.get('Accept-Encoding')):
+        headers['Content-Encoding'] = 'gzip'
+        return web.Response(body=payload.gzipped, content_type="application/json", headers=headers)
+    return web.Response(body=payload.body, content_type="application/json", headers=headers)
+
+
+def check_delta_response(script_type, since, payload):
+    """
+    Build a delta sync response for /check
+    
+    Body is {"version": V, "added": [...], "removed": [...]}, or
+    {"version": V, "full": [...]} when the journal no longer reaches back
+    to `since` or the delta would not be smaller than the list.
+    
+    Args:
+        script_type: Script identifier
+        since: Version the client has
+        payload: Current CheckPayload of the script
         
-        if not res:
-            return web.json_response([])
-            
-        allowed_users = []
-        import json
+    Returns:
+        web.Response
+    """
+    headers = {'Cache-Control': 'no-cache', 'X-Allowlist-Version': str(allowlist.version)}
+    _, body = build_check_delta(script_type, since, payload)
+    return web.Response(body=body, content_type="application/json", headers=headers)
+
+
+async def handle_check_nickname(request):
+    """Check a single nickname: /check/{nickname}?script=X"""
+    if not await ensure_allowlist(request.app):
+        return web.json_response({"error": "DB Error"}, status=500)
+    
+    nickname = request.match_info['nickname']
+    script_type = request.query.get('script', 'mine')
+    return web.json_response(
+        {"nickname": nickname, "allowed": allowlist.allowed(nickname, script_type)},
+        headers={'Cache-Control': 'no-cache', 'X-Allowlist-Version': str(allowlist.version)}
+    )
+
+
+async def handle_check_batch(request):
+    """
+    Check several nicknames at once
+    
+    GET /check-batch?script=X&nicknames=A,B or POST with a JSON array of
+    nicknames. Returns {"Nick": true/false, ...}.
+    """
+    if not await ensure_allowlist(request.app):
+        return web.json_response({"error": "DB Error"}, status=500)
+    
+    script_type = request.query.get('script', 'mine')
+    if request.method == 'POST':
+        try:
+            nicknames = await request.json()
+        except ValueError:
+            return web.json_response({"error": "Invalid JSON"}, status=400)
+        if not isinstance(nicknames, list) or not all(isinstance(n, str) for n in nicknames):
+            return web.json_response({"error": "Expected a list of nicknames"}, status=400)
+    else:
+        nicknames = [n for n in request.query.get('nicknames', '').split(',') if n]
+    
+    if len(nicknames) > CHECK_BATCH_MAX:
+        return web.json_response({"error": f"Too many nicknames (max {CHECK_BATCH_MAX})"}, status=400)
+    
+    return web.json_response(
+        {nickname: allowlist.allowed(nickname, script_type) for nickname in nicknames},
+        headers={'Cache-Control': 'no-cache', 'X-Allowlist-Version': str(allowlist.version)}
+    )
+
+
+def build_check_delta(script_type, since, payload):
+    """
+    Serialize the change of a script's list since a version
+    
+    Args:
+        script_type: Script identifier
+        since: Version the client has
+        payload: Current CheckPayload of the script
         
-        for nickname, approved in res:
-            try:
-                # 1. Check old format (int 1)
-                if approved == 1 or approved == '1':
-                    allowed_users.append(nickname)
-                    continue
-                    
-                # 2. Check JSON format
-                if isinstance(approved, str):
-                    access = json.loads(approved)
-                elif isinstance(approved, dict):
-                    access = approved
-                else:
-                    continue
-                    
-                # Check specific script access
-                if isinstance(access, dict) and access.get(script_type):
-                    allowed_users.append(nickname)
-                    
-            except Exception:
-                continue
-                
-        return web.json_response(allowed_users)
-    except Exception as e:
-        return web.json_response({"error": str(e)}, status=500)
+    Returns:
+        tuple: (kind, body) where kind is "delta" or "full"
+    """
+    version = allowlist.version
+    delta = allowlist.delta(script_type, since)
+    if delta is not None:
+        added, removed = delta
+        body = json.dumps({"version": version, "added": added, "removed": removed}).encode()
+        if len(body) <= len(payload.body):
+            return "delta", body
+        # Otherwise it is cheaper to resend the list
+    return "full", b'{"version": %d, "full": %s}' % (version, payload.body)
+
+
+async def handle_check_watch(request):
+    """
+    Wait for allow-list changes: long-poll, or Server-Sent Events
+    
+    Query: script, since (defaults to the current version), timeout for
+    long-poll. SSE is used when the client accepts text/event-stream;
+    it resumes from the Last-Event-ID header after a reconnect.
+    """
+    if not await ensure_allowlist(request.app):
+        return web.json_response({"error": "DB Error"}, status=500)
+    
+    script_type = request.query.get('script', 'mine')
+    since = request.query.get('since') or request.headers.get('Last-Event-ID')
+    try:
+        since = int(since) if since else allowlist.version
+        timeout = float(request.query.get('timeout', CHECK_WATCH_TIMEOUT))
+    except ValueError:
+        return web.json_response({"error": "Invalid since or timeout"}, status=400)
+    # nan / inf would never let the long-poll deadline pass
+    if not math.isfinite(timeout):
+        return web.json_response({"error": "Invalid since or timeout"}, status=400)
+    timeout = min(max(timeout, 0.0), CHECK_WATCH_TIMEOUT)
+    
+    if 'text/event-stream' in request.headers.get('Accept', ''):
+        return await stream_check_events(request, script_type, since)
+    
+    # Long-poll: answer as soon as this script's list changes, or on timeout
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while True:
+        delta = allowlist.delta(script_type, since)
+        if delta is None or delta[0] or delta[1]:
+            break
+        remaining = deadline - loop.time()
+        if remaining <= 0 or not await allowlist.notifier.wait(remaining):
+            break
+    return check_delta_response(script_type, since, allowlist.payload(script_type))
+
+
+async def stream_check_events(request, script_type, since):
+    """
+    Stream changes of a script's list as Server-Sent Events
+    
+    Events: "delta" or "full" (same bodies as /check?since=), with the
+    allow-list version as the event id. A comment is sent every
+    CHECK_SSE_KEEPALIVE seconds so proxies keep the connection open.
+    """
+    response = web.StreamResponse(headers={
+        'Content-Type': 'text/event-stream',
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+    })
+    await response.prepare(request)
+    try:
+        while True:
+            if allowlist.delta(script_type, since) != ([], []):
+                version = allowlist.version
+                kind, body = build_check_delta(script_type, since, allowlist.payload(script_type))
+                await response.write(b'id: %d\nevent: %s\ndata: %s\n\n' % (version, kind.encode(), body))
+                since = version
+            if not await allowlist.notifier.wait(CHECK_SSE_KEEPALIVE):
+                if allowlist.notifier.closed:
+                    break
+                await response.write(b': keepalive\n\n')
+    except ConnectionResetError:
+        pass  # Client went away
+    return response
+
+
+async def handle_stats(request):
+    """Internal metrics: DB pool, per-query latency, query coalescing, outbound queue, batch loader, allow-lists"""
+    # Internals stay off the public port unless a token is configured
+    if not STATS_TOKEN:
+        return web.json_response({"error": "Not found"}, status=404)
+    if not hmac.compare_digest(request.query.get('token', '').encode(), STATS_TOKEN.encode()):
+        return web.json_response({"error": "Forbidden"}, status=403)
+    
+    return web.json_response({
+        "db_pool": get_pool_stats(),
+        "db_breaker": get_breaker_stats(),
+        "queries": get_query_stats(),
+        "singleflight": get_singleflight_stats(),
+        "outbound": outbound.stats(),
+        "undeliverable_chats": len(undeliverable_chats),
+        "profiles": profile_store.stats(),
+        "profile_resolver": profile_resolver.stats(),
+        "access_loader": dict(access_loader.stats),
+        "access_migration": dict(migration_stats),
+        "allowlist": {
+            "loaded": allowlist.loaded,
+            "version": allowlist.version,
+            "nicknames": len(allowlist),
+        },
+    })
 
 
 async def on_startup(app):
-    """Initialize database and start polling"""
+    """Initialize database, start the outbound scheduler, the broadcast worker and polling"""
     await init_db(app)
+    if check_db_ready():
+        await load_allowlists()
+    app['allowlist_refresh'] = asyncio.create_task(refresh_allowlists_loop())
+    app['profile_writer'] = asyncio.create_task(profile_writer_loop())
+    if CHECK_WORKERS > 0:
+        # /check worker processes read the allow-list from this file
+        app['snapshot_writer'] = asyncio.create_task(snapshot_writer_loop(CHECK_SNAPSHOT_PATH))
+    outbound.start()
+    # Runs stored broadcasts, resuming those interrupted by a restart
+    app['broadcast_worker'] = asyncio.create_task(broadcast_loop(app['bot']))
     dp = app['dp']
     asyncio.create_task(dp.start_polling())
+
+
+async def release_watchers(app):
+    """Let long-poll and SSE clients finish before the server stops"""
+    allowlist.notifier.close()
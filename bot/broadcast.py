@@ -0,0 +1,181 @@
+"""
+Broadcast worker module
+Runs persisted broadcast jobs in the background
+
+Jobs are created by the /broadcast flow (bot/handlers/admin.py) and
+stored in the database, so a restart resumes them from their cursor
+instead of starting over. Each chunk of recipients is queued at once in
+the bulk lane of the outbound scheduler; the admin's status message is
+edited with the progress at most every BROADCAST_PROGRESS_INTERVAL
+seconds.
+"""
+
+import asyncio
+import logging
+
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+
+from bot.config import BROADCAST_CHUNK, BROADCAST_PROGRESS_INTERVAL, BROADCAST_RETRY_INTERVAL
+from bot.database.broadcasts import (
+    get_running_broadcasts, get_broadcast_job, claim_broadcast_chunk, record_broadcast_results,
+    finish_broadcast_job
+)
+from bot.outbound import PRIORITY_BULK, PRIORITY_INTERACTIVE, set_outbound_priority, reset_outbound_priority
+
+logger = logging.getLogger(__name__)
+
+# Set by broadcast_loop(); notify_broadcast() wakes it up for a new job
+_wakeup = None
+
+
+def notify_broadcast():
+    """Tell the worker that a new job was stored"""
+    if _wakeup is not None:
+        _wakeup.set()
+
+
+def format_broadcast_status(job, finished):
+    """
+    Text of the admin's status message
+    
+    Args:
+        job: BroadcastJob
+        finished: True for the final report
+        
+    Returns:
+        str: HTML text
+    """
+    if finished:
+        text = (
+            f"✅ <b>Рассылка завершена!</b>\n"
+            f"🎯 Цель: {job.target}\n"
+            f"📤 Успешно: {job.sent}\n"
+            f"❌ Ошибок: {job.failed}"
+        )
+        if job.unconfirmed:
+            text += f"\n❔ Без подтверждения: {job.unconfirmed}"
+        return text
+    return (
+        f"⏳ <b>Идёт рассылка...</b>\n"
+        f"🎯 Цель: {job.target}\n"
+        f"📨 Обработано: {job.sent + job.failed} из {job.total}\n"
+        f"📤 Успешно: {job.sent}\n"
+        f"❌ Ошибок: {job.failed}"
+    )
+
+
+async def edit_broadcast_status(bot, job, finished=False):
+    """Update the admin's status message (ahead of the bulk sends)"""
+    token = set_outbound_priority(PRIORITY_INTERACTIVE)
+    try:
+        await bot.edit_message_text(
+            format_broadcast_status(job, finished),
+            chat_id=job.admin_chat_id,
+            message_id=job.status_message_id,
+            parse_mode="HTML"
+        )
+    except Exception as e:
+        logger.debug(f"Статус рассылки {job.job_id} не обновлён: {e}")
+    finally:
+        reset_outbound_priority(token)
+
+
+async def send_broadcast_message(bot, job, uid, markup):
+    """Send the job's message to one recipient"""
+    if job.photo:
+        await bot.send_photo(uid, job.photo, caption=job.text, parse_mode="HTML", reply_markup=markup)
+    elif job.document:
+        await bot.send_document(uid, job.document, caption=job.text, parse_mode="HTML", reply_markup=markup)
+    else:
+        await bot.send_message(uid, job.text, parse_mode="HTML", reply_markup=markup)
+
+
+async def run_broadcast_job(bot, job_id):
+    """
+    Send a job to its remaining recipients
+    
+    Stops early on a DB failure; the job stays running and is resumed
+    by broadcast_loop() later.
+    
+    Args:
+        bot: Bot instance
+        job_id: Job ID
+        
+    Returns:
+        bool: True if the job is finished
+    """
+    job = await get_broadcast_job(job_id)
+    if job is None:
+        return False
+    if job.cursor_seq:
+        logger.info(f"📢 Рассылка {job_id}: продолжение с позиции {job.cursor_seq} из {job.total}")
+    
+    markup = InlineKeyboardMarkup()
+    markup.add(InlineKeyboardButton("🏠 Главное меню", callback_data="menu_start"))
+    loop = asyncio.get_running_loop()
+    last_edit = loop.time()
+    
+    while True:
+        chunk = await claim_broadcast_chunk(job, BROADCAST_CHUNK)
+        if chunk is None:
+            logger.warning(f"📢 Рассылка {job_id} приостановлена: ошибка БД")
+            return False
+        if not chunk:
+            break
+        
+        sends = await asyncio.gather(
+            *(send_broadcast_message(bot, job, uid, markup) for _, uid in chunk),
+            return_exceptions=True
+        )
+        results = [
+            (seq, (str(result) or type(result).__name__) if isinstance(result, Exception) else None)
+            for (seq, _), result in zip(chunk, sends)
+        ]
+        if not await record_broadcast_results(job, results):
+            logger.warning(f"📢 Рассылка {job_id}: статусы {len(results)} получателей не сохранены")
+        
+        if loop.time() - last_edit >= BROADCAST_PROGRESS_INTERVAL:
+            last_edit = loop.time()
+            await edit_broadcast_status(bot, job)
+    
+    if not await finish_broadcast_job(job):
+        return False
+    logger.info(f"📢 Рассылка {job_id} завершена: {job.sent} успешно, {job.failed} ошибок")
+    await edit_broadcast_status(bot, job, finished=True)
+    return True
+
+
+async def stop_broadcast_worker(app):
+    """Stop the worker before the outbound scheduler (aiohttp on_shutdown)"""
+    task = app.get('broadcast_worker')
+    if task is not None:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+
+async def broadcast_loop(bot, interval=BROADCAST_RETRY_INTERVAL):
+    """
+    Run stored jobs one after another, forever
+    
+    Unfinished jobs are picked up at start (resume after a restart), when
+    a new job is stored, and every `interval` seconds.
+    
+    Args:
+        bot: Bot instance
+        interval: Seconds between checks when idle
+    """
+    global _wakeup
+    _wakeup = asyncio.Event()
+    set_outbound_priority(PRIORITY_BULK)  # Whole task: messages go after interactive replies
+    while True:
+        _wakeup.clear()
+        job_ids = await get_running_broadcasts()
+        for job_id in job_ids or ():
+            try:
+                await run_broadcast_job(bot, job_id)
+            except Exception as e:
+                logger.error(f"Ошибка рассылки {job_id}: {e}")
+        try:
+            await asyncio.wait_for(_wakeup.wait(), interval)
+        except asyncio.TimeoutError:
+            pass
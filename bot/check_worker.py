@@ -0,0 +1,214 @@
+"""
+/check worker module
+Separate HTTP processes that serve /check from the allow-list snapshot file
+
+Enabled with CHECK_WORKERS > 0. Workers share CHECK_WORKERS_PORT
+(SO_REUSEPORT), so client polling never runs on the bot's event loop.
+Workers are started with the spawn method (a fresh interpreter, no
+locks or threads inherited from the bot) and never touch the Telegram
+API or the database. A supervisor thread in the bot process starts a
+worker again when one exits. The snapshot file of an earlier run is
+removed before the first start, so workers answer 503 until this run's
+bot has loaded the allow-list and published it.
+"""
+
+import atexit
+import logging
+import multiprocessing
+import multiprocessing.connection
+import os
+import threading
+from aiohttp import web
+
+from bot.config import CHECK_BATCH_MAX, CHECK_SNAPSHOT_RECHECK, CHECK_WORKER_RESTART_DELAY
+from bot.httputil import etag_matches, accepts_gzip
+from bot.snapshot import SnapshotReader
+
+logger = logging.getLogger(__name__)
+
+_NOT_READY = {"error": "Snapshot not ready"}
+
+# Set at interpreter exit so the supervisor stops restarting workers
+_stopping = threading.Event()
+
+
+def create_worker_app(snapshot_path):
+    """
+    Create the web app of one worker process
+
+    Args:
+        snapshot_path: Snapshot file written by the bot process
+
+    Returns:
+        web.Application
+    """
+    app = web.Application()
+    app['snapshot'] = SnapshotReader(snapshot_path, CHECK_SNAPSHOT_RECHECK)
+    app.router.add_get('/check', handle_worker_check)
+    # Not under /check/: any segment there is a nickname (players named Watch, Batch, ...)
+    app.router.add_get('/check-batch', handle_worker_check_batch)
+    app.router.add_post('/check-batch', handle_worker_check_batch)
+    app.router.add_get('/check/{nickname}', handle_worker_check_nickname)
+    app.router.add_get('/', lambda r: web.Response(text="OK"))
+    return app
+
+
+async def handle_worker_check(request):
+    """Same response as the bot's /check, served from the mapped snapshot"""
+    snapshot = request.app['snapshot'].current()
+    if snapshot is None:
+        return web.json_response(_NOT_READY, status=503)
+
+    script_type = request.query.get('script', 'mine')
+    payload = snapshot.payload(script_type)
+    if payload is None:
+        etag, body, gzipped = '"empty"', b"[]", None
+    else:
+        etag, body, gzipped = payload
+    headers = {'Cache-Control': 'no-cache', 'X-Allowlist-Version': str(snapshot.version)}
+
+    # The snapshot has no change journal: delta clients get a full snapshot
+    if 'since' in request.query:
+        return web.Response(
+            body=b'{"version": %d, "full": %s}' % (snapshot.version, bytes(body)),
+            content_type="application/json",
+            headers=headers
+        )
+
+    headers['ETag'] = etag
+    headers['Vary'] = 'Accept-Encoding'
+    if etag_matches(request.headers.get('If-None-Match'), etag):
+        return web.Response(status=304, headers=headers)
+    if gzipped is not None and accepts_gzip(request.headers.get('Accept-Encoding')):
+        headers['Content-Encoding'] = 'gzip'
+        return web.Response(body=gzipped, content_type="application/json", headers=headers)
+    return web.Response(body=body, content_type="application/json", headers=headers)
+
+
+async def handle_worker_check_nickname(request):
+    """Check a single nickname: /check/{nickname}?script=X"""
+    snapshot = request.app['snapshot'].current()
+    if snapshot is None:
+        return web.json_response(_NOT_READY, status=503)
+
+    nickname = request.match_info['nickname']
+    script_type = request.query.get('script', 'mine')
+    return web.json_response(
+        {"nickname": nickname, "allowed": snapshot.allowed(nickname, script_type)},
+        headers={'Cache-Control': 'no-cache', 'X-Allowlist-Version': str(snapshot.version)}
+    )
+
+
+async def handle_worker_check_batch(request):
+    """Check several nicknames at once (GET ?nicknames=A,B or POST JSON array)"""
+    snapshot = request.app['snapshot'].current()
+    if snapshot is None:
+        return web.json_response(_NOT_READY, status=503)
+
+    script_type = request.query.get('script', 'mine')
+    if request.method == 'POST':
+        try:
+            nicknames = await request.json()
+        except ValueError:
+            return web.json_response({"error": "Invalid JSON"}, status=400)
+        if not isinstance(nicknames, list) or not all(isinstance(n, str) for n in nicknames):
+            return web.json_response({"error": "Expected a list of nicknames"}, status=400)
+    else:
+        nicknames = [n for n in request.query.get('nicknames', '').split(',') if n]
+
+    if len(nicknames) > CHECK_BATCH_MAX:
+        return web.json_response({"error": f"Too many nicknames (max {CHECK_BATCH_MAX})"}, status=400)
+
+    return web.json_response(
+        {nickname: snapshot.allowed(nickname, script_type) for nickname in nicknames},
+        headers={'Cache-Control': 'no-cache', 'X-Allowlist-Version': str(snapshot.version)}
+    )
+
+
+def run_worker(port, snapshot_path):
+    """
+    Entry point of a worker process
+
+    Args:
+        port: Shared HTTP port
+        snapshot_path: Snapshot file written by the bot process
+    """
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s'
+    )
+    web.run_app(create_worker_app(snapshot_path), port=port, reuse_port=True, print=None)
+
+
+def remove_stale_snapshot(snapshot_path):
+    """
+    Delete the snapshot file left by an earlier run
+
+    Args:
+        snapshot_path: Snapshot file path
+    """
+    try:
+        os.remove(snapshot_path)
+        logger.info(f"🗑 Удалён снапшот прошлого запуска: {snapshot_path}")
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.error(f"Не удалось удалить старый снапшот {snapshot_path}: {e}")
+
+
+def _start_worker(ctx, port, snapshot_path):
+    """Start one worker process"""
+    process = ctx.Process(target=run_worker, args=(port, snapshot_path), daemon=True)
+    process.start()
+    return process
+
+
+def _supervise(ctx, workers, port, snapshot_path):
+    """
+    Start workers again when they exit (supervisor thread of the bot process)
+
+    Args:
+        ctx: multiprocessing context
+        workers: List of worker processes, updated in place
+        port: Shared HTTP port
+        snapshot_path: Snapshot file written by the bot process
+    """
+    while not _stopping.is_set():
+        exited = multiprocessing.connection.wait([process.sentinel for process in workers], timeout=1.0)
+        if not exited or _stopping.is_set():
+            continue
+        for index, process in enumerate(workers):
+            if process.sentinel not in exited:
+                continue
+            process.join()
+            logger.warning(f"⚠️ Процесс /check {process.pid} завершился (код {process.exitcode}), перезапуск")
+            # Pause so a worker that dies at start (port taken, ...) does not restart in a loop
+            if _stopping.wait(CHECK_WORKER_RESTART_DELAY):
+                return
+            workers[index] = _start_worker(ctx, port, snapshot_path)
+
+
+def start_check_workers(count, port, snapshot_path):
+    """
+    Start /check worker processes and their supervisor
+
+    Args:
+        count: Number of processes
+        port: Shared HTTP port
+        snapshot_path: Snapshot file written by the bot process
+
+    Returns:
+        list: Running multiprocessing.Process objects (restarted ones replace exited ones)
+    """
+    remove_stale_snapshot(snapshot_path)
+    # Not fork: restarts happen from a thread of the running bot, and a fork there
+    # could copy a lock held by another thread (logging, SSL, ...) into the child
+    ctx = multiprocessing.get_context('spawn')
+    workers = [_start_worker(ctx, port, snapshot_path) for _ in range(count)]
+    # Runs before multiprocessing's own exit handler terminates the workers
+    atexit.register(_stopping.set)
+    threading.Thread(
+        target=_supervise, args=(ctx, workers, port, snapshot_path), name='check-supervisor', daemon=True
+    ).start()
+    logger.info(f"✅ Запущено {count} процессов /check на порту {port}")
+    return workers
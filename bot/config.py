@@ -5,6 +5,7 @@ Loads and manages all environment variables and settings
 
 import os
 import ssl
+import tempfile
 from dotenv import load_dotenv
 
 # Auto-detect OS
@@ -49,8 +50,40 @@ if IS_WINDOWS:
         ssl_ctx.check_hostname = False
         ssl_ctx.verify_mode = ssl.CERT_NONE
 else:
-    # Linux/Deploy: Use system default SSL (usually True works for TiDB)
-    ssl_ctx = True
+    # Linux/Deploy: system CA store. One context is shared by all pool
+    # connections (ssl=True would build a new one, re-reading the CA store,
+    # on every connect).
+    ssl_ctx = ssl.create_default_context()
+
+# --- DATABASE POOL SETTINGS ---
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", 1))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", 2))  # Important for TiDB Serverless!
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 300))  # Replace connections every 5 minutes (in the background)
+DB_POOL_KEEPALIVE = int(os.getenv("DB_POOL_KEEPALIVE", 60))  # Ping idle connections / rotate old ones this often
+DB_CONNECT_TIMEOUT = int(os.getenv("DB_CONNECT_TIMEOUT", 10))
+DB_ACQUIRE_TIMEOUT = float(os.getenv("DB_ACQUIRE_TIMEOUT", 10))  # Max wait for a free connection (see deadlines below)
+# Adaptive mode: grow up to DB_POOL_ADAPTIVE_MAX while queries queue, shrink back to DB_POOL_MIN when idle
+DB_POOL_ADAPTIVE = os.getenv("DB_POOL_ADAPTIVE", "0").lower() in ("1", "true", "yes")
+DB_POOL_ADAPTIVE_MAX = int(os.getenv("DB_POOL_ADAPTIVE_MAX", 4))
+DB_POOL_ADAPT_INTERVAL = 5  # Seconds between resize decisions
+DB_POOL_SHRINK_AFTER = 12  # Quiet intervals (1 minute) before a connection is given back
+DB_POOL_LIMIT_MAX = max(DB_POOL_MAX, DB_POOL_ADAPTIVE_MAX) if DB_POOL_ADAPTIVE else DB_POOL_MAX
+# Circuit breaker: after this many connection failures in a row, DB calls fail fast
+DB_BREAKER_THRESHOLD = int(os.getenv("DB_BREAKER_THRESHOLD", 5))
+DB_BREAKER_RESET = float(os.getenv("DB_BREAKER_RESET", 10))  # Seconds before a probe query is let through
+DB_RETRY_MAX_DELAY = 2.0  # Cap of the jittered retry delay (seconds)
+# Deadlines: one query attempt, and all DB calls of one Telegram update together.
+# DB_QUERY_TIMEOUT starts once a connection is held; the wait for it is bounded by
+# DB_ACQUIRE_TIMEOUT, so one attempt takes at most their sum. Inside an update both
+# are cut to what is left of DB_UPDATE_BUDGET.
+DB_QUERY_TIMEOUT = float(os.getenv("DB_QUERY_TIMEOUT", 5))
+DB_UPDATE_BUDGET = float(os.getenv("DB_UPDATE_BUDGET", 8))
+# Server-side backstop for SELECTs the client gave up on (closing the socket does not stop them)
+DB_SERVER_QUERY_LIMIT_MS = 30000
+# Query statistics: calls slower than this (retries included) go to the slow-query log
+DB_SLOW_QUERY_MS = float(os.getenv("DB_SLOW_QUERY_MS", 500))
+DB_SLOW_QUERY_LOG = os.getenv("DB_SLOW_QUERY_LOG")  # Optional file for the slow-query log
+DB_QUERY_STATS_MAX = 200  # Distinct query labels tracked; the rest are counted together
 
 # --- DATABASE CONFIGURATION ---
 DB_CONFIG = {
@@ -61,12 +94,70 @@ DB_CONFIG = {
     'db': TIDB_DB_NAME,
     'autocommit': True,
     'ssl': ssl_ctx,
-    'pool_recycle': 300,  # Refresh connection every 5 minutes
-    'connect_timeout': 10,
-    'minsize': 1,
-    'maxsize': 2  # Important for TiDB Serverless!
+    'connect_timeout': DB_CONNECT_TIMEOUT,
+    'init_command': f"SET SESSION max_execution_time = {DB_SERVER_QUERY_LIMIT_MS}"
 }
 
+# --- METRICS ---
+STATS_TOKEN = os.getenv("STATS_TOKEN")  # /stats requires ?token=; unset = /stats disabled (404)
+
+# --- OUTBOUND MESSAGES ---
+# Telegram limits: ~30 messages/s per bot, ~1 message/s per chat
+OUTBOUND_GLOBAL_RATE = float(os.getenv("OUTBOUND_GLOBAL_RATE", 30))
+OUTBOUND_CHAT_RATE = float(os.getenv("OUTBOUND_CHAT_RATE", 1))
+OUTBOUND_CHAT_BURST = 3  # Quick back-to-back replies to one chat before pacing kicks in
+OUTBOUND_WORKERS = int(os.getenv("OUTBOUND_WORKERS", 8))  # Requests in flight at once
+OUTBOUND_MAX_RETRIES = 5  # RetryAfter answers tolerated per message
+
+# --- BROADCASTS ---
+BROADCAST_CHUNK = 100  # Recipients claimed (and their statuses saved) at a time
+BROADCAST_PROGRESS_INTERVAL = 5  # Min seconds between edits of the progress message
+BROADCAST_RETRY_INTERVAL = 30  # Seconds before unfinished jobs are picked up again after a DB error
+
+# --- USER PROFILES ---
+PROFILE_CACHE_MAX = 10000  # Usernames / names kept in memory for admin listings
+PROFILE_FLUSH_INTERVAL = 5  # Seconds between write-behind batches of captured profiles
+PROFILE_FLUSH_BATCH = 200  # Profiles per INSERT
+
+# --- USERNAME RESOLVER ---
+# get_chat lookups for users without a captured profile
+RESOLVER_CONCURRENCY = 10  # get_chat calls in flight at once
+RESOLVER_TTL = 3600  # Keep resolved profiles for an hour
+RESOLVER_NEGATIVE_TTL = 600  # Retry users get_chat failed for after 10 minutes
+RESOLVER_CACHE_MAX = 5000
+RESOLVER_LISTING_BUDGET = 1.0  # Seconds a listing waits for lookups; the rest show the bare ID
+
 # --- ACCESS CACHE SETTINGS ---
 ACCESS_CACHE_TTL = 300  # 5 minutes
 ACCESS_CACHE_MAX = 5000
+
+# Users without access (unregistered / pending) are cached separately
+ACCESS_NEGATIVE_CACHE_TTL = 30  # Short, so new approvals from other paths show up fast
+ACCESS_NEGATIVE_CACHE_MAX = 5000
+
+# --- ACCESS BATCH LOADER SETTINGS ---
+ACCESS_BATCH_WINDOW = 0.005  # Collect user IDs of updates arriving within 5 ms
+ACCESS_BATCH_MAX = 100  # Flush earlier when this many user IDs are waiting
+
+# --- ACCESS MASK MIGRATION SETTINGS ---
+ACCESS_MIGRATION_BATCH = 500  # Rows converted per batch
+ACCESS_MIGRATION_PAUSE = 0.2  # Seconds between batches, keeps the small pool free for handlers
+
+# --- /CHECK ALLOW-LIST SETTINGS ---
+ALLOWLIST_REFRESH_INTERVAL = 300  # Full rebuild to pick up changes made outside the bot
+ALLOWLIST_JOURNAL_MAX = 2000  # Changes kept for ?since= delta sync; older clients get a full snapshot
+
+# --- /CHECK SUB-ENDPOINT SETTINGS ---
+CHECK_WATCH_TIMEOUT = 25  # Max seconds a long-poll request is held open
+CHECK_SSE_KEEPALIVE = 15  # Seconds between SSE keepalive comments
+CHECK_BATCH_MAX = 100  # Nicknames per /check-batch request
+
+# --- /CHECK WORKER PROCESSES ---
+# 0 = /check is served by the bot process only
+CHECK_WORKERS = int(os.getenv("CHECK_WORKERS", 0))
+CHECK_WORKERS_PORT = int(os.getenv("CHECK_WORKERS_PORT", 8081))
+CHECK_SNAPSHOT_PATH = os.getenv(
+    "CHECK_SNAPSHOT_PATH", os.path.join(tempfile.gettempdir(), "podzemka_allowlist.snapshot")
+)
+CHECK_SNAPSHOT_RECHECK = 0.5  # Seconds between snapshot file stat() calls in a worker
+CHECK_WORKER_RESTART_DELAY = 1.0  # Seconds before a worker process that exited is started again
@@ -3,7 +3,7 @@ Database package
 Handles all database operations and connections
 """
 
-from .connection import init_db, close_db, check_db_ready, db_execute_with_retry, db_fetch_with_retry
+from .connection import init_db, close_db, check_db_ready, db_execute_with_retry, db_fetch_with_retry, unit_of_work
 from .queries import *
 
 __all__ = [
@@ -12,4 +12,5 @@ __all__ = [
     'check_db_ready',
     'db_execute_with_retry',
     'db_fetch_with_retry',
+    'unit_of_work',
 ]
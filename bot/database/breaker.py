@@ -0,0 +1,122 @@
+"""
+Circuit breaker module
+Fail fast while the database is down instead of piling up retries
+"""
+
+import logging
+import random
+import time
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker
+
+    closed: calls go through; `failure_threshold` failures in a row open it.
+    open: calls are rejected without touching the database for
+        `reset_timeout` seconds, then the breaker becomes half-open.
+    half_open: a single probe call goes through (others are rejected).
+        Success closes the breaker, failure opens it again. A probe that
+        never reports back (e.g. a cancelled handler) is replaced after
+        another reset_timeout.
+    """
+
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0  # Consecutive failures
+        self._opened_at = 0.0
+        self._probe_started = None
+        self.counters = {
+            'opened': 0,
+            'rejected': 0,  # Calls failed fast while open
+            'probes': 0,
+        }
+
+    def allow(self):
+        """
+        Check whether a call may go to the database
+
+        Returns:
+            bool: False if the call must fail fast
+        """
+        if self.state == CLOSED:
+            return True
+        now = time.monotonic()
+        if self.state == OPEN:
+            if now - self._opened_at < self.reset_timeout:
+                self.counters['rejected'] += 1
+                return False
+            self.state = HALF_OPEN
+            self._probe_started = None
+        if self._probe_started is not None and now - self._probe_started < self.reset_timeout:
+            self.counters['rejected'] += 1
+            return False
+        self._probe_started = now
+        self.counters['probes'] += 1
+        return True
+
+    def record_success(self):
+        """Report a call that reached the database"""
+        if self.state != CLOSED:
+            logger.info("✅ БД снова доступна, запросы возобновлены")
+        self.state = CLOSED
+        self.failures = 0
+        self._probe_started = None
+
+    def record_failure(self):
+        """Report a call that failed because the database is unreachable"""
+        self.failures += 1
+        if self.state == HALF_OPEN or (self.state == CLOSED and self.failures >= self.failure_threshold):
+            self.state = OPEN
+            self._opened_at = time.monotonic()
+            self._probe_started = None
+            self.counters['opened'] += 1
+            logger.error(
+                f"⛔ БД недоступна ({self.failures} ошибок подряд), "
+                f"запросы отклоняются {self.reset_timeout} сек."
+            )
+
+    @property
+    def is_open(self):
+        """True while calls are being rejected"""
+        return self.state != CLOSED
+
+    def stats(self):
+        """
+        Get breaker state
+
+        Returns:
+            dict: State, consecutive failures, seconds until the next probe and counters
+        """
+        retry_in = 0.0
+        if self.state == OPEN:
+            retry_in = max(0.0, self.reset_timeout - (time.monotonic() - self._opened_at))
+        return {
+            'state': self.state,
+            'failures': self.failures,
+            'retry_in': round(retry_in, 1),
+            'counters': dict(self.counters),
+        }
+
+
+def backoff_delay(base, attempt, cap):
+    """
+    Full-jitter exponential backoff
+
+    Args:
+        base: Delay of the first retry (seconds)
+        attempt: Number of the attempt that just failed (1-based)
+        cap: Upper bound of the delay
+
+    Returns:
+        float: Random delay in [0, min(cap, base * 2 ** (attempt - 1))]
+    """
+    return random.uniform(0, min(cap, base * 2 ** (attempt - 1)))
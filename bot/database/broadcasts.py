@@ -0,0 +1,230 @@
+"""
+Broadcast jobs module
+Persistent broadcast jobs: audience snapshot, cursor and delivery status
+"""
+
+import logging
+
+from bot.models.records import BroadcastJob
+from .connection import check_db_ready, db_execute_with_retry, db_fetch_with_retry, unit_of_work
+from .deliverability import AUDIENCE_QUERY
+
+logger = logging.getLogger(__name__)
+
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+
+RECIPIENT_PENDING = 0
+RECIPIENT_SENT = 1
+RECIPIENT_FAILED = 2
+
+# Rows per multi-row INSERT of an explicit recipient list
+_INSERT_CHUNK = 500
+
+
+async def create_broadcast_job(target, text, photo, document, admin_chat_id, status_message_id, recipients=None):
+    """
+    Store a broadcast job with a snapshot of its audience
+    
+    The job and its recipients are written in one transaction, so the
+    worker never sees a job with a partial audience.
+    
+    Args:
+        target: "all" or "select"
+        text: Message text or caption
+        photo: Photo file_id or None
+        document: Document file_id or None
+        admin_chat_id: Chat of the status message
+        status_message_id: Message edited with the progress
+        recipients: List of user IDs, or None for the whole audience (AUDIENCE_QUERY)
+        
+    Returns:
+        tuple: (job_id, total); (None, 0) if there is nobody to send to; None on DB failure
+    """
+    if not check_db_ready():
+        return None
+    async with unit_of_work(transaction=True) as uow:
+        job_id = await uow.fetch(
+            "INSERT INTO broadcast_jobs (status, target, text, photo, document, admin_chat_id, status_message_id) "
+            "VALUES (%s, %s, %s, %s, %s, %s, %s)",
+            (JOB_RUNNING, target, text, photo, document, admin_chat_id, status_message_id),
+            fetch="lastrowid",
+            action_desc="Ошибка создания рассылки"
+        )
+        if recipients is None:
+            # Snapshot taken by the server, the IDs never travel to the bot
+            await uow.execute(
+                "INSERT INTO broadcast_recipients (job_id, seq, tg_user_id) "
+                "SELECT %s, ROW_NUMBER() OVER (ORDER BY audience.tg_user_id), audience.tg_user_id "
+                f"FROM ({AUDIENCE_QUERY}) audience",
+                (job_id,),
+                action_desc="Ошибка записи получателей рассылки"
+            )
+        else:
+            for start in range(0, len(recipients), _INSERT_CHUNK):
+                chunk = recipients[start:start + _INSERT_CHUNK]
+                params = []
+                for seq, uid in enumerate(chunk, start + 1):
+                    params.extend((job_id, seq, uid))
+                await uow.execute(
+                    "INSERT INTO broadcast_recipients (job_id, seq, tg_user_id) VALUES "
+                    + ", ".join(["(%s, %s, %s)"] * len(chunk)),
+                    tuple(params),
+                    action_desc="Ошибка записи получателей рассылки"
+                )
+        row = await uow.fetch(
+            "SELECT COUNT(*) FROM broadcast_recipients WHERE job_id = %s",
+            (job_id,),
+            fetch="one",
+            action_desc="Ошибка подсчёта получателей рассылки"
+        )
+        if uow.failed:
+            return None
+        total = row[0] if row else 0
+        if not total:
+            return None, 0  # Rolled back on exit
+        await uow.execute(
+            "UPDATE broadcast_jobs SET total = %s WHERE id = %s",
+            (total, job_id),
+            action_desc="Ошибка создания рассылки"
+        )
+        if not await uow.commit():
+            return None
+    return job_id, total
+
+
+async def get_running_broadcasts():
+    """
+    Get jobs that are not finished (new ones and those interrupted by a restart)
+    
+    Returns:
+        list: Job IDs, oldest first, or None on DB failure
+    """
+    rows = await db_fetch_with_retry(
+        "SELECT id FROM broadcast_jobs WHERE status = %s ORDER BY id",
+        (JOB_RUNNING,),
+        fetch="all",
+        action_desc="Ошибка чтения активных рассылок"
+    )
+    if rows is None:
+        return None
+    return [row[0] for row in rows]
+
+
+async def get_broadcast_job(job_id):
+    """
+    Load a broadcast job
+    
+    Args:
+        job_id: Job ID
+        
+    Returns:
+        BroadcastJob or None if missing / on DB failure
+    """
+    row = await db_fetch_with_retry(
+        "SELECT id, target, text, photo, document, admin_chat_id, status_message_id, "
+        "total, sent, failed, cursor_seq FROM broadcast_jobs WHERE id = %s",
+        (job_id,),
+        fetch="one",
+        action_desc="Ошибка чтения рассылки"
+    )
+    if not row:
+        return None
+    return BroadcastJob(*row)
+
+
+async def claim_broadcast_chunk(job, limit):
+    """
+    Take the next recipients of a job and move its cursor past them
+    
+    The cursor is saved before anything is sent: after a restart the
+    chunk is not sent again (at most once), its recipients just stay
+    without a recorded result.
+    
+    Args:
+        job: BroadcastJob (cursor_seq is advanced in place)
+        limit: Recipients per chunk
+        
+    Returns:
+        list: (seq, tg_user_id) tuples, empty when the job is through; None on DB failure
+    """
+    async with unit_of_work() as uow:
+        rows = await uow.fetch(
+            "SELECT seq, tg_user_id FROM broadcast_recipients WHERE job_id = %s AND seq > %s ORDER BY seq LIMIT %s",
+            (job.job_id, job.cursor_seq, limit),
+            fetch="all",
+            action_desc="Ошибка чтения получателей рассылки"
+        )
+        if not rows:
+            return None if rows is None else []
+        if not await uow.execute(
+            "UPDATE broadcast_jobs SET cursor_seq = %s WHERE id = %s",
+            (rows[-1][0], job.job_id),
+            action_desc="Ошибка сохранения позиции рассылки"
+        ):
+            return None
+    job.cursor_seq = rows[-1][0]
+    return list(rows)
+
+
+async def record_broadcast_results(job, results):
+    """
+    Save the delivery status of a sent chunk and add it to the job counters
+    
+    Args:
+        job: BroadcastJob (counters are updated in place on success)
+        results: List of (seq, error) tuples, error is None for delivered messages
+        
+    Returns:
+        bool: True if saved
+    """
+    if not results:
+        return True
+    status_cases = []
+    error_cases = []
+    status_params = []
+    error_params = []
+    for seq, error in results:
+        status_cases.append("WHEN %s THEN %s")
+        status_params.extend((seq, RECIPIENT_SENT if error is None else RECIPIENT_FAILED))
+        error_cases.append("WHEN %s THEN %s")
+        error_params.extend((seq, error[:255] if error else None))
+    seqs = [seq for seq, _ in results]
+    failed = sum(1 for _, error in results if error is not None)
+    sent = len(results) - failed
+    
+    async with unit_of_work(transaction=True) as uow:
+        await uow.execute(
+            f"UPDATE broadcast_recipients SET status = CASE seq {' '.join(status_cases)} END, "
+            f"error = CASE seq {' '.join(error_cases)} END "
+            f"WHERE job_id = %s AND seq IN ({', '.join(['%s'] * len(seqs))})",
+            tuple(status_params + error_params + [job.job_id] + seqs),
+            action_desc="Ошибка записи статусов рассылки"
+        )
+        await uow.execute(
+            "UPDATE broadcast_jobs SET sent = sent + %s, failed = failed + %s WHERE id = %s",
+            (sent, failed, job.job_id),
+            action_desc="Ошибка записи статусов рассылки"
+        )
+        if not await uow.commit():
+            return False
+    job.sent += sent
+    job.failed += failed
+    return True
+
+
+async def finish_broadcast_job(job):
+    """
+    Mark a job as done
+    
+    Args:
+        job: BroadcastJob
+        
+    Returns:
+        bool: True if saved
+    """
+    return await db_execute_with_retry(
+        "UPDATE broadcast_jobs SET status = %s, finished_at = CURRENT_TIMESTAMP WHERE id = %s",
+        (JOB_DONE, job.job_id),
+        action_desc="Ошибка завершения рассылки"
+    )
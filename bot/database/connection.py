@@ -6,13 +6,28 @@ Manages database pool, connections, and retry logic
 import logging
 import asyncio
 import aiomysql
-from bot.config import DB_CONFIG
+from functools import partial
+from bot.config import (
+    DB_CONFIG, DB_POOL_MAX, DB_POOL_MIN, DB_POOL_LIMIT_MAX, DB_POOL_RECYCLE, DB_POOL_KEEPALIVE,
+    DB_ACQUIRE_TIMEOUT, DB_POOL_ADAPTIVE, DB_POOL_ADAPT_INTERVAL, DB_POOL_SHRINK_AFTER,
+    DB_BREAKER_THRESHOLD, DB_BREAKER_RESET, DB_RETRY_MAX_DELAY, DB_QUERY_TIMEOUT
+)
+from .pool import InstrumentedPool, PoolTimeoutError, adapt_pool_loop, keepalive_pool_loop
+from .breaker import CircuitBreaker, backoff_delay
+from .deadline import budget_remaining
+from .querystats import record_query, normalize_query
 
 logger = logging.getLogger(__name__)
 
 # Global reference to the web app (set by app.py)
 _app = None
 
+# action_desc of calls that did not pass one (their stats are labelled by the query)
+_DEFAULT_ACTION = "операция БД"
+
+# Shared by all DB helpers: opens after consecutive connection-level failures
+db_breaker = CircuitBreaker(DB_BREAKER_THRESHOLD, DB_BREAKER_RESET)
+
 
 def set_app(app):
     """Set the global app reference"""
@@ -35,11 +50,42 @@ async def init_db(app):
     
     logger.info(f"🔄 Подключение к TiDB...")
     try:
-        pool = await aiomysql.create_pool(**DB_CONFIG)
+        pool = InstrumentedPool(
+            partial(aiomysql.connect, **DB_CONFIG),
+            limit=DB_POOL_MAX,
+            min_limit=DB_POOL_MIN,
+            max_limit=DB_POOL_LIMIT_MAX,
+            acquire_timeout=DB_ACQUIRE_TIMEOUT,
+            max_lifetime=DB_POOL_RECYCLE,
+            adaptive=DB_POOL_ADAPTIVE
+        )
+        # Open the first connections now, so no handler waits for a handshake
+        await pool.prewarm()
         app['db_pool'] = pool
+        app['db_pool_keepalive'] = asyncio.create_task(keepalive_pool_loop(pool, DB_POOL_KEEPALIVE))
+        if DB_POOL_ADAPTIVE:
+            app['db_pool_adapt'] = asyncio.create_task(
+                adapt_pool_loop(pool, DB_POOL_ADAPT_INTERVAL, DB_POOL_SHRINK_AFTER)
+            )
         
         # Import cache functions here to avoid circular import
-        from bot.models.cache import banned_cache, access_cache_set
+        from bot.models.cache import banned_cache, access_cache_set, undeliverable_chats
+        from bot.models.access import mask_to_access
+        from .migrations import (
+            ensure_access_mask_column, migrate_access_masks, ensure_broadcast_tables, ensure_undeliverable_chats_table,
+            ensure_user_profiles_table
+        )
+        from .deliverability import load_undeliverable_chats
+        
+        # Normalized access column; old rows are converted in the background
+        if await ensure_access_mask_column():
+            app['access_migration'] = asyncio.create_task(migrate_access_masks())
+        await ensure_broadcast_tables()
+        await ensure_user_profiles_table()
+        
+        # Chats that blocked the bot etc. (skipped by sends and broadcasts)
+        if await ensure_undeliverable_chats_table():
+            undeliverable_chats.update(await load_undeliverable_chats() or {})
         
         # Load banned users into cache
         result = await db_fetch_with_retry(
@@ -53,86 +99,416 @@ async def init_db(app):
 
         # Load approved users into access cache
         approved = await db_fetch_with_retry(
-            "SELECT tg_user_id, nickname FROM access_list WHERE approved = 1 AND tg_user_id IS NOT NULL",
+            "SELECT tg_user_id, nickname, access_mask FROM access_list WHERE access_mask > 0 AND tg_user_id IS NOT NULL",
             fetch="all",
             action_desc="Загрузка доступа"
         )
         if approved:
-            for uid, nick in approved:
-                access_cache_set(uid, nick)
+            for uid, nick, mask in approved:
+                access_cache_set(uid, nick, mask_to_access(mask))
                     
         logger.info(f"✅ УСПЕХ: БД подключена. В бане: {len(banned_cache)} чел.")
     except Exception as e:
         logger.error(f"❌ Ошибка БД: {str(e)}")
 
 
+def get_pool_stats():
+    """
+    Get DB pool metrics
+    
+    Returns:
+        dict: Pool sizes, counters and histograms, or None if the pool is not ready
+    """
+    if not check_db_ready():
+        return None
+    return _app['db_pool'].stats()
+
+
+def get_breaker_stats():
+    """
+    Get DB circuit breaker state
+    
+    Returns:
+        dict: State, consecutive failures, time to the next probe and counters
+    """
+    return db_breaker.stats()
+
+
 async def close_db(app):
     """Close database connection pool"""
+    # Stop background tasks that use the pool
+    for key in ('access_migration', 'allowlist_refresh', 'db_pool_adapt', 'db_pool_keepalive'):
+        task = app.get(key)
+        if task is not None:
+            task.cancel()
     if 'db_pool' in app:
         app['db_pool'].close()
         await app['db_pool'].wait_closed()
 
 
-async def db_execute_with_retry(query, params=None, attempts=3, delay=0.5, action_desc="операция БД"):
+def _is_outage(error):
+    """
+    Check whether an error means the database is unreachable or overloaded
+    
+    Errors the server answered with (syntax, duplicate key, deadlock - MySQL
+    codes 1000-1999) prove it is up and do not trip the circuit breaker.
+    Neither does a timeout waiting for a pooled connection (PoolTimeoutError):
+    that is local load, not a database failure.
+    """
+    if isinstance(error, PoolTimeoutError):
+        return False
+    if isinstance(error, (asyncio.TimeoutError, OSError, aiomysql.InterfaceError)):
+        return True
+    if isinstance(error, aiomysql.OperationalError):
+        code = error.args[0] if error.args and isinstance(error.args[0], int) else 0
+        return not 1000 <= code < 2000
+    return False
+
+
+def _record_result(error):
+    """Feed the outcome of one attempt to the circuit breaker"""
+    if isinstance(error, PoolTimeoutError):
+        return  # The attempt never reached the database: says nothing about its health
+    if error is None or not _is_outage(error):
+        db_breaker.record_success()
+    else:
+        db_breaker.record_failure()
+
+
+def _attempt_timeout(timeout):
+    """
+    Deadline of a statement: the per-call timeout, cut to the update's budget
+    
+    Returns:
+        float: Seconds; zero or negative if the budget is spent
+    """
+    remaining = budget_remaining()
+    timeout = timeout or DB_QUERY_TIMEOUT
+    return timeout if remaining is None else min(timeout, remaining)
+
+
+def _statement_timeout(timeout):
+    """
+    Deadline of a statement whose connection was just acquired
+    
+    Raises:
+        PoolTimeoutError: If the update's budget ran out while waiting for the connection
+    """
+    deadline = _attempt_timeout(timeout)
+    if deadline <= 0:
+        raise PoolTimeoutError("DB budget spent waiting for a connection")
+    return deadline
+
+
+def _can_retry(pause):
+    """Check that a retry after `pause` seconds still fits in the update's budget"""
+    remaining = budget_remaining()
+    return remaining is None or pause < remaining
+
+
+async def _run_query(query, params, fetch, timeout):
+    """
+    Run one query on a pooled connection
+    
+    The wait for a connection is bounded by DB_ACQUIRE_TIMEOUT (and the
+    update's budget) and ends with PoolTimeoutError. The query deadline
+    starts once the connection is held and ends with asyncio.TimeoutError,
+    after which the pool closes the connection instead of reusing it.
+    
+    Args:
+        fetch: None to only execute, "one" or "all" to return rows
+        timeout: Statement deadline (seconds, None for DB_QUERY_TIMEOUT)
+    """
+    async with _app['db_pool'].acquire(timeout=budget_remaining()) as conn:
+        return await asyncio.wait_for(_execute(conn, query, params, fetch), _statement_timeout(timeout))
+
+
+async def _execute(conn, query, params, fetch):
+    """Execute a statement on a connection and read its result"""
+    async with conn.cursor() as cur:
+        await cur.execute(query, params or ())
+        return await _fetch_rows(cur, fetch)
+
+
+async def _fetch_rows(cur, fetch):
+    """Read the result of an executed statement ("one", "all", "lastrowid" or None for nothing)"""
+    if fetch == "one":
+        return await cur.fetchone()
+    if fetch == "lastrowid":
+        return cur.lastrowid
+    if fetch is not None:
+        return await cur.fetchall()
+    return None
+
+
+async def _retry_loop(run, attempts, delay, action_desc, timeout):
+    """
+    Attempts of one DB call: breaker, deadline, budget and backoff
+    
+    Args:
+        run: Function taking the statement timeout and returning a coroutine for one attempt
+        
+    Returns:
+        tuple: (success, rows, attempts made)
+    """
+    for attempt in range(1, attempts + 1):
+        if not db_breaker.allow():
+            logger.warning(f"{action_desc}: БД недоступна, запрос отклонён")
+            return False, None, attempt - 1
+        deadline = _attempt_timeout(timeout)
+        if deadline <= 0:
+            logger.warning(f"{action_desc}: время на запросы к БД исчерпано")
+            return False, None, attempt - 1
+        try:
+            rows = await run(timeout)
+            _record_result(None)
+            return True, rows, attempt
+        except Exception as e:
+            _record_result(e)
+            if isinstance(e, PoolTimeoutError):
+                logger.error(f"{action_desc}: попытка {attempt} - нет свободного соединения в пуле ({e})")
+            elif isinstance(e, asyncio.TimeoutError):
+                logger.error(f"{action_desc}: попытка {attempt} прервана по таймауту ({deadline:.1f} сек.)")
+            else:
+                logger.error(f"{action_desc}: попытка {attempt} неудачна: {e}")
+            if attempt < attempts and not db_breaker.is_open:
+                pause = backoff_delay(delay, attempt, DB_RETRY_MAX_DELAY)
+                if not _can_retry(pause):
+                    return False, None, attempt
+                await asyncio.sleep(pause)
+    return False, None, attempts
+
+
+async def _query_with_retry(query, params, fetch, run, attempts, delay, action_desc, timeout):
+    """
+    Retry loop shared by the DB helpers and UnitOfWork, with per-query statistics
+    
+    The call is accounted under its action_desc (or the query itself when
+    the default description is used).
+    
+    Args:
+        run: Function returning a new coroutine for one attempt
+        
+    Returns:
+        tuple: (success, rows)
+    """
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    ok, rows, made = await _retry_loop(run, attempts, delay, action_desc, timeout)
+    if fetch == "all":
+        count = len(rows) if rows else 0
+    elif fetch == "one":
+        count = 1 if rows else 0
+    else:
+        count = 0
+    label = action_desc if action_desc != _DEFAULT_ACTION else normalize_query(query, 60)
+    record_query(label, query, params, (loop.time() - started) * 1000, made, count, ok)
+    return ok, rows
+
+
+async def db_execute_with_retry(query, params=None, attempts=3, delay=0.5, action_desc="операция БД",
+                                timeout=None):
     """
     Execute a database query with retry logic
     
+    Fails fast while the circuit breaker is open. Retries wait a jittered,
+    exponentially growing delay. Every attempt waits at most DB_ACQUIRE_TIMEOUT
+    for a pooled connection, then the statement is cancelled after `timeout`
+    seconds; no attempt starts once the update's DB budget is spent.
+    
     Args:
         query: SQL query string
         params: Query parameters tuple
         attempts: Number of retry attempts
-        delay: Delay between retries (seconds)
+        delay: Base delay between retries (seconds)
         action_desc: Description for logging
+        timeout: Statement deadline (seconds, default DB_QUERY_TIMEOUT)
         
     Returns:
         bool: True if successful, False otherwise
     """
     if not check_db_ready():
         return False
-        
-    for attempt in range(1, attempts + 1):
-        try:
-            pool = _app['db_pool']
-            async with pool.acquire() as conn:
-                async with conn.cursor() as cur:
-                    await cur.execute(query, params or ())
-            return True
-        except Exception as e:
-            logger.error(f"{action_desc}: попытка {attempt} неудачна: {e}")
-            if attempt < attempts:
-                await asyncio.sleep(delay * attempt)
-    return False
+    ok, _ = await _query_with_retry(
+        query, params, None, lambda timeout: _run_query(query, params, None, timeout), attempts, delay, action_desc, timeout
+    )
+    return ok
 
 
-async def db_fetch_with_retry(query, params=None, fetch="all", attempts=3, delay=0.5, action_desc="операция БД"):
+async def db_fetch_with_retry(query, params=None, fetch="all", attempts=3, delay=0.5, action_desc="операция БД",
+                              timeout=None):
     """
     Fetch data from database with retry logic
     
+    Fails fast while the circuit breaker is open. Retries wait a jittered,
+    exponentially growing delay. Every attempt waits at most DB_ACQUIRE_TIMEOUT
+    for a pooled connection, then the statement is cancelled after `timeout`
+    seconds; no attempt starts once the update's DB budget is spent.
+    
     Args:
         query: SQL query string
         params: Query parameters tuple
-        fetch: "all" or "one" - fetch all rows or just one
+        fetch: "all" or "one" - fetch all rows or just one; "lastrowid" - the
+            statement's LAST_INSERT_ID (also set by LAST_INSERT_ID(expr) in an UPDATE)
         attempts: Number of retry attempts
-        delay: Delay between retries (seconds)
+        delay: Base delay between retries (seconds)
         action_desc: Description for logging
+        timeout: Statement deadline (seconds, default DB_QUERY_TIMEOUT)
         
     Returns:
         Query results or None if failed
     """
     if not check_db_ready():
         return None
+    _, rows = await _query_with_retry(
+        query, params, fetch, lambda timeout: _run_query(query, params, fetch, timeout), attempts, delay, action_desc, timeout
+    )
+    return rows
+
+
+class UnitOfWork:
+    """
+    Several statements of one handler on a single pooled connection
+    
+    The connection is acquired by the first statement and released when
+    the `async with` block ends, so a handler costs one pool checkout
+    instead of one per statement. execute()/fetch() take the same
+    arguments and return the same results as db_execute_with_retry /
+    db_fetch_with_retry, including breaker, deadline and budget handling.
+    
+    Without a transaction every statement autocommits and is retried on a
+    fresh connection if the current one breaks. With transaction=True the
+    statements run between BEGIN and commit(); they are not retried (the
+    earlier ones cannot be replayed), the first failure marks the unit as
+    failed, and anything not committed is rolled back on exit.
+    """
+    
+    def __init__(self, transaction=False):
+        self.transaction = transaction
+        self.failed = False
+        self._lease = None
+        self._conn = None
+        self._in_transaction = False
+    
+    async def __aenter__(self):
+        return self
+    
+    async def __aexit__(self, exc_type, exc, tb):
+        if self._in_transaction:
+            self._in_transaction = False
+            try:
+                await asyncio.wait_for(self._conn.rollback(), DB_QUERY_TIMEOUT)
+            except Exception as e:
+                logger.error(f"Ошибка отката транзакции: {e}")
+                self._conn.close()
+        await self._release()
+        return False
+    
+    async def _release(self, exc_type=None):
+        """Return the connection to the pool (closed if exc_type is a cancellation or timeout)"""
+        lease, self._lease, self._conn = self._lease, None, None
+        if lease is not None:
+            await lease.__aexit__(exc_type, None, None)
+    
+    async def _run(self, query, params, fetch, timeout):
+        """One attempt: take the connection if needed, then run the statement (see _run_query)"""
+        try:
+            if self._conn is None:
+                lease = _app['db_pool'].acquire(timeout=budget_remaining())
+                self._conn = await lease.__aenter__()
+                self._lease = lease
+            return await asyncio.wait_for(self._execute(query, params, fetch), _statement_timeout(timeout))
+        except BaseException as e:
+            if self.transaction:
+                self.failed = True
+            if not isinstance(e, Exception) or isinstance(e, asyncio.TimeoutError):
+                # Cancelled or timed out mid-statement: the connection is unusable
+                self._in_transaction = False
+                await self._release(type(e))
+            elif self._conn is not None and self._conn.closed:
+                self._in_transaction = False
+                await self._release()
+            raise
+    
+    async def _execute(self, query, params, fetch):
+        """Run a statement on the unit's connection (opening the transaction first)"""
+        if self.transaction and not self._in_transaction:
+            await self._conn.begin()
+            self._in_transaction = True
+        return await _execute(self._conn, query, params, fetch)
+    
+    async def _statement(self, query, params, fetch, attempts, delay, action_desc, timeout):
+        """Run a statement through the shared retry loop"""
+        if not check_db_ready() or self.failed:
+            return False, None
+        if self.transaction:
+            attempts = 1
+        return await _query_with_retry(
+            query, params, fetch, lambda timeout: self._run(query, params, fetch, timeout), attempts, delay, action_desc, timeout
+        )
+    
+    async def execute(self, query, params=None, attempts=3, delay=0.5, action_desc="операция БД", timeout=None):
+        """
+        Execute a statement (see db_execute_with_retry)
         
-    for attempt in range(1, attempts + 1):
+        Returns:
+            bool: True if successful, False otherwise
+        """
+        ok, _ = await self._statement(query, params, None, attempts, delay, action_desc, timeout)
+        return ok
+    
+    async def fetch(self, query, params=None, fetch="all", attempts=3, delay=0.5, action_desc="операция БД",
+                    timeout=None):
+        """
+        Fetch rows (see db_fetch_with_retry)
+        
+        Returns:
+            Query results or None if failed
+        """
+        _, rows = await self._statement(query, params, fetch, attempts, delay, action_desc, timeout)
+        return rows
+    
+    async def commit(self, action_desc="Ошибка фиксации транзакции"):
+        """
+        Commit the transaction
+        
+        Returns:
+            bool: True if every statement succeeded and the commit went through
+        """
+        if self.failed:
+            return False
+        if not self._in_transaction:
+            return True
+        self._in_transaction = False
         try:
-            pool = _app['db_pool']
-            async with pool.acquire() as conn:
-                async with conn.cursor() as cur:
-                    await cur.execute(query, params or ())
-                    if fetch == "one":
-                        return await cur.fetchone()
-                    return await cur.fetchall()
-        except Exception as e:
-            logger.error(f"{action_desc}: попытка {attempt} неудачна: {e}")
-            if attempt < attempts:
-                await asyncio.sleep(delay * attempt)
-    return None
+            await asyncio.wait_for(self._conn.commit(), DB_QUERY_TIMEOUT)
+        except BaseException as e:
+            # Outcome unknown: never reuse the connection
+            self.failed = True
+            self._conn.close()
+            if not isinstance(e, Exception):
+                raise
+            _record_result(e)
+            logger.error(f"{action_desc}: {e}")
+            return False
+        _record_result(None)
+        return True
+
+
+def unit_of_work(transaction=False):
+    """
+    Share one pooled connection between several statements
+    
+    Usage:
+        async with unit_of_work(transaction=True) as uow:
+            row = await uow.fetch("SELECT ... FOR UPDATE", (...,), fetch="one")
+            await uow.execute("UPDATE ...", (...,))
+            ok = await uow.commit()
+    
+    Args:
+        transaction: Run the statements in one transaction
+        
+    Returns:
+        UnitOfWork
+    """
+    return UnitOfWork(transaction)
@@ -0,0 +1,69 @@
+"""
+Deadline module
+Per-update time budget shared by all database calls of one update
+
+Tasks inherit a copy of the context they are created in, budget
+included. Background work started while an update is handled (write-behind
+writes, shared batched/single-flight queries) must not be cut off when
+that update's budget runs out: start it with create_detached_task().
+"""
+
+import asyncio
+import contextvars
+import time
+
+# Absolute time.monotonic() deadline of the current update, None outside updates
+_deadline = contextvars.ContextVar('db_deadline', default=None)
+
+
+def start_budget(seconds):
+    """
+    Give the current task (one update) a total time budget for DB calls
+
+    Args:
+        seconds: Budget length
+
+    Returns:
+        Token for end_budget()
+    """
+    return _deadline.set(time.monotonic() + seconds)
+
+
+def end_budget(token):
+    """
+    Drop the budget set by start_budget()
+
+    Args:
+        token: Value returned by start_budget()
+    """
+    _deadline.reset(token)
+
+
+def budget_remaining():
+    """
+    Seconds left in the current budget
+
+    Returns:
+        float (zero or negative when exhausted) or None if no budget is set
+    """
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+def create_detached_task(coro):
+    """
+    Start a task that runs without the current update's budget
+
+    Other context variables are kept.
+
+    Args:
+        coro: Coroutine to run
+
+    Returns:
+        asyncio.Task
+    """
+    context = contextvars.copy_context()
+    context.run(_deadline.set, None)
+    return context.run(asyncio.ensure_future, coro)
@@ -0,0 +1,89 @@
+"""
+Deliverability module
+Chats the bot can't message and the broadcast audience built without them
+"""
+
+import logging
+
+from .connection import db_execute_with_retry, db_fetch_with_retry
+
+logger = logging.getLogger(__name__)
+
+# One row per Telegram user with access that can still receive messages:
+# not banned, chat not known to be dead. (tg_user_id, nickname)
+AUDIENCE_QUERY = (
+    "SELECT a.tg_user_id, MIN(a.nickname) AS nickname FROM access_list a "
+    "LEFT JOIN undeliverable_chats u ON u.tg_user_id = a.tg_user_id "
+    "LEFT JOIN banned_users b ON b.tg_user_id = a.tg_user_id "
+    "WHERE a.tg_user_id IS NOT NULL AND u.tg_user_id IS NULL AND b.tg_user_id IS NULL "
+    "AND (a.access_mask > 0 OR (a.access_mask IS NULL AND a.approved IS NOT NULL AND a.approved != '0')) "
+    "GROUP BY a.tg_user_id"
+)
+
+
+async def get_broadcast_audience():
+    """
+    Get the users a broadcast can reach
+    
+    Returns:
+        list: (tg_user_id, nickname) tuples, or None on DB failure
+    """
+    rows = await db_fetch_with_retry(
+        AUDIENCE_QUERY + " ORDER BY nickname",
+        fetch="all",
+        action_desc="Ошибка чтения аудитории рассылки"
+    )
+    return None if rows is None else list(rows)
+
+
+async def load_undeliverable_chats():
+    """
+    Load chats marked as undeliverable
+    
+    Returns:
+        dict: chat_id -> reason, or None on DB failure
+    """
+    rows = await db_fetch_with_retry(
+        "SELECT tg_user_id, reason FROM undeliverable_chats",
+        fetch="all",
+        action_desc="Загрузка недоступных чатов"
+    )
+    if rows is None:
+        return None
+    return {chat_id: reason for chat_id, reason in rows}
+
+
+async def mark_chat_undeliverable(chat_id, reason):
+    """
+    Remember that messages to a chat fail
+    
+    Args:
+        chat_id: Telegram user ID
+        reason: "blocked", "deactivated", "chat_not_found", ...
+        
+    Returns:
+        bool: True if saved
+    """
+    return await db_execute_with_retry(
+        "INSERT INTO undeliverable_chats (tg_user_id, reason) VALUES (%s, %s) "
+        "ON DUPLICATE KEY UPDATE reason = VALUES(reason), since = CURRENT_TIMESTAMP",
+        (chat_id, reason),
+        action_desc="Ошибка записи недоступного чата"
+    )
+
+
+async def mark_chat_deliverable(chat_id):
+    """
+    Forget a dead chat (the user talked to the bot again)
+    
+    Args:
+        chat_id: Telegram user ID
+        
+    Returns:
+        bool: True if saved
+    """
+    return await db_execute_with_retry(
+        "DELETE FROM undeliverable_chats WHERE tg_user_id = %s",
+        (chat_id,),
+        action_desc="Ошибка удаления недоступного чата"
+    )
@@ -0,0 +1,97 @@
+"""
+Batch loader module
+Resolves access records of many users with a single query
+"""
+
+import logging
+import asyncio
+
+from bot.config import ACCESS_BATCH_WINDOW, ACCESS_BATCH_MAX
+from bot.models.cache import user_record_get
+from .connection import db_fetch_with_retry
+from .deadline import create_detached_task
+from .queries import USER_RECORD_COLUMNS, cache_user_row, cache_missing_user
+
+logger = logging.getLogger(__name__)
+
+
+class AccessBatchLoader:
+    """
+    DataLoader for UserRecord objects
+    
+    Lookups that miss the record caches within one batch window are resolved
+    with one SELECT ... WHERE tg_user_id IN (...). Results are written to the
+    caches, so later lookups are served from memory.
+    """
+
+    def __init__(self, window=ACCESS_BATCH_WINDOW, max_batch=ACCESS_BATCH_MAX):
+        self.window = window
+        self.max_batch = max_batch
+        self._pending = {}  # user_id -> Future
+        self._timer = None
+        self.stats = {'batches': 0, 'keys': 0}
+
+    async def load(self, user_id):
+        """
+        Get the record of a user, loading it in a batch if needed
+        
+        Args:
+            user_id: Telegram user ID
+            
+        Returns:
+            UserRecord (nickname None if not registered) or None if the database is unavailable
+        """
+        record = user_record_get(user_id)
+        if record is not None:
+            return record
+
+        future = self._pending.get(user_id)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+            self._pending[user_id] = future
+            if len(self._pending) >= self.max_batch:
+                self._dispatch()
+            elif self._timer is None:
+                self._timer = loop.call_later(self.window, self._dispatch)
+        return await asyncio.shield(future)
+
+    def _dispatch(self):
+        """Start a query for everything collected so far"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, {}
+        if batch:
+            # Serves every waiting update: not bound by the budget of the one that triggered it
+            create_detached_task(self._flush(batch))
+
+    async def _flush(self, batch):
+        """Resolve a batch of user IDs with one query"""
+        self.stats['batches'] += 1
+        self.stats['keys'] += len(batch)
+        records = {}
+        try:
+            user_ids = tuple(batch)
+            placeholders = ", ".join(["%s"] * len(user_ids))
+            rows = await db_fetch_with_retry(
+                f"SELECT {USER_RECORD_COLUMNS} FROM access_list WHERE tg_user_id IN ({placeholders})",
+                user_ids,
+                fetch="all",
+                action_desc="Ошибка пакетной загрузки доступа"
+            )
+            if rows is not None:
+                for row in rows:
+                    records[row[0]] = cache_user_row(row)
+                for user_id in user_ids:
+                    if user_id not in records:
+                        records[user_id] = cache_missing_user(user_id)
+        except Exception as e:
+            logger.error(f"Ошибка пакетной загрузки доступа: {e}")
+
+        for user_id, future in batch.items():
+            if not future.done():
+                future.set_result(records.get(user_id))
+
+
+access_loader = AccessBatchLoader()
@@ -0,0 +1,177 @@
+"""
+Database migrations module
+Online schema changes and chunked data backfills
+"""
+
+import logging
+import asyncio
+
+from bot.config import ACCESS_MIGRATION_BATCH, ACCESS_MIGRATION_PAUSE
+from bot.models.access import access_to_mask
+from .connection import db_execute_with_retry, db_fetch_with_retry
+from .queries import parse_access
+
+logger = logging.getLogger(__name__)
+
+migration_stats = {
+    'batches': 0,  # Batches written
+    'rows': 0,     # Rows converted
+    'done': False,
+}
+
+
+async def ensure_access_mask_column():
+    """
+    Add access_list.access_mask and its index if they are missing
+    
+    TiDB runs both statements as online DDL, so the table stays writable.
+    NULL marks a row that has not been migrated yet.
+    
+    Returns:
+        bool: True if the column exists
+    """
+    success = await db_execute_with_retry(
+        "ALTER TABLE access_list ADD COLUMN IF NOT EXISTS access_mask TINYINT UNSIGNED NULL DEFAULT NULL",
+        action_desc="Ошибка добавления колонки access_mask"
+    )
+    if not success:
+        return False
+    await db_execute_with_retry(
+        "CREATE INDEX IF NOT EXISTS idx_access_mask ON access_list (access_mask)",
+        action_desc="Ошибка создания индекса access_mask"
+    )
+    return True
+
+
+async def migrate_access_masks(batch_size=ACCESS_MIGRATION_BATCH, pause=ACCESS_MIGRATION_PAUSE):
+    """
+    Fill access_mask from the legacy approved column, batch by batch
+    
+    Rows are walked in primary key order (keyset pagination on id), one
+    SELECT and one UPDATE per batch, and every row is updated by its own
+    id: rows with a NULL/empty or shared nickname each get the mask of
+    their own approved value. The `access_mask IS NULL` guard keeps masks
+    that handlers wrote in the meantime. Safe to interrupt: the next start
+    continues with the rows that are still NULL.
+    
+    Args:
+        batch_size: Rows per batch
+        pause: Delay between batches (seconds)
+    """
+    last_id = 0
+    while True:
+        rows = await db_fetch_with_retry(
+            "SELECT id, approved FROM access_list "
+            "WHERE access_mask IS NULL AND id > %s ORDER BY id LIMIT %s",
+            (last_id, batch_size),
+            fetch="all",
+            action_desc="Ошибка чтения строк для миграции access_mask"
+        )
+        if rows is None:
+            logger.warning("Миграция access_mask прервана, продолжится при следующем запуске")
+            return
+        if not rows:
+            break
+
+        cases = []
+        params = []
+        for row_id, approved in rows:
+            cases.append("WHEN %s THEN %s")
+            params.extend((row_id, access_to_mask(parse_access(approved))))
+        row_ids = [row[0] for row in rows]
+        placeholders = ", ".join(["%s"] * len(row_ids))
+        success = await db_execute_with_retry(
+            f"UPDATE access_list SET access_mask = CASE id {' '.join(cases)} END "
+            f"WHERE access_mask IS NULL AND id IN ({placeholders})",
+            tuple(params + row_ids),
+            action_desc="Ошибка записи access_mask"
+        )
+        if not success:
+            logger.warning("Миграция access_mask прервана, продолжится при следующем запуске")
+            return
+
+        migration_stats['batches'] += 1
+        migration_stats['rows'] += len(rows)
+        last_id = row_ids[-1]
+        await asyncio.sleep(pause)
+
+    migration_stats['done'] = True
+    logger.info(f"✅ Миграция access_mask завершена: {migration_stats['rows']} строк")
+
+
+async def ensure_broadcast_tables():
+    """
+    Create the broadcast job tables if they are missing
+    
+    broadcast_jobs holds one row per broadcast: the message, the admin's
+    status message, counters and the cursor (last recipient seq handed to
+    the sender). broadcast_recipients is the audience snapshot taken when
+    the job was created, with the delivery status of every recipient.
+    
+    Returns:
+        bool: True if both tables exist
+    """
+    success = await db_execute_with_retry(
+        "CREATE TABLE IF NOT EXISTS broadcast_jobs ("
+        "id BIGINT NOT NULL AUTO_INCREMENT PRIMARY KEY, "
+        "status VARCHAR(16) NOT NULL, "
+        "target VARCHAR(16) NOT NULL, "
+        "text TEXT NULL, "
+        "photo VARCHAR(255) NULL, "
+        "document VARCHAR(255) NULL, "
+        "admin_chat_id BIGINT NOT NULL, "
+        "status_message_id BIGINT NOT NULL, "
+        "total INT NOT NULL DEFAULT 0, "
+        "sent INT NOT NULL DEFAULT 0, "
+        "failed INT NOT NULL DEFAULT 0, "
+        "cursor_seq INT NOT NULL DEFAULT 0, "
+        "created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP, "
+        "finished_at TIMESTAMP NULL DEFAULT NULL, "
+        "INDEX idx_broadcast_status (status))",
+        action_desc="Ошибка создания таблицы broadcast_jobs"
+    )
+    if not success:
+        return False
+    return await db_execute_with_retry(
+        "CREATE TABLE IF NOT EXISTS broadcast_recipients ("
+        "job_id BIGINT NOT NULL, "
+        "seq INT NOT NULL, "
+        "tg_user_id BIGINT NOT NULL, "
+        "status TINYINT NOT NULL DEFAULT 0, "
+        "error VARCHAR(255) NULL DEFAULT NULL, "
+        "PRIMARY KEY (job_id, seq))",
+        action_desc="Ошибка создания таблицы broadcast_recipients"
+    )
+
+
+async def ensure_undeliverable_chats_table():
+    """
+    Create the table of chats the bot can't message (blocked, deactivated, ...)
+    
+    Returns:
+        bool: True if the table exists
+    """
+    return await db_execute_with_retry(
+        "CREATE TABLE IF NOT EXISTS undeliverable_chats ("
+        "tg_user_id BIGINT NOT NULL PRIMARY KEY, "
+        "reason VARCHAR(32) NOT NULL, "
+        "since TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP)",
+        action_desc="Ошибка создания таблицы undeliverable_chats"
+    )
+
+
+async def ensure_user_profiles_table():
+    """
+    Create the table of captured usernames / names (used by admin listings)
+    
+    Returns:
+        bool: True if the table exists
+    """
+    return await db_execute_with_retry(
+        "CREATE TABLE IF NOT EXISTS user_profiles ("
+        "tg_user_id BIGINT NOT NULL PRIMARY KEY, "
+        "username VARCHAR(64) NULL DEFAULT NULL, "
+        "full_name VARCHAR(255) NOT NULL, "
+        "updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP)",
+        action_desc="Ошибка создания таблицы user_profiles"
+    )
@@ -0,0 +1,396 @@
+"""
+Database pool module
+Instrumented, optionally adaptive connection pool with background warm-up
+"""
+
+import asyncio
+import logging
+from collections import deque
+
+from bot.metrics import Histogram
+
+logger = logging.getLogger(__name__)
+
+
+class PoolTimeoutError(Exception):
+    """No pooled connection freed up in time: the pool is busy, the database may be fine"""
+
+
+class _Lease:
+    """Async context manager returned by InstrumentedPool.acquire()"""
+    __slots__ = ('_pool', '_conn', '_started', '_timeout')
+
+    def __init__(self, pool, timeout):
+        self._pool = pool
+        self._conn = None
+        self._started = 0.0
+        self._timeout = timeout
+
+    async def __aenter__(self):
+        self._conn, self._started = await self._pool._acquire(self._timeout)
+        return self._conn
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if exc_type is not None and (not issubclass(exc_type, Exception) or issubclass(exc_type, asyncio.TimeoutError)):
+            # Cancelled or timed out mid-query (deadline): the protocol state is unknown
+            self._conn.close()
+        self._pool._release(self._conn, self._started)
+        return False
+
+
+class InstrumentedPool:
+    """
+    Connection pool with a soft size limit, wait/usage metrics and warm-up
+
+    At most `limit` callers hold a connection; the rest wait in FIFO order,
+    bounded by acquire_timeout. In adaptive mode, adapt() grows the limit
+    while callers queue up and shrinks it after a quiet period, always
+    within [min_limit, max_limit].
+
+    Opening a connection (TCP + TLS + auth) is kept off the request path:
+    maintain() tops the pool up to the current limit, pings idle
+    connections so the server does not drop them, and opens a replacement
+    for every idle connection about to reach max_lifetime before retiring it.
+    Connections that reach max_lifetime while in use are retired on release
+    and replaced in the background.
+    """
+
+    def __init__(self, connect, limit, min_limit, max_limit, acquire_timeout, max_lifetime,
+                 adaptive=False):
+        self._connect = connect  # Coroutine function opening a new connection
+        self.limit = limit
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.acquire_timeout = acquire_timeout
+        self.max_lifetime = max_lifetime
+        self.adaptive = adaptive
+        self.in_use = 0
+        self._idle = deque()  # (conn, idle_since), most recently released last
+        self._opened_at = {}  # conn -> loop time it was opened (every open connection)
+        self._opening = 0
+        self._refill_task = None
+        self._closing = False
+        self._drained = None  # Future resolved when the last lease returns after close()
+        self._waiters = deque()  # Futures of callers waiting for the gate
+        self._quiet_rounds = 0
+        self._peak_waiting = 0  # Queue depth peak since the last adapt()
+        self._peak_in_use = 0
+        self.wait_hist = Histogram()  # Time spent waiting for a connection
+        self.use_hist = Histogram()  # Time a connection was held
+        self.connect_hist = Histogram()  # Time to open a connection
+        self.counters = {
+            'acquires': 0,
+            'waited': 0,      # Acquires that found the pool saturated
+            'timeouts': 0,    # Acquires that gave up after acquire_timeout
+            'max_waiting': 0, # Deepest queue seen
+            'grown': 0,
+            'shrunk': 0,
+            'opened': 0,
+            'inline_opens': 0,  # Connections a caller had to wait to open
+            'retired': 0,     # Closed for age, shrink or a failed ping
+            'pings': 0,
+        }
+
+    @property
+    def waiting(self):
+        """Number of callers queued for a connection"""
+        return len(self._waiters)
+
+    @property
+    def size(self):
+        """Number of open connections (idle and in use)"""
+        return len(self._opened_at)
+
+    def acquire(self, timeout=None):
+        """
+        Acquire a connection (use as `async with pool.acquire() as conn`)
+
+        Args:
+            timeout: Max wait for a free slot, default (and at most) acquire_timeout
+
+        Raises:
+            PoolTimeoutError: If no connection frees up in time
+        """
+        return _Lease(self, timeout)
+
+    async def _acquire(self, timeout=None):
+        """Pass the gate, then take an idle connection"""
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        self.counters['acquires'] += 1
+        if self.in_use >= self.limit or self._waiters:
+            self.counters['waited'] += 1
+            waiter = loop.create_future()
+            self._waiters.append(waiter)
+            depth = len(self._waiters)
+            self._peak_waiting = max(self._peak_waiting, depth)
+            self.counters['max_waiting'] = max(self.counters['max_waiting'], depth)
+            wait = self.acquire_timeout if timeout is None else min(self.acquire_timeout, timeout)
+            try:
+                await asyncio.wait_for(waiter, wait)
+            except BaseException as e:
+                if waiter.done() and not waiter.cancelled():
+                    self._free_slot()  # Slot was handed over just as we gave up
+                elif waiter in self._waiters:
+                    self._waiters.remove(waiter)
+                if isinstance(e, asyncio.TimeoutError):
+                    self.counters['timeouts'] += 1
+                    raise PoolTimeoutError(f"No free DB connection within {wait:.1f}s") from None
+                raise
+            # The slot was handed over by _wake_next()
+        else:
+            self.in_use += 1
+        self._peak_in_use = max(self._peak_in_use, self.in_use)
+        try:
+            conn = await self._take()
+        except BaseException:
+            self._free_slot()
+            raise
+        now = loop.time()
+        self.wait_hist.observe((now - started) * 1000)
+        return conn, now
+
+    async def _take(self):
+        """Pop the warmest idle connection, or open one inline as a last resort"""
+        while self._idle:
+            conn, _ = self._idle.pop()
+            if not conn.closed:
+                return conn
+            self._forget(conn)
+        self.counters['inline_opens'] += 1
+        return await self._open()
+
+    def _release(self, conn, started):
+        """Return a connection and hand the slot to the next waiter"""
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        self.use_hist.observe((now - started) * 1000)
+        if conn.closed or self._closing:
+            self._forget(conn)
+            if not self._closing:
+                self._schedule_refill()
+        elif conn.get_transaction_status():
+            self._retire(conn)  # Never hand out a connection inside a transaction
+        elif now - self._opened_at.get(conn, now) >= self.max_lifetime or self.size > self.limit:
+            self._retire(conn)
+            self._schedule_refill()
+        else:
+            self._idle.append((conn, now))
+        self._free_slot()
+
+    def _free_slot(self):
+        """Give a slot back, or pass it straight to a waiter"""
+        self.in_use -= 1
+        self._wake_next()
+        if self._closing and self.in_use == 0 and self._drained and not self._drained.done():
+            self._drained.set_result(None)
+
+    def _wake_next(self):
+        """Hand free slots to waiters in FIFO order"""
+        while self._waiters and self.in_use < self.limit:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.in_use += 1
+                waiter.set_result(None)
+
+    async def _open(self):
+        """Open and register a new connection"""
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        self._opening += 1
+        try:
+            conn = await self._connect()
+        finally:
+            self._opening -= 1
+        now = loop.time()
+        self.connect_hist.observe((now - started) * 1000)
+        self.counters['opened'] += 1
+        if self._closing:
+            conn.close()
+            raise RuntimeError("Pool is closing")
+        self._opened_at[conn] = now
+        return conn
+
+    def _forget(self, conn):
+        """Drop a connection from the bookkeeping"""
+        self._opened_at.pop(conn, None)
+
+    def _retire(self, conn):
+        """Close a connection the pool no longer wants"""
+        self._forget(conn)
+        conn.close()
+        self.counters['retired'] += 1
+
+    def _schedule_refill(self):
+        """Top the pool up to the current limit in the background"""
+        if self._refill_task is None or self._refill_task.done():
+            self._refill_task = asyncio.create_task(self._refill())
+
+    async def _refill(self):
+        """Open connections until the current limit is reached"""
+        try:
+            await self.prewarm()
+        except Exception as e:
+            logger.error(f"Ошибка открытия соединения с БД: {e}")
+
+    async def prewarm(self, count=None):
+        """
+        Open idle connections ahead of demand
+
+        Args:
+            count: Target number of open connections (default: the current limit)
+        """
+        target = min(self.limit if count is None else count, self.max_limit)
+        while not self._closing and self.size + self._opening < target:
+            conn = await self._open()
+            self._idle.appendleft((conn, asyncio.get_running_loop().time()))
+
+    async def maintain(self, ping_after):
+        """
+        Keep idle connections alive and rotate them before they expire
+
+        Each idle connection is taken out of the idle list while it is
+        checked, so no caller can receive it mid-ping.
+
+        Args:
+            ping_after: Ping connections idle for at least this many seconds
+        """
+        loop = asyncio.get_running_loop()
+        for entry in list(self._idle):
+            if self._closing:
+                return
+            conn, idle_since = entry
+            now = loop.time()
+            age = now - self._opened_at.get(conn, now)
+            if age >= self.max_lifetime - ping_after:
+                # Would expire before the next round: open the replacement first
+                replacement = await self._open()
+                try:
+                    await replacement.ping(reconnect=False)
+                except Exception:
+                    self._retire(replacement)
+                    raise
+                if entry in self._idle:
+                    self._idle.remove(entry)
+                    self._retire(conn)
+                self._idle.appendleft((replacement, loop.time()))
+            elif now - idle_since >= ping_after:
+                if entry not in self._idle:
+                    continue  # Handed out meanwhile: it is in use, so alive
+                self._idle.remove(entry)
+                try:
+                    await conn.ping(reconnect=False)
+                except Exception as e:
+                    logger.warning(f"⚠️ Соединение с БД не ответило на ping: {e}")
+                    self._retire(conn)
+                    continue
+                self.counters['pings'] += 1
+                if self._closing:
+                    self._retire(conn)
+                else:
+                    self._idle.appendleft((conn, loop.time()))
+        await self.prewarm()
+
+    async def adapt(self, quiet_rounds_to_shrink):
+        """
+        Resize the soft limit from the queue depth seen since the last call
+
+        Args:
+            quiet_rounds_to_shrink: Consecutive calls without queueing before shrinking
+        """
+        peak_waiting, peak_in_use = self._peak_waiting, self._peak_in_use
+        self._peak_waiting = len(self._waiters)
+        self._peak_in_use = self.in_use
+        if peak_waiting > 0:
+            self._quiet_rounds = 0
+            if self.limit < self.max_limit:
+                # Open the extra connection before the queued caller gets the slot
+                await self.prewarm(self.limit + 1)
+                self.limit += 1
+                self.counters['grown'] += 1
+                logger.info(f"📈 Пул БД увеличен до {self.limit} (очередь: {peak_waiting})")
+                self._wake_next()
+            return
+        self._quiet_rounds += 1
+        if (self._quiet_rounds >= quiet_rounds_to_shrink and self.limit > self.min_limit
+                and peak_in_use < self.limit):
+            self._quiet_rounds = 0
+            self.limit -= 1
+            self.counters['shrunk'] += 1
+            logger.info(f"📉 Пул БД уменьшен до {self.limit}")
+            # Close the coldest idle connections above the new limit; busy ones on release
+            while self._idle and self.size > self.limit:
+                conn, _ = self._idle.popleft()
+                self._retire(conn)
+
+    def stats(self):
+        """
+        Get pool metrics
+
+        Returns:
+            dict: Sizes, counters and wait/use/connect histograms
+        """
+        return {
+            'limit': self.limit,
+            'min_limit': self.min_limit,
+            'max_limit': self.max_limit,
+            'adaptive': self.adaptive,
+            'in_use': self.in_use,
+            'waiting': self.waiting,
+            'connections': self.size,
+            'idle': len(self._idle),
+            'opening': self._opening,
+            'counters': dict(self.counters),
+            'acquire_wait': self.wait_hist.snapshot(),
+            'in_use_time': self.use_hist.snapshot(),
+            'connect_time': self.connect_hist.snapshot(),
+        }
+
+    def close(self):
+        """Stop handing out connections and close the idle ones"""
+        self._closing = True
+        if self._refill_task is not None:
+            self._refill_task.cancel()
+        while self._idle:
+            conn, _ = self._idle.pop()
+            self._forget(conn)
+            conn.close()
+
+    async def wait_closed(self):
+        """Wait until connections in use are returned (and closed)"""
+        if self.in_use > 0:
+            self._drained = asyncio.get_running_loop().create_future()
+            await self._drained
+
+
+async def adapt_pool_loop(pool, interval, quiet_rounds_to_shrink):
+    """
+    Periodically resize an adaptive pool
+
+    Args:
+        pool: InstrumentedPool
+        interval: Seconds between adjustments
+        quiet_rounds_to_shrink: Quiet intervals before the limit shrinks
+    """
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await pool.adapt(quiet_rounds_to_shrink)
+        except Exception as e:
+            logger.error(f"Ошибка адаптации пула БД: {e}")
+
+
+async def keepalive_pool_loop(pool, interval):
+    """
+    Periodically ping, rotate and top up pool connections
+
+    Args:
+        pool: InstrumentedPool
+        interval: Seconds between rounds (also the idle time before a ping)
+    """
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await pool.maintain(interval)
+        except Exception as e:
+            logger.error(f"Ошибка обслуживания пула БД: {e}")
@@ -0,0 +1,108 @@
+"""
+Profiles persistence module
+Write-behind storage of captured user profiles and batch lookups for listings
+"""
+
+import logging
+import asyncio
+
+from bot.config import PROFILE_FLUSH_INTERVAL, PROFILE_FLUSH_BATCH
+from bot.models.profiles import profile_store
+from bot.models.records import UserProfile
+from .connection import check_db_ready, db_execute_with_retry, db_fetch_with_retry
+
+logger = logging.getLogger(__name__)
+
+
+async def get_profiles(user_ids):
+    """
+    Get profiles of several users: memory first, the rest in one query
+    
+    Args:
+        user_ids: Iterable of Telegram user IDs (None entries are ignored)
+        
+    Returns:
+        dict: user_id -> UserProfile for the users whose profile is known
+    """
+    profiles = {}
+    missing = []
+    for user_id in set(user_ids):
+        if user_id is None:
+            continue
+        profile = profile_store.get(user_id)
+        if profile is not None:
+            profiles[user_id] = profile
+        else:
+            missing.append(user_id)
+    if not missing or not check_db_ready():
+        return profiles
+    
+    rows = await db_fetch_with_retry(
+        f"SELECT tg_user_id, username, full_name FROM user_profiles "
+        f"WHERE tg_user_id IN ({', '.join(['%s'] * len(missing))})",
+        tuple(missing),
+        fetch="all",
+        action_desc="Ошибка чтения профилей"
+    )
+    for user_id, username, full_name in rows or ():
+        profile = UserProfile(username, full_name)
+        profile_store.put(user_id, profile)
+        profiles[user_id] = profile
+    profile_store.counters['loaded'] += len(rows or ())
+    return profiles
+
+
+async def flush_profiles():
+    """
+    Write captured profile changes, PROFILE_FLUSH_BATCH rows per statement
+    
+    Returns:
+        bool: False if a batch could not be written (it is kept for the next flush)
+    """
+    while profile_store.pending and check_db_ready():
+        batch = profile_store.take_dirty(PROFILE_FLUSH_BATCH)
+        params = []
+        for user_id, profile in batch:
+            # full_name is NOT NULL; get_chat may return a chat without one
+            params.extend((user_id, profile.username, (profile.full_name or '')[:255]))
+        try:
+            success = await db_execute_with_retry(
+                "INSERT INTO user_profiles (tg_user_id, username, full_name) VALUES "
+                + ", ".join(["(%s, %s, %s)"] * len(batch))
+                + " ON DUPLICATE KEY UPDATE username = VALUES(username), full_name = VALUES(full_name)",
+                tuple(params),
+                action_desc="Ошибка записи профилей"
+            )
+        except BaseException:
+            # Errors and cancellation (shutdown) must not lose the batch taken above
+            profile_store.requeue(batch)
+            raise
+        if not success:
+            profile_store.requeue(batch)
+            return False
+        profile_store.counters['written'] += len(batch)
+    return True
+
+
+async def profile_writer_loop(interval=PROFILE_FLUSH_INTERVAL):
+    """
+    Flush captured profiles every `interval` seconds
+    
+    Args:
+        interval: Seconds between flushes
+    """
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await flush_profiles()
+        except Exception as e:
+            logger.error(f"Ошибка записи профилей: {e}")
+
+
+async def stop_profile_writer(app):
+    """Stop the writer and save what is left (aiohttp on_shutdown, before the pool closes)"""
+    task = app.get('profile_writer')
+    if task is not None:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+    await flush_profiles()
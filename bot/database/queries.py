@@ -3,73 +3,231 @@ Database queries module
 Contains all database query functions
 """
 
-from .connection import db_execute_with_retry, db_fetch_with_retry
-from bot.models.cache import access_cache, access_cache_set, access_cache_remove, access_cache_remove_by_nick
-import time
+import asyncio
 import json
+import logging
 
+from .connection import db_execute_with_retry, db_fetch_with_retry
+from .deadline import create_detached_task
+from bot.models.cache import user_record_get, user_record_put
+from bot.models.records import UserRecord
+from bot.models.access import SCRIPT_BITS, FULL_ACCESS_MASK, mask_to_access, access_to_mask
+from bot.models.allowlist import allowlist
+from bot.config import ALLOWLIST_REFRESH_INTERVAL
 
-async def get_user_script_access(user_id):
+logger = logging.getLogger(__name__)
+
+# --- SINGLE-FLIGHT ---
+_inflight = {}  # key -> asyncio.Task of the query currently running
+singleflight_stats = {
+    'queries': 0,    # Queries actually sent to the DB
+    'collapsed': 0,  # Calls that reused an in-flight query instead
+}
+
+
+async def _single_flight(key, loader):
     """
-    Get user's script access permissions
+    Run loader() at most once at a time per key
+    
+    Concurrent callers with the same key await the same in-flight task.
+    The task is shielded, so a cancelled caller does not cancel it for the others.
+    
+    Args:
+        key: Hashable identifier of the query
+        loader: Zero-argument coroutine function performing the query
+        
+    Returns:
+        Result of loader()
+    """
+    task = _inflight.get(key)
+    if task is None:
+        singleflight_stats['queries'] += 1
+        # Shared by all callers: not bound by the budget of the update that started it
+        task = create_detached_task(loader())
+        _inflight[key] = task
+
+        def _forget(done_task):
+            if _inflight.get(key) is done_task:
+                del _inflight[key]
+
+        task.add_done_callback(_forget)
+    else:
+        singleflight_stats['collapsed'] += 1
+    return await asyncio.shield(task)
+
+
+def get_singleflight_stats():
+    """
+    Get single-flight counters
+    
+    Returns:
+        dict: Number of queries sent, calls collapsed and queries in flight
+    """
+    return dict(singleflight_stats, inflight=len(_inflight))
+
+
+# Columns every access_list lookup selects, in UserRecord order
+USER_RECORD_COLUMNS = "tg_user_id, nickname, access_mask, approved"
+
+
+async def _fetch_user_rows(user_id):
+    """
+    Fetch the access_list row of a user, sharing concurrent identical queries
+    
+    Uses fetch="all": an empty result means "no row", None means a DB error.
     
     Args:
         user_id: Telegram user ID
         
     Returns:
-        dict: Dictionary like {'mine': True, 'oskolki': False} or None if no access
+        list of rows with USER_RECORD_COLUMNS, or None on DB error
     """
-    # Check cache first
-    cached = access_cache.get(user_id)
-    if cached:
-        nickname, expires_at, access_dict = cached
-        if expires_at > time.time() and isinstance(access_dict, dict):
-            return access_dict
-        # If expired or access_dict is None (old cache format), remove it
-        if expires_at <= time.time():
-            access_cache.pop(user_id, None)
-
-    row = await db_fetch_with_retry(
-        "SELECT approved, nickname FROM access_list WHERE tg_user_id = %s",
-        (user_id,),
-        fetch="one",
-        action_desc="Ошибка проверки доступа к скриптам"
+    return await _single_flight(
+        ('user', user_id),
+        lambda: db_fetch_with_retry(
+            f"SELECT {USER_RECORD_COLUMNS} FROM access_list WHERE tg_user_id = %s",
+            (user_id,),
+            fetch="all",
+            action_desc="Ошибка загрузки пользователя"
+        )
     )
+
+
+def parse_access(approved):
+    """
+    Parse the legacy approved column of access_list
     
-    if not row or row[0] is None:
-        return None
-    
-    approved_json, nickname = row
+    Only needed for rows the access_mask migration has not reached yet.
     
-    # Parse JSON or handle legacy 0/1
-    access_dict = None
+    Args:
+        approved: Raw column value (JSON string, dict, legacy 0/1 or NULL)
+        
+    Returns:
+        dict: Dictionary like {'mine': True, 'oskolki': False} or None if no access
+    """
+    if approved is None:
+        return None
     try:
         # If it's modern JSON (e.g. '{"mine": true}')
-        if isinstance(approved_json, str) and (approved_json.startswith('{') or approved_json.startswith('[')):
-            access_dict = json.loads(approved_json)
-        elif isinstance(approved_json, dict):
-            access_dict = approved_json
+        if isinstance(approved, str) and (approved.startswith('{') or approved.startswith('[')):
+            access_dict = json.loads(approved)
+        elif isinstance(approved, dict):
+            access_dict = approved
         # If it's legacy or simplified status
+        elif str(approved) == '1':
+            access_dict = {'mine': True, 'oskolki': True}
         else:
-             val = str(approved_json)
-             if val == '1':
-                 access_dict = {'mine': True, 'oskolki': True}
-             else:
-                 # 0, NULL, or any other value means no approved access
-                 return None
+            # 0 or any other value means no approved access
+            return None
     except Exception as e:
-        logger.error(f"Error parsing access JSON for {user_id}: {e}")
+        logger.error(f"Error parsing access JSON {approved!r}: {e}")
         return None
-        
-    # Extra check: if it parsed as empty dict, treat as no access
-    if not access_dict or not any(access_dict.values()):
+    
+    # If it parsed as empty dict (or not a dict at all), treat as no access
+    if not isinstance(access_dict, dict) or not any(access_dict.values()):
         return None
+    return access_dict
+
+
+def row_access(access_mask, approved):
+    """
+    Get the access of an access_list row
+    
+    Args:
+        access_mask: access_mask column (NULL until the row is migrated)
+        approved: Legacy approved column
+        
+    Returns:
+        dict: Dictionary like {'mine': True, 'oskolki': False} or None if no access
+    """
+    if access_mask is not None:
+        return mask_to_access(access_mask)
+    return parse_access(approved)
+
+
+def build_user_record(user_id, nickname, access_mask, approved):
+    """
+    Build a UserRecord from an access_list row
+    
+    Args:
+        user_id: Telegram user ID
+        nickname: nickname column
+        access_mask: access_mask column
+        approved: approved column (legacy access, for rows not migrated yet)
         
-    # Populate cache
-    if access_dict:
-        access_cache_set(user_id, nickname, access_dict)
+    Returns:
+        UserRecord
+    """
+    return UserRecord(user_id, nickname, row_access(access_mask, approved))
+
+
+def cache_user_row(row):
+    """
+    Build a UserRecord from a row with USER_RECORD_COLUMNS and cache it
+    
+    Args:
+        row: (tg_user_id, nickname, access_mask, approved)
         
-    return access_dict
+    Returns:
+        UserRecord
+    """
+    record = build_user_record(*row)
+    user_record_put(record)
+    return record
+
+
+def cache_missing_user(user_id):
+    """
+    Cache the fact that a user has no access_list row
+    
+    Args:
+        user_id: Telegram user ID
+        
+    Returns:
+        UserRecord: Record with nickname None
+    """
+    record = UserRecord(user_id)
+    user_record_put(record)
+    return record
+
+
+async def get_user_record(user_id):
+    """
+    Get everything known about a user's access, from cache or database
+    
+    Args:
+        user_id: Telegram user ID
+        
+    Returns:
+        UserRecord (nickname None if not registered) or None if the database failed
+    """
+    record = user_record_get(user_id)
+    if record is not None:
+        return record
+
+    # Only real answers (not DB errors) end up in the cache
+    rows = await _fetch_user_rows(user_id)
+    if rows is None:
+        return None
+    if not rows:
+        return cache_missing_user(user_id)
+    return cache_user_row(rows[0])
+
+
+async def get_user_script_access(user_id):
+    """
+    Get user's script access permissions
+    
+    Args:
+        user_id: Telegram user ID
+        
+    Returns:
+        dict: Dictionary like {'mine': True, 'oskolki': False} or None if no access
+    """
+    record = await get_user_record(user_id)
+    if record is None or not record.has_access:
+        return None
+    return record.access
 
 
 async def has_script_access(user_id, script_name):
@@ -99,46 +257,153 @@ async def get_access_nickname(user_id):
     Returns:
         str: Nickname if user has ANY approved access, None otherwise
     """
-    # Check cache first
-    cached = access_cache.get(user_id)
-    if cached:
-        nickname, expires_at, _ = cached # Unpack 3 values
-        if expires_at > time.time():
-            return nickname
-        access_cache.pop(user_id, None)
-    
-    # Query database - check if user has any approved scripts
-    row = await db_fetch_with_retry(
-        "SELECT nickname, approved FROM access_list WHERE tg_user_id = %s",
-        (user_id,),
-        fetch="one",
-        action_desc="Ошибка проверки доступа"
-    )
-    
-    if not row:
+    record = await get_user_record(user_id)
+    if record is None or not record.has_access:
         return None
+    return record.nickname
+
+
+# --- ATOMIC ACCESS UPDATES ---
+# Set next to the new mask in LAST_INSERT_ID(): tells "updated to 0" from "no row matched"
+_ROW_MATCHED = 0x100
+
+
+def _approved_json(mask):
+    """Legacy approved column value for a mask (dual write, all scripts listed)"""
+    return json.dumps({name: bool(mask & bit) for name, bit in SCRIPT_BITS.items()})
+
+
+async def _migrate_access_row(where, key):
+    """
+    Fill access_mask of a row the background migration has not reached yet
     
-    nickname, approved = row
+    Returns:
+        bool: True if a row was migrated, False if there is none, None if the database failed
+    """
+    rows = await db_fetch_with_retry(
+        f"SELECT approved FROM access_list WHERE {where} AND access_mask IS NULL LIMIT 1",
+        key,
+        fetch="all",
+        action_desc="Ошибка чтения строки для миграции access_mask"
+    )
+    if not rows:
+        return None if rows is None else False
+    success = await db_execute_with_retry(
+        f"UPDATE access_list SET access_mask = %s WHERE {where} AND access_mask IS NULL",
+        (access_to_mask(parse_access(rows[0][0])),) + key,
+        action_desc="Ошибка записи access_mask"
+    )
+    return True if success else None
+
+
+async def update_access_mask(user_id=None, nickname=None, grant=0, revoke=0, clear_request=False,
+                             action_desc="Ошибка обновления доступа"):
+    """
+    Grant and revoke scripts in one atomic statement
     
-    # Check if user has any approved scripts
-    if approved is None:
-        return None
+    The database computes (access_mask | grant) & ~revoke itself, so
+    concurrent approvals cannot overwrite each other, and hands the result
+    back through LAST_INSERT_ID(expr), which arrives in the OK packet of the
+    UPDATE - no read before or after it. The legacy approved column is
+    dual-written from the same expression (listed before access_mask, so
+    it sees the old value on any assignment order). The statement is
+    idempotent, so retries are safe.
     
-    try:
-        # Parse JSON to check if any script is approved
-        if isinstance(approved, str):
-            access_dict = json.loads(approved)
-        elif isinstance(approved, dict):
-            access_dict = approved
-        else:
-            # Old format compatibility
-            access_dict = {'mine': True, 'oskolki': True}
+    Args:
+        user_id: Match by Telegram user ID
+        nickname: Match by nickname (both given: both must match)
+        grant: Bits to set
+        revoke: Bits to clear
+        clear_request: Also close an open additional access request
+        action_desc: Description for logging
         
-        # If any script is approved, cache and return nickname
-        if any(access_dict.values()):
-            access_cache_set(user_id, nickname, access_dict)
-            return nickname
-    except:
-        pass
-    
-    return None
+    Returns:
+        tuple: (found, new access_mask), or None if the database failed
+    """
+    conditions = []
+    key = ()
+    if user_id is not None:
+        conditions.append("tg_user_id = %s")
+        key += (user_id,)
+    if nickname is not None:
+        conditions.append("nickname = %s")
+        key += (nickname,)
+    where = " AND ".join(conditions)
+    
+    keep = FULL_ACCESS_MASK & ~revoke
+    new_mask = "((access_mask | %s) & %s)"
+    cases = []
+    case_params = []
+    for mask in range(FULL_ACCESS_MASK + 1):
+        cases.append("WHEN %s THEN %s")
+        case_params.extend((mask, _approved_json(mask)))
+    query = (
+        f"UPDATE access_list SET approved = CASE {new_mask} {' '.join(cases)} END, "
+        f"access_mask = LAST_INSERT_ID({new_mask} | %s) & %s"
+        + (", requested_access = NULL" if clear_request else "")
+        + f" WHERE {where} AND access_mask IS NOT NULL"
+    )
+    params = (grant, keep, *case_params, grant, keep, _ROW_MATCHED, FULL_ACCESS_MASK) + key
+    
+    for _ in range(2):
+        result = await db_fetch_with_retry(query, params, fetch="lastrowid", action_desc=action_desc)
+        if result is None:
+            return None
+        if result & _ROW_MATCHED:
+            return True, result & FULL_ACCESS_MASK
+        # No migrated row: migrate it in place if it exists, then try again
+        migrated = await _migrate_access_row(where, key)
+        if migrated is None:
+            return None
+        if not migrated:
+            break
+    return False, 0
+
+
+async def load_allowlists():
+    """
+    Rebuild the /check allow-lists from access_list
+    
+    If a handler changed the lists while the query was running, the result
+    is dropped: the in-memory state is already newer than the snapshot.
+    
+    Returns:
+        bool: True if the allow-lists are loaded
+    """
+    version = allowlist.version
+    rows = await _single_flight(
+        ('allowlist',),
+        lambda: db_fetch_with_retry(
+            "SELECT tg_user_id, nickname, access_mask, approved FROM access_list "
+            "WHERE access_mask > 0 OR (access_mask IS NULL AND approved IS NOT NULL AND approved != '0')",
+            fetch="all",
+            action_desc="Ошибка загрузки списков доступа"
+        )
+    )
+    if rows is None:
+        return allowlist.loaded
+    if allowlist.loaded and allowlist.version != version:
+        return True
+    allowlist.replace(
+        (user_id, nickname, access_mask if access_mask is not None else access_to_mask(parse_access(approved)))
+        for user_id, nickname, access_mask, approved in rows
+    )
+    return True
+
+
+async def refresh_allowlists_loop(interval=ALLOWLIST_REFRESH_INTERVAL):
+    """
+    Periodically rebuild the allow-lists
+    
+    Handlers keep the lists current; this only picks up rows changed
+    outside the bot (manual SQL, another instance).
+    
+    Args:
+        interval: Seconds between rebuilds
+    """
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await load_allowlists()
+        except Exception as e:
+            logger.error(f"Ошибка обновления списков доступа: {e}")
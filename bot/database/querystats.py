@@ -0,0 +1,134 @@
+"""
+Query statistics module
+Per-query latency histograms and the slow-query log
+"""
+
+import logging
+import re
+
+from bot.config import DB_SLOW_QUERY_MS, DB_QUERY_STATS_MAX
+from bot.metrics import Histogram
+
+logger = logging.getLogger(__name__)
+# Dedicated logger, so slow queries can be routed to their own file (DB_SLOW_QUERY_LOG)
+slow_logger = logging.getLogger("slow_queries")
+
+_WHITESPACE = re.compile(r"\s+")
+_OVERFLOW_LABEL = "(другие)"
+
+
+class QueryStats:
+    """Counters and latency histogram of one query label"""
+    __slots__ = ('query', 'calls', 'failures', 'attempts', 'rows', 'slow', 'latency')
+
+    def __init__(self, query):
+        self.query = query  # Normalized SQL of the first call, for reference
+        self.calls = 0
+        self.failures = 0
+        self.attempts = 0
+        self.rows = 0
+        self.slow = 0
+        self.latency = Histogram()
+
+    def snapshot(self):
+        """
+        Get the statistics
+
+        Returns:
+            dict: Counters, query and latency histogram
+        """
+        return {
+            'query': self.query,
+            'calls': self.calls,
+            'failures': self.failures,
+            'attempts': self.attempts,
+            'rows': self.rows,
+            'slow': self.slow,
+            'latency': self.latency.snapshot(),
+        }
+
+
+# label (action_desc) -> QueryStats
+query_stats = {}
+
+
+def normalize_query(query, limit=200):
+    """
+    Collapse whitespace and cut a query for labels and logs
+
+    Args:
+        query: SQL query string
+        limit: Maximum length
+
+    Returns:
+        str: One-line query
+    """
+    query = _WHITESPACE.sub(" ", query).strip()
+    return query if len(query) <= limit else query[:limit] + "…"
+
+
+def params_shape(params):
+    """
+    Describe query parameters without their values
+
+    Args:
+        params: Query parameters tuple (or None)
+
+    Returns:
+        str: Types, with lengths of strings and sequences, e.g. "(int, str[12])"
+    """
+    if not params:
+        return "()"
+    parts = []
+    for value in params:
+        name = type(value).__name__
+        if isinstance(value, (str, bytes, list, tuple, set, dict)):
+            name += f"[{len(value)}]"
+        parts.append(name)
+    return f"({', '.join(parts)})"
+
+
+def record_query(label, query, params, elapsed_ms, attempts, rows, ok):
+    """
+    Account one DB helper call (all of its attempts)
+
+    Args:
+        label: Query label (the action_desc of the call)
+        query: SQL query string
+        params: Query parameters
+        elapsed_ms: Wall time of the call, retries included
+        attempts: Attempts made
+        rows: Rows returned
+        ok: False if the call failed
+    """
+    stats = query_stats.get(label)
+    if stats is None:
+        if len(query_stats) >= DB_QUERY_STATS_MAX:
+            label = _OVERFLOW_LABEL
+            stats = query_stats.get(label)
+        if stats is None:
+            stats = query_stats[label] = QueryStats(normalize_query(query))
+    stats.calls += 1
+    stats.attempts += attempts
+    stats.rows += rows
+    if not ok:
+        stats.failures += 1
+    stats.latency.observe(elapsed_ms)
+
+    if elapsed_ms >= DB_SLOW_QUERY_MS:
+        stats.slow += 1
+        slow_logger.warning(
+            f"🐢 {label}: {elapsed_ms:.0f} мс, попыток: {attempts}, строк: {rows}, "
+            f"{'ok' if ok else 'ошибка'} | {normalize_query(query)} | параметры: {params_shape(params)}"
+        )
+
+
+def get_query_stats():
+    """
+    Get statistics of all query labels, slowest in total first
+
+    Returns:
+        dict: label -> statistics
+    """
+    ordered = sorted(query_stats.items(), key=lambda item: item[1].latency.total, reverse=True)
+    return {label: stats.snapshot() for label, stats in ordered}
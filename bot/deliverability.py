@@ -0,0 +1,115 @@
+"""
+Deliverability module
+Tracks chats that can't receive messages and stops sending to them
+
+A send that fails with "blocked by the user", "user is deactivated",
+"chat not found" and the like marks the chat as undeliverable: in memory
+(undeliverable_chats) and, in the background, in the database. Further
+sends to it fail at once with ChatUndeliverable instead of costing an
+API round trip, and broadcast audiences leave it out. The mark is
+removed as soon as the user writes to the bot again.
+"""
+
+import logging
+
+from aiogram.utils import exceptions
+
+from bot.database.deadline import create_detached_task
+from bot.database.deliverability import mark_chat_undeliverable, mark_chat_deliverable
+from bot.models.cache import undeliverable_chats
+
+logger = logging.getLogger(__name__)
+
+# Send errors that mean the chat is gone until the user comes back
+_DEAD_CHAT_ERRORS = (
+    (exceptions.BotBlocked, "blocked"),
+    (exceptions.UserDeactivated, "deactivated"),
+    (exceptions.ChatNotFound, "chat_not_found"),
+    (exceptions.CantInitiateConversation, "not_started"),
+    (exceptions.BotKicked, "kicked"),
+)
+
+# Background DB writes (kept so they are not garbage collected mid-flight)
+_pending_writes = set()
+
+
+class ChatUndeliverable(Exception):
+    """Send skipped: the chat is known not to accept messages"""
+
+    def __init__(self, chat_id, reason):
+        super().__init__(f"Chat {chat_id} is undeliverable: {reason}")
+        self.chat_id = chat_id
+        self.reason = reason
+
+
+def classify_send_error(error):
+    """
+    Tell whether a send error means the chat is dead
+
+    Args:
+        error: Exception raised by a send
+
+    Returns:
+        str: Reason ("blocked", "deactivated", ...) or None for other errors
+    """
+    if isinstance(error, ChatUndeliverable):
+        return error.reason
+    for error_type, reason in _DEAD_CHAT_ERRORS:
+        if isinstance(error, error_type):
+            return reason
+    return None
+
+
+def undeliverable_reason(chat_id):
+    """Reason a chat can't be messaged, or None"""
+    return undeliverable_chats.get(chat_id)
+
+
+def _write_behind(coro):
+    """Run a DB write without making the sender wait for it (or sharing its update budget)"""
+    task = create_detached_task(coro)
+    _pending_writes.add(task)
+    task.add_done_callback(_pending_writes.discard)
+
+
+def note_send_failure(chat_id, error):
+    """
+    Mark the chat as undeliverable if the error says so
+
+    Args:
+        chat_id: Target chat of the failed send
+        error: Exception raised by the send
+
+    Returns:
+        str: Reason if the chat is dead, None otherwise
+    """
+    reason = classify_send_error(error)
+    if reason is not None and not isinstance(error, ChatUndeliverable):
+        note_chat_dead(chat_id, reason)
+    return reason
+
+
+def note_chat_dead(chat_id, reason):
+    """
+    Mark a chat as undeliverable
+
+    Args:
+        chat_id: Telegram user ID
+        reason: "blocked", "deactivated", ...
+    """
+    if undeliverable_chats.get(chat_id) != reason:
+        undeliverable_chats[chat_id] = reason
+        logger.info(f"📵 Чат {chat_id} недоступен ({reason}), отправка ему отключена")
+        _write_behind(mark_chat_undeliverable(chat_id, reason))
+
+
+def note_chat_alive(chat_id):
+    """
+    Clear the mark of a chat that showed signs of life (the user wrote to the bot)
+
+    Args:
+        chat_id: Telegram user ID
+    """
+    if undeliverable_chats.pop(chat_id, None) is not None:
+        logger.info(f"📲 Чат {chat_id} снова доступен")
+        _write_behind(mark_chat_deliverable(chat_id))
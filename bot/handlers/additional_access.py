@@ -9,9 +9,10 @@ from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 
 from bot.config import ADMIN_ID, REQUEST_PHOTO_FILE_ID
 from bot.models.states import UserStates
-from bot.database.connection import db_execute_with_retry, db_fetch_with_retry
+from bot.database.connection import db_execute_with_retry
+from bot.database.queries import get_user_record
+from bot.models.cache import access_cache_remove
 from bot.utils.ui import send_ui
-from bot.utils.access_control import get_user_script_access
 
 logger = logging.getLogger(__name__)
 
@@ -20,29 +21,22 @@ def register_additional_access_handlers(dp):
     """Register handlers for requesting additional script access"""
     
     @dp.callback_query_handler(text="request_additional_access", state="*")
-    async def cb_request_additional_access(call: types.CallbackQuery, state: FSMContext):
+    async def cb_request_additional_access(call: types.CallbackQuery, state: FSMContext, user_record=None):
         """Show menu to select which script to request access to"""
         user_id = call.from_user.id
         
-        # Get current access
-        current_access = await get_user_script_access(user_id)
-        if not current_access:
-            await call.answer("⚠️ Ошибка получения доступа", show_alert=True)
+        # Current access and nickname (record preloaded by AccessPreloadMiddleware)
+        record = user_record if user_record is not None else await get_user_record(user_id)
+        if record is None or not record.registered:
+            await call.answer("⚠️ Профиль не найден", show_alert=True)
             return
         
-        # Get user nickname
-        row = await db_fetch_with_retry(
-            "SELECT nickname FROM access_list WHERE tg_user_id = %s",
-            (user_id,),
-            fetch="one",
-            action_desc="Ошибка получения ника"
-        )
-        
-        if not row:
-            await call.answer("⚠️ Профиль не найден", show_alert=True)
+        if not record.has_access:
+            await call.answer("⚠️ Ошибка получения доступа", show_alert=True)
             return
         
-        nickname = row[0]
+        current_access = record.access
+        nickname = record.nickname
         
         # Find scripts without access
         available_to_request = []
@@ -173,6 +167,7 @@ def register_additional_access_handlers(dp):
             (requested_json, call.from_user.id),
             action_desc="Сохранение запроса на доп. доступ"
         )
+        access_cache_remove(call.from_user.id)
 
         # Notify admin
         try:
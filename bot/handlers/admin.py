@@ -4,6 +4,7 @@ Handles all admin commands
 """
 
 import logging
+from html import escape
 from aiogram import types, Bot
 from aiogram.dispatcher import FSMContext
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
@@ -12,13 +13,40 @@ from bot.config import ADMIN_ID, API_TOKEN
 from bot.models.states import AdminStates
 from bot.models.cache import banned_cache, pending_cache
 from bot.database.connection import check_db_ready, db_execute_with_retry, db_fetch_with_retry
-from bot.database.queries import get_access_nickname
+from bot.database.queries import get_access_nickname, row_access, update_access_mask
 from bot.middleware.security import ban_user_system
-from bot.models.cache import access_cache_remove_by_nick
+from bot.models.cache import access_cache_remove, access_cache_remove_by_nick
+from bot.models.access import FULL_ACCESS_MASK, SCRIPT_BITS
+from bot.models.allowlist import allowlist_set, allowlist_remove
+from bot.database.broadcasts import create_broadcast_job
+from bot.database.deliverability import get_broadcast_audience
+from bot.resolver import get_listing_profiles
+from bot.utils.helpers import split_message
+from bot.broadcast import notify_broadcast
 
 logger = logging.getLogger(__name__)
 
 
+def format_user_link(uid, profile, spoiler=False):
+    """
+    Render a user for admin listings from their captured profile
+    
+    Args:
+        uid: Telegram user ID
+        profile: UserProfile or None if the user was never seen
+        spoiler: Hide the ID under a spoiler
+        
+    Returns:
+        str: "@username (ID: ...)", a name link, or just the ID
+    """
+    id_text = f"<tg-spoiler>{uid}</tg-spoiler>" if spoiler else str(uid)
+    if profile is None or not (profile.username or profile.full_name):
+        return f"ID: {id_text}"
+    if profile.username:
+        return f"@{profile.username} (ID: {id_text})"
+    return f"<a href='tg://user?id={uid}'>{escape(profile.full_name)}</a> (ID: {id_text})"
+
+
 def register_admin_handlers(dp):
     """Register all admin command handlers"""
     
@@ -32,9 +60,10 @@ def register_admin_handlers(dp):
             return
             
         try:
-            # Query for users with valid JSON in approved column
+            # Users with any access (access_mask IS NULL: row not migrated yet)
             rows = await db_fetch_with_retry(
-                "SELECT nickname, tg_user_id, approved FROM access_list WHERE approved IS NOT NULL AND approved != '0' AND approved != '1'",
+                "SELECT nickname, tg_user_id, access_mask, approved FROM access_list "
+                "WHERE access_mask > 0 OR (access_mask IS NULL AND approved IS NOT NULL AND approved != '0')",
                 fetch="all",
                 action_desc="Ошибка получения списка одобренных"
             )
@@ -45,40 +74,26 @@ def register_admin_handlers(dp):
             if not rows:
                 text += "Пусто."
             else:
+                profiles = await get_listing_profiles(message.bot, [r[1] for r in rows])
                 for r in rows:
                     nick = r[0]
                     uid = r[1] if r[1] else "N/A"
-                    approved_json = r[2]
+                    access = row_access(r[2], r[3])
+                    if not access:
+                        continue
                     
-                    # Parse access
-                    import json
-                    try:
-                        access = json.loads(approved_json) if isinstance(approved_json, str) else approved_json
-                        access_str = ""
-                        if isinstance(access, dict):
-                            parts = []
-                            if access.get('mine'): parts.append("⛏")
-                            if access.get('oskolki'): parts.append("💎")
-                            access_str = " ".join(parts)
-                    except:
-                        access_str = "❓"
+                    parts = []
+                    if access.get('mine'): parts.append("⛏")
+                    if access.get('oskolki'): parts.append("💎")
+                    access_str = " ".join(parts)
                     
-                    # Get user info safely
-                    user_link = f"ID: <tg-spoiler>{uid}</tg-spoiler>"
-                    try:
-                        if uid != "N/A":
-                            chat = await message.bot.get_chat(uid)
-                            if chat.username:
-                                user_link = f"@{chat.username} (ID: <tg-spoiler>{uid}</tg-spoiler>)"
-                            else:
-                                user_link = f"<a href='tg://user?id={uid}'>{chat.full_name}</a> (ID: <tg-spoiler>{uid}</tg-spoiler>)"
-                    except Exception:
-                        # If bot doesn't know the user (cleared cache/restart), show just ID
-                        pass
+                    # Captured or resolved profile (unknown / over the time budget: just the ID)
+                    user_link = format_user_link(uid, profiles.get(r[1]), spoiler=True)
                     
                     text += f"• <code>{nick}</code> {access_str} — {user_link}\n"
             
-            await message.reply(text, parse_mode="HTML")
+            for part in split_message(text):
+                await message.reply(part, parse_mode="HTML")
 
         except Exception as e:
             await message.reply(f"Ошибка: {e}")
@@ -96,47 +111,22 @@ def register_admin_handlers(dp):
         nickname = args.strip()
         
         try:
-            # Get current access
-            row = await db_fetch_with_retry(
-                "SELECT approved, tg_user_id FROM access_list WHERE nickname = %s",
-                (nickname,),
-                fetch="one",
-                action_desc="Ошибка получения прав"
-            )
-            
-            if not row:
-                return await message.reply("⚠️ Пользователь не найден")
-                
-            current_access = row[0]
-            user_id = row[1]
-            import json
-            
-            if isinstance(current_access, str):
-                try:
-                    current_access = json.loads(current_access)
-                except:
-                    current_access = {}
-            elif not isinstance(current_access, dict):
-                current_access = {}
-                
-            # Update access
-            current_access['mine'] = False
-            new_access_json = json.dumps(current_access)
-            
-            # Save to DB
-            success = await db_execute_with_retry(
-                "UPDATE access_list SET approved = %s WHERE nickname = %s",
-                (new_access_json, nickname),
+            # Clear the script bit in one atomic statement (no read first)
+            result = await update_access_mask(
+                nickname=nickname,
+                revoke=SCRIPT_BITS['mine'],
                 action_desc="Ошибка обновления прав"
             )
             
-            if success:
-                # Update cache
-                from bot.models.cache import access_cache_set
-                access_cache_set(user_id, nickname, current_access)
-                await message.reply(f"✅ Доступ к '⛏ Скрипт Шахты' отозван у пользователя <code>{nickname}</code>", parse_mode="HTML")
-            else:
+            if result is None:
                 await message.reply("❌ Ошибка базы данных")
+            elif not result[0]:
+                await message.reply("⚠️ Пользователь не найден")
+            else:
+                # Cached records are re-read on the next access check
+                access_cache_remove_by_nick(nickname)
+                allowlist_set(nickname, result[1])
+                await message.reply(f"✅ Доступ к '⛏ Скрипт Шахты' отозван у пользователя <code>{nickname}</code>", parse_mode="HTML")
                 
         except Exception as e:
             await message.reply(f"Ошибка: {e}")
@@ -154,47 +144,22 @@ def register_admin_handlers(dp):
         nickname = args.strip()
         
         try:
-            # Get current access
-            row = await db_fetch_with_retry(
-                "SELECT approved, tg_user_id FROM access_list WHERE nickname = %s",
-                (nickname,),
-                fetch="one",
-                action_desc="Ошибка получения прав"
-            )
-            
-            if not row:
-                return await message.reply("⚠️ Пользователь не найден")
-                
-            current_access = row[0]
-            user_id = row[1]
-            import json
-            
-            if isinstance(current_access, str):
-                try:
-                    current_access = json.loads(current_access)
-                except:
-                    current_access = {}
-            elif not isinstance(current_access, dict):
-                current_access = {}
-                
-            # Update access
-            current_access['oskolki'] = False
-            new_access_json = json.dumps(current_access)
-            
-            # Save to DB
-            success = await db_execute_with_retry(
-                "UPDATE access_list SET approved = %s WHERE nickname = %s",
-                (new_access_json, nickname),
+            # Clear the script bit in one atomic statement (no read first)
+            result = await update_access_mask(
+                nickname=nickname,
+                revoke=SCRIPT_BITS['oskolki'],
                 action_desc="Ошибка обновления прав"
             )
             
-            if success:
-                # Update cache
-                from bot.models.cache import access_cache_set
-                access_cache_set(user_id, nickname, current_access)
-                await message.reply(f"✅ Доступ к '🔮 Счетчик осколков' отозван у пользователя <code>{nickname}</code>", parse_mode="HTML")
-            else:
+            if result is None:
                 await message.reply("❌ Ошибка базы данных")
+            elif not result[0]:
+                await message.reply("⚠️ Пользователь не найден")
+            else:
+                # Cached records are re-read on the next access check
+                access_cache_remove_by_nick(nickname)
+                allowlist_set(nickname, result[1])
+                await message.reply(f"✅ Доступ к '🔮 Счетчик осколков' отозван у пользователя <code>{nickname}</code>", parse_mode="HTML")
                 
         except Exception as e:
             await message.reply(f"Ошибка: {e}")
@@ -202,40 +167,29 @@ def register_admin_handlers(dp):
     async def build_pending_list(admin_id):
         """Build pending applications list"""
         rows = await db_fetch_with_retry(
-            "SELECT nickname, tg_user_id, approved, requested_access FROM access_list WHERE approved=0 OR requested_access IS NOT NULL",
+            "SELECT nickname, tg_user_id, access_mask, approved, requested_access FROM access_list WHERE approved=0 OR requested_access IS NOT NULL",
             fetch="all",
             action_desc="Ошибка получения списка заявок"
         )
-        if rows is None:
-            rows = []
+        # (nickname, user_id, current access dict or None, requested_access)
+        rows = [(r[0], r[1], row_access(r[2], r[3]), r[4]) for r in rows or ()]
             
         text = "⏳ <b>Заявки на рассмотрении:</b>\n\n"
         if not rows:
             text += "Нет заявок."
         else:
             pending_cache[admin_id] = rows
+            profiles = await get_listing_profiles(dp.bot, [r[1] for r in rows])
             for idx, r in enumerate(rows, start=1):
                 nick = r[0]
                 uid = r[1] if r[1] else "N/A"
-                approved = r[2]
-                requested = r[3]
+                access = r[2]
                 
                 status = "🆕" # New user
-                if approved and approved != 0 and approved != '0':
+                if access:
                      status = "🆙" # Upgrade request
                 
-                username = None
-                if uid != "N/A":
-                    try:
-                        user = await dp.bot.get_chat(uid)
-                        if user.username:
-                            username = f"@{user.username}"
-                    except:
-                        pass
-                
-                user_info = f"ID: {uid}"
-                if username:
-                    user_info = f"{username} (ID: {uid})"
+                user_info = format_user_link(uid, profiles.get(r[1]))
                 
                 text += f"{idx}. {status} <code>{nick}</code> — {user_info}\n"
         
@@ -285,26 +239,16 @@ def register_admin_handlers(dp):
             if not rows:
                 text += "Нет забаненных."
             else:
+                profiles = await get_listing_profiles(message.bot, [r[0] for r in rows])
                 for r in rows:
                     uid = r[0]
                     reason = r[1] if r[1] else "Не указана"
-                    
-                    # Get username and fullname
-                    username = None
-                    fullname = f"User {uid}"
-                    try:
-                        user = await message.bot.get_chat(uid)
-                        fullname = user.full_name or f"User {uid}"
-                        if user.username:
-                            username = f"@{user.username}"
-                    except:
-                        pass
-                    
-                    user_info = f"{username} (ID: {uid})" if username else f"{fullname} (ID: {uid})"
+                    user_info = format_user_link(uid, profiles.get(uid))
                     
                     text += f"• {user_info}\n  📝 Причина: {reason}\n"
             
-            await message.reply(text, parse_mode="HTML")
+            for part in split_message(text):
+                await message.reply(part, parse_mode="HTML")
 
         except Exception as e:
             await message.reply(f"Ошибка: {e}")
@@ -324,12 +268,14 @@ def register_admin_handlers(dp):
             
         try:
             success = await db_execute_with_retry(
-                "INSERT INTO access_list (nickname, approved) VALUES (%s, 1)",
-                (args,),
+                "INSERT INTO access_list (nickname, approved, access_mask) VALUES (%s, 1, %s)",
+                (args, FULL_ACCESS_MASK),
                 action_desc="Ошибка ручного добавления"
             )
             if not success:
                 return await message.reply("❌ Не удалось добавить в БД. Попробуйте позже.")
+            access_cache_remove_by_nick(args)
+            allowlist_set(args, FULL_ACCESS_MASK)
             await message.reply(f"✅ Добавил: {args}")
         except Exception as e:
             await message.reply(f"Ошибка: {e}")
@@ -356,6 +302,7 @@ def register_admin_handlers(dp):
             if not success:
                 return await message.reply("❌ Не удалось удалить из БД. Попробуйте позже.")
             access_cache_remove_by_nick(args)
+            allowlist_remove(args)
             await message.reply(f"🗑 Удалил: {args}")
         except Exception as e:
             await message.reply(f"Ошибка: {e}")
@@ -401,6 +348,7 @@ def register_admin_handlers(dp):
                 return await message.reply("⚠️ Пользователь не в бане")
             
             banned_cache.remove(uid)
+            access_cache_remove(uid)
             
             await db_execute_with_retry(
                 "DELETE FROM banned_users WHERE tg_user_id=%s",
@@ -557,10 +505,8 @@ def register_admin_handlers(dp):
             await call.answer("БД недоступна", show_alert=True)
             return
 
-        users = await db_fetch_with_retry(
-            "SELECT tg_user_id, nickname FROM access_list WHERE approved IS NOT NULL AND approved != '0'", 
-            fetch="all"
-        )
+        # Same audience as a broadcast to everyone
+        users = await get_broadcast_audience()
         
         if not users:
             await call.answer("Нет доступных пользователей", show_alert=True)
@@ -711,7 +657,7 @@ def register_admin_handlers(dp):
 
     @dp.callback_query_handler(text="broadcast_send", state=AdminStates.waiting_for_broadcast_msg)
     async def cb_broadcast_send(call: types.CallbackQuery, state: FSMContext):
-        """Execute broadcast"""
+        """Store the broadcast as a job for the background worker"""
         data = await state.get_data()
         text = data.get('broadcast_text')
         photo = data.get('broadcast_photo')
@@ -722,54 +668,19 @@ def register_admin_handlers(dp):
         await call.message.edit_reply_markup(reply_markup=None)
         status_msg = await call.message.reply("⏳ Начинаю рассылку...")
         
-        recipients = []
-        
-        try:
-            if target_type == "all":
-                 # Fetch all users
-                rows = await db_fetch_with_retry(
-                    "SELECT tg_user_id FROM access_list",
-                    fetch="all",
-                    action_desc="Broadcast user fetch"
-                )
-                if rows:
-                    recipients = [r[0] for r in rows]
-            else:
-                # Use selected ids
-                recipients = data.get("selected_ids", [])
-        except Exception as e:
-            await status_msg.edit_text(f"❌ Ошибка БД: {e}")
+        # "all": the audience is snapshotted when the job is stored
+        recipients = None if target_type == "all" else data.get("selected_ids", [])
+        created = await create_broadcast_job(
+            target_type, text, photo, document, status_msg.chat.id, status_msg.message_id, recipients
+        )
+        if created is None:
+            await status_msg.edit_text("❌ Ошибка БД: рассылка не сохранена.")
             return
-
-        if not recipients:
+        job_id, total = created
+        if not job_id:
             await status_msg.edit_text("❌ Нет получателей для рассылки.")
             return
-            
-        count_ok = 0
-        count_fail = 0
         
-        markup = InlineKeyboardMarkup()
-        markup.add(InlineKeyboardButton("🏠 Главное меню", callback_data="menu_start"))
-        
-        import asyncio
-        for uid in recipients:
-            try:
-                if photo:
-                    await call.bot.send_photo(uid, photo, caption=text, parse_mode="HTML", reply_markup=markup)
-                elif document:
-                    await call.bot.send_document(uid, document, caption=text, parse_mode="HTML", reply_markup=markup)
-                else:
-                    await call.bot.send_message(uid, text, parse_mode="HTML", reply_markup=markup)
-                count_ok += 1
-            except Exception:
-                count_fail += 1
-            
-            await asyncio.sleep(0.05) # Flood limit prevention
-            
-        await status_msg.edit_text(
-            f"✅ <b>Рассылка завершена!</b>\n"
-            f"🎯 Цель: {target_type}\n"
-            f"📤 Успешно: {count_ok}\n"
-            f"❌ Ошибок: {count_fail}",
-            parse_mode="HTML"
-        )
+        logger.info(f"📢 Рассылка {job_id} создана: {total} получателей")
+        await status_msg.edit_text(f"⏳ Рассылка поставлена в очередь: {total} получателей")
+        notify_broadcast()
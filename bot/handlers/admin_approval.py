@@ -9,7 +9,9 @@ from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 
 from bot.config import ADMIN_ID, PHOTO_FILE_ID
 from bot.models.cache import last_bot_msg, access_cache_set, access_cache_remove
-from bot.database.connection import db_execute_with_retry, db_fetch_with_retry
+from bot.models.access import access_to_mask, mask_to_access
+from bot.models.allowlist import allowlist_set
+from bot.database.queries import get_user_record, update_access_mask
 from bot.utils.ui import send_ui
 
 logger = logging.getLogger(__name__)
@@ -39,54 +41,35 @@ def register_admin_approval_handlers(dp):
         except:
             requested_scripts = {'mine': True, 'oskolki': True}
         
-        # Get user info from database
-        row = await db_fetch_with_retry(
-            "SELECT nickname FROM access_list WHERE tg_user_id = %s",
-            (user_id,),
-            fetch="one",
-            action_desc="Ошибка получения ника пользователя"
-        )
+        # Nickname for the messages (usually cached since the application)
+        record = await get_user_record(user_id)
         
-        if not row:
+        if record is None or not record.registered:
             await call.answer("⚠️ Заявка не найдена", show_alert=True)
             return
         
-        nickname = row[0]
+        nickname = record.nickname
         
-        # Approve all requested scripts
-        # Merge with existing access (if any)
-        row_access = await db_fetch_with_retry(
-            "SELECT approved FROM access_list WHERE tg_user_id = %s",
-            (user_id,),
-            fetch="one",
-            action_desc="Чтение текущего доступа"
-        )
-        current_access = {}
-        if row_access and row_access[0]:
-             try:
-                 if isinstance(row_access[0], str): current_access = json.loads(row_access[0])
-                 elif isinstance(row_access[0], dict): current_access = row_access[0]
-             except: pass
-             
-        # Merge
-        new_access = current_access.copy()
-        for script, val in requested_scripts.items():
-            if val:
-                new_access[script] = True
-        
-        approved_json = json.dumps(new_access)
-        success = await db_execute_with_retry(
-            "UPDATE access_list SET approved = %s, requested_access = NULL WHERE tg_user_id = %s",
-            (approved_json, user_id),
+        # Approve all requested scripts, merged with existing access by the DB
+        result = await update_access_mask(
+            user_id=user_id,
+            grant=access_to_mask(requested_scripts),
+            clear_request=True,
             action_desc="Ошибка одобрения заявки"
         )
         
-        if not success:
+        if result is None:
             await call.answer("❌ Ошибка БД", show_alert=True)
             return
+        found, new_mask = result
+        if not found:
+            await call.answer("⚠️ Заявка не найдена", show_alert=True)
+            return
+        new_access = mask_to_access(new_mask) or {}
         
         # Update cache with FULL access dict
         access_cache_set(user_id, nickname, new_access)
+        allowlist_set(nickname, new_mask, user_id)
         
         # Build approved scripts list
         approved_list = []
@@ -174,18 +157,13 @@ def register_admin_approval_handlers(dp):
             requested_scripts = {'mine': True, 'oskolki': True}
         
         # Get user info
-        row = await db_fetch_with_retry(
-            "SELECT nickname FROM access_list WHERE tg_user_id = %s",
-            (user_id,),
-            fetch="one",
-            action_desc="Ошибка получения ника"
-        )
+        record = await get_user_record(user_id)
         
-        if not row:
+        if record is None or not record.registered:
             await call.answer("⚠️ Заявка не найдена", show_alert=True)
             return
         
-        nickname = row[0]
+        nickname = record.nickname
         
         # Store in state (including original caption for later update)
         await state.update_data(
@@ -345,29 +323,23 @@ def register_admin_approval_handlers(dp):
             await call.answer("⚠️ Выберите хотя бы один скрипт!", show_alert=True)
             return
         
-        # Always merge with existing access to avoid overwriting current permissions
-        from bot.database.queries import get_user_script_access
-        current_access = await get_user_script_access(user_id) or {}
-        
-        # Merge
-        new_access = current_access.copy()
-        if selected.get('mine'): new_access['mine'] = True
-        if selected.get('oskolki'): new_access['oskolki'] = True
-        
-        approved_json = json.dumps(new_access)
-            
-        success = await db_execute_with_retry(
-            "UPDATE access_list SET approved = %s, requested_access = NULL WHERE tg_user_id = %s",
-            (approved_json, user_id),
+        # Merged with existing access by the DB, so current permissions are never overwritten
+        result = await update_access_mask(
+            user_id=user_id,
+            grant=access_to_mask(selected),
+            clear_request=True,
             action_desc="Ошибка одобрения заявки"
         )
         
-        if not success:
+        if result is None or not result[0]:
             await call.answer("❌ Ошибка БД", show_alert=True)
             return
+        new_mask = result[1]
+        new_access = mask_to_access(new_mask) or {}
         
         # Update cache with FULL access dict
         access_cache_set(user_id, nickname, new_access)
+        allowlist_set(nickname, new_mask, user_id)
         
         # Build approved scripts list
         approved_list = []
@@ -492,48 +464,32 @@ def register_admin_approval_handlers(dp):
         except:
             requested_scripts = {}
         
-        # Get current user access
-        from bot.database.queries import get_user_script_access
-        current_access = await get_user_script_access(user_id)
+        # Get current user access and nickname
+        record = await get_user_record(user_id)
         
-        if not current_access:
+        if record is None or not record.has_access:
             await call.answer("⚠️ Пользователь не найден", show_alert=True)
             return
         
-        # Get user info
-        row = await db_fetch_with_retry(
-            "SELECT nickname FROM access_list WHERE tg_user_id = %s",
-            (user_id,),
-            fetch="one",
-            action_desc="Ошибка получения ника"
-        )
-        
-        if not row:
-            await call.answer("⚠️ Пользователь не найден", show_alert=True)
-            return
+        nickname = record.nickname
         
-        nickname = row[0]
-        
-        # Merge current access with requested
-        new_access = current_access.copy()
-        for script, value in requested_scripts.items():
-            if value:
-                new_access[script] = True
-        
-        # Save to database
-        approved_json = json.dumps(new_access)
-        success = await db_execute_with_retry(
-            "UPDATE access_list SET approved = %s, requested_access = NULL WHERE tg_user_id = %s",
-            (approved_json, user_id),
+        # Merge current access with requested (in the DB, atomically)
+        result = await update_access_mask(
+            user_id=user_id,
+            grant=access_to_mask(requested_scripts),
+            clear_request=True,
             action_desc="Ошибка одобрения дополнительного доступа"
         )
         
-        if not success:
+        if result is None or not result[0]:
             await call.answer("❌ Ошибка БД", show_alert=True)
             return
+        new_mask = result[1]
+        new_access = mask_to_access(new_mask) or {}
         
         # Update cache
         access_cache_set(user_id, nickname, new_access)
+        allowlist_set(nickname, new_mask, user_id)
         
         # Build newly granted scripts list
         newly_granted = []
@@ -620,18 +576,13 @@ def register_admin_approval_handlers(dp):
             requested_scripts = {}
         
         # Get user info
-        row = await db_fetch_with_retry(
-            "SELECT nickname FROM access_list WHERE tg_user_id = %s",
-            (user_id,),
-            fetch="one",
-            action_desc="Ошибка получения ника"
-        )
+        record = await get_user_record(user_id)
         
-        if not row:
+        if record is None or not record.registered:
             await call.answer("⚠️ Пользователь не найден", show_alert=True)
             return
         
-        nickname = row[0]
+        nickname = record.nickname
         
         # Store in state
         await state.update_data(
@@ -663,18 +614,13 @@ def register_admin_approval_handlers(dp):
         user_id = int(call.data.split(":")[1])
         
         # Get user info
-        row = await db_fetch_with_retry(
-            "SELECT nickname FROM access_list WHERE tg_user_id = %s",
-            (user_id,),
-            fetch="one",
-            action_desc="Ошибка получения ника"
-        )
+        record = await get_user_record(user_id)
         
-        if not row:
+        if record is None or not record.registered:
             await call.answer("⚠️ Пользователь не найден", show_alert=True)
             return
         
-        nickname = row[0]
+        nickname = record.nickname
         
         # Notify user
         try:
@@ -13,8 +13,10 @@ from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from bot.config import ADMIN_ID, PHOTO_FILE_ID, API_TOKEN
 from bot.models.states import AdminStates, UserStates
 from bot.models.cache import banned_cache, last_bot_msg, pending_cache, access_cache_set, access_cache_remove
+from bot.models.access import FULL_ACCESS_MASK, mask_to_access
+from bot.models.allowlist import allowlist_set, allowlist_remove
 from bot.database.connection import check_db_ready, db_execute_with_retry, db_fetch_with_retry
-from bot.database.queries import get_access_nickname
+from bot.database.queries import get_access_nickname, update_access_mask
 from bot.middleware.security import ban_user_system
 from bot.utils.ui import send_ui
 from bot.utils.helpers import delete_after_delay
@@ -58,7 +60,10 @@ def register_callback_handlers(dp):
             (target_uid, target_nick),
             action_desc="Ошибка удаления заявки"
         )
-        if not delete_success:
+        if delete_success:
+            # The row may have carried access (rejected upgrade request)
+            allowlist_remove(target_nick)
+        else:
             logger.error("Не удалось удалить заявку из БД после повторов.")
         access_cache_remove(target_uid)
         
@@ -388,11 +393,11 @@ def register_callback_handlers(dp):
             await call.answer("Список устарел. Обновляю.", show_alert=True)
             return await cb_pending_list(call)
         
-        # rows tuple: (nickname, user_id, approved, requested_access)
+        # rows tuple: (nickname, user_id, current access dict or None, requested_access)
         row = rows[idx - 1]
         nick = row[0]
         uid = row[1]
-        approved = row[2]
+        curr_dict = row[2] or {}
         requested = row[3]
         
         if not uid:
@@ -410,8 +415,8 @@ def register_callback_handlers(dp):
                 elif isinstance(requested, dict):
                    req_dict = requested
             
-            # If no requested_access but approved=0, it's a new legacy request or just registration without specifics
-            if not req_dict and (not approved or approved == '0' or approved == 0):
+            # If no requested_access and no access yet, it's a new legacy request or just registration without specifics
+            if not req_dict and not curr_dict:
                  req_dict = {'mine': True, 'oskolki': True}
                  
             req_list = []
@@ -437,16 +442,9 @@ def register_callback_handlers(dp):
             requested_text = "Ошибка данных"
             requested_code = "m1o1" # Default fallback
             
-        # Parse current access
+        # Format current access
         current_text = "Нет"
         try:
-            curr_dict = {}
-            if approved and approved != '0' and approved != 0:
-                if isinstance(approved, str):
-                   curr_dict = json.loads(approved)
-                elif isinstance(approved, dict):
-                   curr_dict = approved
-                   
             curr_list = []
             if curr_dict.get('mine'): curr_list.append("⛏ Скрипт Шахты")
             if curr_dict.get('oskolki'): curr_list.append("🔮 Счетчик осколков")
@@ -509,25 +507,17 @@ def register_callback_handlers(dp):
                     pass
                 return
             
-            # Update in DB with retries
+            # Update in DB with retries; the statement returns the stored mask, so no check query
             success = False
             try:
-                upd = await db_execute_with_retry(
-                    "UPDATE access_list SET approved=1 WHERE tg_user_id=%s AND nickname=%s",
-                    (uid, nick),
-                    attempts=3,
+                result = await update_access_mask(
+                    user_id=uid,
+                    nickname=nick,
+                    grant=FULL_ACCESS_MASK,
                     action_desc="Ошибка обновления статуса заявки"
                 )
-                if upd:
-                    result = await db_fetch_with_retry(
-                        "SELECT approved FROM access_list WHERE tg_user_id=%s AND nickname=%s",
-                        (uid, nick),
-                        fetch="one",
-                        attempts=3,
-                        action_desc="Ошибка проверки статуса заявки"
-                    )
-                    if result and result[0] == 1:
-                        success = True
+                if result == (True, FULL_ACCESS_MASK):
+                    success = True
             except Exception as e:
                 logger.error(f"Ошибка обновления заявки: {e}")
             
@@ -538,7 +528,9 @@ def register_callback_handlers(dp):
                     pass
                 return
             
-            access_cache_set(uid, nick)
+            # Legacy approve (approved = 1) grants every script
+            access_cache_set(uid, nick, mask_to_access(FULL_ACCESS_MASK))
+            allowlist_set(nick, FULL_ACCESS_MASK, uid)
             
             # Update admin message
             try:
@@ -616,11 +608,12 @@ def register_callback_handlers(dp):
                 success = await db_execute_with_retry(
                     "DELETE FROM access_list WHERE nickname=%s AND tg_user_id=%s",
                     (nick, uid),
-                    action_desc=f"Удаление ника {nick}"
+                    action_desc="Удаление ника"  # Also the query-stats label: no per-nick keys
                 )
                 
                 if success:
                     logger.info(f"✅ Ник {nick} успешно удален из БД.")
+                    allowlist_remove(nick)
                 else:
                     logger.error(f"❌ Не удалось удалить ник {nick} из БД (success=False).")
                 
@@ -642,6 +635,7 @@ def register_callback_handlers(dp):
             uid = int(d.split(":")[1])
             if uid in banned_cache:
                 banned_cache.remove(uid)
+            access_cache_remove(uid)
                 
             await db_execute_with_retry(
                 "DELETE FROM banned_users WHERE tg_user_id=%s",
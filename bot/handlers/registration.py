@@ -13,6 +13,7 @@ from bot.config import ADMIN_ID, REQUEST_PHOTO_FILE_ID, PHOTO_FILE_ID
 from bot.models.states import UserStates
 from bot.models.cache import last_bot_msg
 from bot.database.connection import check_db_ready, db_execute_with_retry, db_fetch_with_retry
+from bot.database.queries import get_user_record
 from bot.utils.ui import send_ui
 
 logger = logging.getLogger(__name__)
@@ -86,38 +87,22 @@ def register_registration_handlers(dp):
     # --- REGISTRATION HANDLERS ---
     
     @dp.callback_query_handler(text="menu_apply", state="*")
-    async def cb_menu_apply(call: types.CallbackQuery, state: FSMContext):
+    async def cb_menu_apply(call: types.CallbackQuery, state: FSMContext, user_record=None):
         """Start registration process"""
         user_id = call.from_user.id
         if not check_db_ready():
             return await call.answer("БД недоступна", show_alert=True)
         
         try:
-            # Check status in access_list
-            row = await db_fetch_with_retry(
-                "SELECT nickname, approved FROM access_list WHERE tg_user_id = %s",
-                (user_id,),
-                fetch="one",
-                action_desc="Ошибка проверки заявки"
-            )
+            # Check status in access_list (record preloaded by AccessPreloadMiddleware)
+            record = user_record if user_record is not None else await get_user_record(user_id)
+            if record is None:
+                return await call.answer("Ошибка БД", show_alert=True)
             
-            if row:
-                nickname, approved = row
-                
-                # Robust check if user is approved
-                is_approved = False
-                if approved == 1 or approved == '1':
-                    is_approved = True
-                elif isinstance(approved, str) and (approved.startswith('{') or approved.startswith('[')):
-                    import json
-                    try:
-                        acc_dict = json.loads(approved)
-                        if isinstance(acc_dict, dict) and any(acc_dict.values()):
-                            is_approved = True
-                    except:
-                        pass
+            if record.registered:
+                nickname = record.nickname
                 
-                if is_approved:
+                if record.has_access:
                     return await call.answer("✅ У вас уже есть доступ! Проверьте профиль.", show_alert=True)
                 
                 # If pending
@@ -9,6 +9,8 @@ from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 
 from bot.config import ADMIN_ID, REQUEST_PHOTO_FILE_ID
 from bot.models.states import UserStates
+from bot.models.cache import access_cache_remove
+from bot.models.allowlist import allowlist_set
 from bot.database.connection import db_execute_with_retry
 from bot.utils.ui import send_ui
 
@@ -92,15 +94,19 @@ def register_script_selection_handlers(dp):
         requested_json = json.dumps(requested_access)
         
         # Save application to DB
-        # approved=0 means pending, requested_access stores what they want
+        # approved=0 means pending (access_mask=0), requested_access stores what they want
         success = await db_execute_with_retry(
-            "INSERT INTO access_list (nickname, tg_user_id, approved, requested_access) VALUES (%s, %s, 0, %s) "
-            "ON DUPLICATE KEY UPDATE nickname=%s, approved=0, requested_access=%s",
+            "INSERT INTO access_list (nickname, tg_user_id, approved, access_mask, requested_access) VALUES (%s, %s, 0, 0, %s) "
+            "ON DUPLICATE KEY UPDATE nickname=%s, approved=0, access_mask=0, requested_access=%s",
             (nick, user_id, requested_json, nick, requested_json),
             action_desc="Ошибка сохранения заявки"
         )
         if not success:
             logger.error("Не удалось сохранить заявку в БД после повторов.")
+        access_cache_remove(user_id)
+        if success:
+            # Re-application resets access (and may rename the row)
+            allowlist_set(nick, 0, user_id)
 
         # Build requested scripts list for display
         requested_scripts_list = []
@@ -13,7 +13,7 @@ from bot.config import ADMIN_ID, PHOTO_FILE_ID, MINE_SCRIPT_BANNER_ID, MINE_SCRI
 from bot.models.cache import banned_cache, last_bot_msg
 from bot.models.states import UserStates, AdminStates
 from bot.database.connection import check_db_ready
-from bot.database.queries import get_access_nickname
+from bot.database.queries import get_access_nickname, get_user_record
 from bot.utils.ui import send_ui, get_menu_markup, get_help_text
 from bot.middleware.security import check_user_status
 
@@ -100,9 +100,9 @@ def register_user_handlers(dp):
         await send_ui(message, caption, markup)
 
     @dp.message_handler(commands=['profile'], state="*")
-    async def cmd_profile(message: types.Message, state: FSMContext):
+    async def cmd_profile(message: types.Message, state: FSMContext, user_record=None):
         """Show user profile"""
-        await show_profile_logic(message, state)
+        await show_profile_logic(message, state, user_record)
 
     @dp.message_handler(commands=['addmy'], state="*")
     async def cmd_addmy(message: types.Message, state: FSMContext):
@@ -123,12 +123,12 @@ def register_user_handlers(dp):
         await send_ui(call, text, markup)
 
     @dp.callback_query_handler(text="menu_profile", state="*")
-    async def cb_menu_profile(call: types.CallbackQuery, state: FSMContext):
+    async def cb_menu_profile(call: types.CallbackQuery, state: FSMContext, user_record=None):
         """Show profile"""
-        await show_profile_logic(call, state)
+        await show_profile_logic(call, state, user_record)
 
     @dp.callback_query_handler(text="menu_scripts", state="*")
-    async def cb_menu_scripts(call: types.CallbackQuery, state: FSMContext):
+    async def cb_menu_scripts(call: types.CallbackQuery, state: FSMContext, user_record=None):
         """Show scripts menu"""
         # Delete script file if it was sent
         file_msg_id = last_bot_msg.get(f"{call.from_user.id}_file")
@@ -141,9 +141,9 @@ def register_user_handlers(dp):
                     pass
             asyncio.create_task(delete_file())
         
-        # Get user's accessible scripts
-        from bot.utils.access_control import get_user_accessible_scripts
-        accessible_scripts = await get_user_accessible_scripts(call.from_user.id)
+        # Get user's accessible scripts (record preloaded by AccessPreloadMiddleware)
+        record = user_record if user_record is not None else await get_user_record(call.from_user.id)
+        accessible_scripts = record.scripts if record else []
         
         if not accessible_scripts:
             # User has no access to any scripts
@@ -468,13 +468,14 @@ def register_user_handlers(dp):
         await call.answer("🛠 Этот скрипт находится в разработке. Ожидайте обновлений!", show_alert=True)
 
 
-async def show_profile_logic(event, state):
+async def show_profile_logic(event, state, user_record=None):
     """
     Show user profile (shared logic for command and callback)
     
     Args:
         event: Message or CallbackQuery
         state: FSM context
+        user_record: UserRecord preloaded by AccessPreloadMiddleware (optional)
     """
     if not await check_user_status(event if isinstance(event, types.Message) else event.message, state):
         return
@@ -486,38 +487,18 @@ async def show_profile_logic(event, state):
     markup = InlineKeyboardMarkup()
     
     try:
-        from bot.database.connection import db_fetch_with_retry
+        record = user_record if user_record is not None else await get_user_record(user_id)
         
-        res = await db_fetch_with_retry(
-            "SELECT nickname, approved FROM access_list WHERE tg_user_id = %s",
-            (user_id,),
-            fetch="one",
-            action_desc="Ошибка загрузки профиля"
-        )
-        
-        if res:
-            nickname, approved = res
-            
-            # Robust check if user is approved (extracted to a variable)
-            is_approved = False
-            if approved == 1 or approved == '1':
-                is_approved = True
-            elif isinstance(approved, str) and (approved.startswith('{') or approved.startswith('[')):
-                import json
-                try:
-                    acc_dict = json.loads(approved)
-                    if isinstance(acc_dict, dict) and any(acc_dict.values()):
-                        is_approved = True
-                except:
-                    pass
+        if record and record.registered:
+            nickname = record.nickname
 
             # If approved (has some access)
-            if is_approved:
-                from bot.utils.access_control import format_user_access_status, get_user_accessible_scripts
+            if record.has_access:
+                from bot.utils.access_control import format_user_access_status
                 
-                # Get access status
+                # Get access status (served from the record cache)
                 access_status = await format_user_access_status(user_id)
-                accessible_scripts = await get_user_accessible_scripts(user_id)
+                accessible_scripts = record.scripts
                 
                 text = (
                     f"👤 <b>Ваш профиль:</b>\n\n"
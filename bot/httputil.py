@@ -0,0 +1,60 @@
+"""
+HTTP helpers module
+Small helpers shared by the bot's web app and the /check worker processes
+"""
+
+
+def etag_matches(if_none_match, etag):
+    """
+    Check an If-None-Match header against an ETag
+    
+    Args:
+        if_none_match: Header value (None if absent)
+        etag: Current strong ETag, quoted
+        
+    Returns:
+        bool: True if the client's copy is current
+    """
+    if not if_none_match:
+        return False
+    for tag in if_none_match.split(','):
+        tag = tag.strip()
+        if tag.startswith('W/'):
+            tag = tag[2:]  # Weak comparison, as RFC 7232 requires for If-None-Match
+        if tag == etag or tag == '*':
+            return True
+    return False
+
+
+def accepts_gzip(accept_encoding):
+    """
+    Check whether an Accept-Encoding header allows a gzip body
+    
+    Codings are parsed with their q-values, so "gzip;q=0" refuses gzip.
+    A "*" entry applies when gzip is not listed by name.
+    
+    Args:
+        accept_encoding: Header value (None if absent)
+        
+    Returns:
+        bool: True if gzip may be sent
+    """
+    if not accept_encoding:
+        return False
+    wildcard = None
+    for item in accept_encoding.split(','):
+        coding, _, params = item.partition(';')
+        coding = coding.strip().lower()
+        quality = 1.0
+        for param in params.split(';'):
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if coding in ('gzip', 'x-gzip'):
+            return quality > 0
+        if coding == '*':
+            wildcard = quality > 0
+    return bool(wildcard)
@@ -0,0 +1,82 @@
+"""
+Metrics module
+Lightweight in-process histograms for latency instrumentation
+"""
+
+import bisect
+
+# Upper bounds of histogram buckets, in milliseconds
+DEFAULT_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+class Histogram:
+    """
+    Fixed-bucket latency histogram
+    
+    observe() is O(log buckets); snapshot() returns counts per bucket
+    plus count, sum, max and approximate percentiles.
+    """
+    __slots__ = ('buckets', 'counts', 'count', 'total', 'max')
+
+    def __init__(self, buckets=DEFAULT_BUCKETS_MS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # Last bucket: above the highest bound
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value_ms):
+        """
+        Record one value
+        
+        Args:
+            value_ms: Duration in milliseconds
+        """
+        self.counts[bisect.bisect_left(self.buckets, value_ms)] += 1
+        self.count += 1
+        self.total += value_ms
+        if value_ms > self.max:
+            self.max = value_ms
+
+    def percentile(self, q):
+        """
+        Approximate percentile (upper bound of the bucket that contains it)
+        
+        Args:
+            q: Fraction between 0 and 1
+            
+        Returns:
+            float: Milliseconds, or 0 if nothing was recorded
+        """
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, bucket_count in zip(self.buckets, self.counts):
+            seen += bucket_count
+            if seen >= rank:
+                return float(bound)
+        return self.max
+
+    def snapshot(self):
+        """
+        Get the histogram as a JSON-friendly dict
+        
+        Returns:
+            dict: count, avg/max/p50/p95/p99 in ms, and non-empty buckets
+        """
+        buckets = {}
+        for bound, bucket_count in zip(self.buckets, self.counts):
+            if bucket_count:
+                buckets[f"le_{bound}"] = bucket_count
+        if self.counts[-1]:
+            buckets["inf"] = self.counts[-1]
+        return {
+            'count': self.count,
+            'avg_ms': round(self.total / self.count, 2) if self.count else 0.0,
+            'max_ms': round(self.max, 2),
+            'p50_ms': self.percentile(0.5),
+            'p95_ms': self.percentile(0.95),
+            'p99_ms': self.percentile(0.99),
+            'buckets': buckets,
+        }
@@ -4,8 +4,16 @@ Security and access control
 """
 
 from .security import check_user_status, ban_user_system
+from .preload import AccessPreloadMiddleware
+from .budget import DbBudgetMiddleware
+from .deliverability import DeliverabilityMiddleware
+from .profiles import ProfileCaptureMiddleware
 
 __all__ = [
     'check_user_status',
     'ban_user_system',
+    'AccessPreloadMiddleware',
+    'DbBudgetMiddleware',
+    'DeliverabilityMiddleware',
+    'ProfileCaptureMiddleware',
 ]
@@ -0,0 +1,31 @@
+"""
+Budget middleware module
+Bounds the total time an update may spend in the database
+"""
+
+from aiogram import types
+from aiogram.dispatcher.middlewares import BaseMiddleware
+
+from bot.database.deadline import start_budget, end_budget
+
+
+class DbBudgetMiddleware(BaseMiddleware):
+    """
+    Give every update a total DB time budget
+
+    Polling processes each update in its own task, so the budget set here
+    is seen by every DB call of that update (and only that update). Once it
+    is spent, DB helpers fail fast instead of starting another attempt.
+    """
+
+    def __init__(self, budget):
+        super().__init__()
+        self.budget = budget
+
+    async def on_pre_process_update(self, update: types.Update, data: dict):
+        data['_db_budget'] = start_budget(self.budget)
+
+    async def on_post_process_update(self, update: types.Update, result, data: dict):
+        token = data.pop('_db_budget', None)
+        if token is not None:
+            end_budget(token)
@@ -0,0 +1,32 @@
+"""
+Deliverability middleware module
+Revives chats marked as undeliverable when their user shows up
+"""
+
+from aiogram import types
+from aiogram.dispatcher.middlewares import BaseMiddleware
+
+from bot.deliverability import note_chat_alive, note_chat_dead
+
+
+class DeliverabilityMiddleware(BaseMiddleware):
+    """
+    Keep the undeliverable-chat marks in sync with what users do
+
+    A message or button press from a user means the bot can reach them
+    again. Telegram also reports (my_chat_member) when a user blocks or
+    unblocks the bot, which marks the chat before any send has to fail.
+    """
+
+    async def on_pre_process_update(self, update: types.Update, data: dict):
+        member = update.my_chat_member
+        if member is not None:
+            if member.chat.type == types.ChatType.PRIVATE:
+                if member.new_chat_member.status == types.ChatMemberStatus.KICKED:
+                    note_chat_dead(member.chat.id, "blocked")
+                else:
+                    note_chat_alive(member.chat.id)
+            return
+        event = update.message or update.callback_query
+        if event is not None and event.from_user:
+            note_chat_alive(event.from_user.id)
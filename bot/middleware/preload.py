@@ -0,0 +1,26 @@
+"""
+Preload middleware module
+Batches access lookups of incoming updates
+"""
+
+from aiogram import types
+from aiogram.dispatcher.middlewares import BaseMiddleware
+
+from bot.database.loader import access_loader
+
+
+class AccessPreloadMiddleware(BaseMiddleware):
+    """
+    Resolve the UserRecord of the update's sender before handlers run
+    
+    Updates fetched together by polling are processed concurrently, so their
+    lookups land in the same batch window and cost one query. Handlers get the
+    record as the `user_record` argument if they declare it.
+    """
+
+    async def on_pre_process_message(self, message: types.Message, data: dict):
+        if message.from_user:
+            data['user_record'] = await access_loader.load(message.from_user.id)
+
+    async def on_pre_process_callback_query(self, call: types.CallbackQuery, data: dict):
+        data['user_record'] = await access_loader.load(call.from_user.id)
@@ -0,0 +1,25 @@
+"""
+Profiles middleware module
+Captures usernames and names of users from incoming updates
+"""
+
+from aiogram import types
+from aiogram.dispatcher.middlewares import BaseMiddleware
+
+from bot.models.profiles import profile_store
+
+
+class ProfileCaptureMiddleware(BaseMiddleware):
+    """
+    Remember the username and name of every update's sender
+    
+    Memory only; changes are written to user_profiles in batches by the
+    profile writer. Admin listings render names from these profiles
+    instead of calling get_chat for every row.
+    """
+
+    async def on_pre_process_update(self, update: types.Update, data: dict):
+        event = update.message or update.edited_message or update.callback_query or update.my_chat_member
+        user = event.from_user if event is not None else None
+        if user is not None and not user.is_bot:
+            profile_store.capture(user.id, user.username, user.full_name)
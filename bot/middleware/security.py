@@ -11,7 +11,7 @@ from aiogram.dispatcher import FSMContext
 from bot.config import ADMIN_ID, PHOTO_FILE_ID
 from bot.models.states import UserStates
 from bot.models.cache import banned_cache, last_bot_msg
-from bot.database.connection import check_db_ready, db_execute_with_retry
+from bot.database.connection import check_db_ready, unit_of_work
 
 logger = logging.getLogger(__name__)
 
@@ -52,7 +52,6 @@ async def ban_user_system(user_id, fullname, username, reason):
         reason: Ban reason
     """
     from aiogram import Bot
-    from bot.config import API_TOKEN
     from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
     
     if user_id in banned_cache:
@@ -60,29 +59,32 @@ async def ban_user_system(user_id, fullname, username, reason):
     
     banned_cache.add(user_id)
     
-    # Save to database
+    # Save to database (both statements on one pooled connection)
     if check_db_ready():
-        success = await db_execute_with_retry(
-            "INSERT IGNORE INTO banned_users (tg_user_id, reason) VALUES (%s, %s)",
-            (user_id, reason),
-            action_desc="Ошибка записи бана"
-        )
-        if not success:
-            logger.error("Не удалось записать бан в БД после повторов.")
-        
-        # Remove any pending access request
-        await db_execute_with_retry(
-            "DELETE FROM access_list WHERE tg_user_id=%s",
-            (user_id,),
-            action_desc="Ошибка удаления заявки при бане"
-        )
+        async with unit_of_work() as uow:
+            success = await uow.execute(
+                "INSERT IGNORE INTO banned_users (tg_user_id, reason) VALUES (%s, %s)",
+                (user_id, reason),
+                action_desc="Ошибка записи бана"
+            )
+            if not success:
+                logger.error("Не удалось записать бан в БД после повторов.")
+            
+            # Remove any pending access request
+            await uow.execute(
+                "DELETE FROM access_list WHERE tg_user_id=%s",
+                (user_id,),
+                action_desc="Ошибка удаления заявки при бане"
+            )
         
         # Clear access cache
         from bot.models.cache import access_cache_remove
+        from bot.models.allowlist import allowlist_remove_user
         access_cache_remove(user_id)
+        allowlist_remove_user(user_id)
     
-    # Create bot instance for sending messages
-    bot = Bot(token=API_TOKEN)
+    # Dispatcher's bot: sends go through the outbound scheduler and its shared session
+    bot = Bot.get_current()
     
     # Notify admin
     user_link = f"@{username}" if username else f"<a href='tg://user?id={user_id}'>{fullname}</a>"
@@ -108,5 +110,3 @@ async def ban_user_system(user_id, fullname, username, reason):
         last_bot_msg[user_id] = None  # Reset cache for new context
     except Exception as e:
         logger.warning(f"Не смог отправить уведомление о бане: {e}")
-    
-    await bot.session.close()
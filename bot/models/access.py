@@ -0,0 +1,64 @@
+"""
+Access mask module
+Bitmask representation of per-script access stored in access_list.access_mask
+"""
+
+# Bit of each script in the access_mask column
+SCRIPT_BITS = {
+    'mine': 1,
+    'oskolki': 2,
+}
+SCRIPT_NAMES = tuple(SCRIPT_BITS)
+FULL_ACCESS_MASK = 3  # Every script (legacy approved = 1)
+
+
+def access_to_mask(access):
+    """
+    Convert an access dictionary to a bitmask
+    
+    Args:
+        access: Dictionary like {'mine': True, 'oskolki': False} or None
+        
+    Returns:
+        int: Bitmask of approved scripts (0 if none)
+    """
+    mask = 0
+    if access:
+        for name, bit in SCRIPT_BITS.items():
+            if access.get(name):
+                mask |= bit
+    return mask
+
+
+def mask_to_access(mask):
+    """
+    Convert a bitmask to an access dictionary
+    
+    Args:
+        mask: Value of the access_mask column
+        
+    Returns:
+        dict: Dictionary like {'mine': True, 'oskolki': False} or None if no access
+    """
+    if not mask:
+        return None
+    return {name: bool(mask & bit) for name, bit in SCRIPT_BITS.items()}
+
+
+def masks_with_script(script_name):
+    """
+    All mask values that include a script
+    
+    Used as `access_mask IN (...)`, so the filter can use the column index
+    (a bitwise AND in SQL cannot).
+    
+    Args:
+        script_name: Script identifier ('mine', 'oskolki')
+        
+    Returns:
+        tuple: Matching mask values, empty for an unknown script
+    """
+    bit = SCRIPT_BITS.get(script_name)
+    if bit is None:
+        return ()
+    return tuple(mask for mask in range(1, FULL_ACCESS_MASK + 1) if mask & bit)
@@ -0,0 +1,311 @@
+"""
+Allow-list module
+Materialized per-script nickname lists served by the /check endpoint
+"""
+
+import asyncio
+import gzip
+import hashlib
+import json
+import time
+from collections import deque
+
+from bot.config import ALLOWLIST_JOURNAL_MAX
+from .access import SCRIPT_BITS
+
+
+class CheckPayload:
+    """Serialized /check response of one script for one allow-list version"""
+    __slots__ = ('body', 'gzipped', 'etag')
+
+    def __init__(self, body):
+        self.body = body
+        # Content hash: identical lists get identical ETags across restarts
+        self.etag = '"' + hashlib.sha1(body).hexdigest()[:20] + '"'
+        gzipped = gzip.compress(body, compresslevel=9, mtime=0)
+        self.gzipped = gzipped if len(gzipped) < len(body) else None  # Tiny lists are not worth it
+
+
+EMPTY_PAYLOAD = CheckPayload(b"[]")
+
+
+class ChangeNotifier:
+    """
+    Wakes every waiter at once when the allow-list changes
+    
+    All waiters await one shared future; notify() resolves it and the next
+    wait() starts a new one. Waiters are shielded so a timed-out client
+    does not cancel it for the others. An idle client costs one pending
+    future, with no task and no polling.
+    """
+
+    def __init__(self):
+        self._future = None  # Created lazily inside the running loop
+        self.closed = False
+
+    async def wait(self, timeout):
+        """
+        Wait for the next change
+        
+        Args:
+            timeout: Maximum wait (seconds)
+            
+        Returns:
+            bool: True if a change happened, False on timeout or shutdown
+        """
+        if self.closed:
+            return False
+        if self._future is None:
+            self._future = asyncio.get_running_loop().create_future()
+        try:
+            await asyncio.wait_for(asyncio.shield(self._future), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return not self.closed
+
+    def notify(self):
+        """Wake all current waiters"""
+        if self._future is not None:
+            if not self._future.done():
+                self._future.set_result(None)
+            self._future = None
+
+    def close(self):
+        """Release all waiters for shutdown"""
+        self.closed = True
+        self.notify()
+
+
+class AllowList:
+    """
+    Nicknames allowed to use each script, kept in sync with access_list
+    
+    Built once from the database, then updated in place by the handlers
+    that write access (approve, revoke, delete, ban). The JSON body of
+    each script is serialized (and gzipped) once per change, so a read is
+    a dict lookup.
+    
+    Every change is appended to a bounded journal of
+    (version, nickname, old_mask, new_mask), which lets clients fetch only
+    what changed since the version they have. Versions start from the
+    current time in milliseconds, so a version from before a restart is
+    always older than the new journal and gets a full snapshot.
+    """
+
+    def __init__(self, journal_max=ALLOWLIST_JOURNAL_MAX):
+        self.loaded = False
+        self.version = int(time.time() * 1000)  # Incremented on every change
+        self._masks = {}  # nickname -> access_mask (> 0 only)
+        self._user_by_nick = {}  # nickname -> user_id
+        self._nick_by_user = {}  # user_id -> nickname
+        self._payloads = {}  # script_name -> CheckPayload of the current version
+        self._journal = deque()
+        self._journal_max = journal_max
+        self._journal_base = self.version  # Changes after this version are all in the journal
+        self.notifier = ChangeNotifier()
+
+    def __len__(self):
+        return len(self._masks)
+
+    def replace(self, rows):
+        """
+        Rebuild from a full snapshot
+        
+        Only nicknames whose access differs are journaled, so a periodic
+        rebuild that finds nothing new keeps the version (and ETags).
+        
+        Args:
+            rows: Iterable of (user_id, nickname, access_mask)
+        """
+        old_masks = self._masks
+        self._masks = {}
+        self._user_by_nick = {}
+        self._nick_by_user = {}
+        for user_id, nickname, mask in rows:
+            if mask:
+                self._masks[nickname] = mask
+                self._link(nickname, user_id)
+        if not self.loaded:
+            # Initial load: nothing to diff against
+            self.loaded = True
+            self.version += 1
+            self._journal.clear()
+            self._journal_base = self.version
+            self._payloads = {}
+            self.notifier.notify()
+            return
+        for nickname in old_masks.keys() | self._masks.keys():
+            old_mask = old_masks.get(nickname, 0)
+            new_mask = self._masks.get(nickname, 0)
+            if old_mask != new_mask:
+                self._changed(nickname, old_mask, new_mask)
+
+    def set(self, nickname, mask, user_id=None):
+        """
+        Set the access of one nickname (mask 0 removes it)
+        
+        Args:
+            nickname: User's nickname
+            mask: New access_mask
+            user_id: Telegram user ID of the row, if known
+        """
+        if user_id is not None:
+            # The row of a user can be renamed (re-application with a new nick)
+            old_nickname = self._nick_by_user.get(user_id)
+            if old_nickname is not None and old_nickname != nickname:
+                self.remove(old_nickname)
+        if not mask:
+            self.remove(nickname)
+            return
+        self._link(nickname, user_id)
+        old_mask = self._masks.get(nickname, 0)
+        if old_mask != mask:
+            self._masks[nickname] = mask
+            self._changed(nickname, old_mask, mask)
+
+    def remove(self, nickname):
+        """Remove a nickname from all lists"""
+        user_id = self._user_by_nick.pop(nickname, None)
+        if user_id is not None:
+            self._nick_by_user.pop(user_id, None)
+        old_mask = self._masks.pop(nickname, None)
+        if old_mask is not None:
+            self._changed(nickname, old_mask, 0)
+
+    def remove_user(self, user_id):
+        """Remove the nickname of a user from all lists"""
+        nickname = self._nick_by_user.get(user_id)
+        if nickname is not None:
+            self.remove(nickname)
+
+    def masks(self):
+        """Copy of the nickname -> access_mask index"""
+        return dict(self._masks)
+
+    def nicknames(self, script_name):
+        """
+        Sorted nicknames allowed to use a script
+        
+        Args:
+            script_name: Script identifier ('mine', 'oskolki')
+            
+        Returns:
+            list: Nicknames, empty for an unknown script
+        """
+        bit = SCRIPT_BITS.get(script_name)
+        if bit is None:
+            return []
+        return sorted(nick for nick, mask in self._masks.items() if mask & bit)
+
+    def allowed(self, nickname, script_name):
+        """
+        Check one nickname (a dict lookup)
+        
+        Args:
+            nickname: User's nickname
+            script_name: Script identifier
+            
+        Returns:
+            bool: True if the nickname may use the script
+        """
+        return bool(self._masks.get(nickname, 0) & SCRIPT_BITS.get(script_name, 0))
+
+    def delta(self, script_name, since):
+        """
+        Nicknames added to and removed from a script's list after a version
+        
+        Args:
+            script_name: Script identifier
+            since: Version the client has
+            
+        Returns:
+            tuple: (added, removed) sorted lists, or None if the journal no
+            longer covers `since` and a full snapshot is needed
+        """
+        bit = SCRIPT_BITS.get(script_name)
+        if bit is None or since < self._journal_base or since > self.version:
+            return None
+        # Compare the first known mask after `since` with the current one
+        before = {}
+        for version, nickname, old_mask, new_mask in reversed(self._journal):
+            if version <= since:
+                break
+            before[nickname] = old_mask
+        added = []
+        removed = []
+        for nickname, old_mask in before.items():
+            had = bool(old_mask & bit)
+            has = bool(self._masks.get(nickname, 0) & bit)
+            if has and not had:
+                added.append(nickname)
+            elif had and not has:
+                removed.append(nickname)
+        return sorted(added), sorted(removed)
+
+    def payload(self, script_name):
+        """
+        Serialized JSON list of a script, built at most once per version
+        
+        Args:
+            script_name: Script identifier
+            
+        Returns:
+            CheckPayload: JSON array of nicknames, its gzip and ETag
+        """
+        payload = self._payloads.get(script_name)
+        if payload is None:
+            if script_name not in SCRIPT_BITS:
+                return EMPTY_PAYLOAD
+            payload = CheckPayload(json.dumps(self.nicknames(script_name)).encode())
+            self._payloads[script_name] = payload
+        return payload
+
+    def _link(self, nickname, user_id):
+        """Remember which user owns a nickname"""
+        if user_id is not None:
+            self._user_by_nick[nickname] = user_id
+            self._nick_by_user[user_id] = nickname
+
+    def _changed(self, nickname, old_mask, new_mask):
+        """Bump the version, journal the change and drop serialized payloads"""
+        self.version += 1
+        self._payloads = {}
+        if len(self._journal) >= self._journal_max:
+            self._journal_base = self._journal.popleft()[0]
+        self._journal.append((self.version, nickname, old_mask, new_mask))
+        self.notifier.notify()
+
+
+allowlist = AllowList()
+
+
+def allowlist_set(nickname, mask, user_id=None):
+    """
+    Update the allow-lists after access of a nickname was written to the DB
+    
+    Args:
+        nickname: User's nickname
+        mask: New access_mask (0 removes the nickname)
+        user_id: Telegram user ID, if known
+    """
+    allowlist.set(nickname, mask, user_id)
+
+
+def allowlist_remove(nickname):
+    """
+    Remove a nickname from the allow-lists after its row was deleted
+    
+    Args:
+        nickname: User's nickname
+    """
+    allowlist.remove(nickname)
+
+
+def allowlist_remove_user(user_id):
+    """
+    Remove a user from the allow-lists after their row was deleted
+    
+    Args:
+        user_id: Telegram user ID
+    """
+    allowlist.remove_user(user_id)
@@ -4,66 +4,212 @@ In-memory caches for performance optimization
 """
 
 import time
-from bot.config import ACCESS_CACHE_TTL, ACCESS_CACHE_MAX
+from collections import OrderedDict
+from bot.config import ACCESS_CACHE_TTL, ACCESS_CACHE_MAX, ACCESS_NEGATIVE_CACHE_TTL, ACCESS_NEGATIVE_CACHE_MAX
+from .records import UserRecord
+
+
+class AccessCacheEntry:
+    """Single access cache slot"""
+    __slots__ = ('record', 'expires_at')
+
+    def __init__(self, record, expires_at):
+        self.record = record  # UserRecord
+        self.expires_at = expires_at
+
+
+class AccessCache:
+    """
+    TTL + LRU cache of UserRecord objects keyed by user ID
+
+    All operations are O(1): entries live in an OrderedDict ordered from
+    least to most recently used. Expiry is lazy - an expired entry is dropped
+    when it is read, or when it reaches the LRU end during an insert.
+    A nickname -> user IDs index is kept in sync so entries can be
+    invalidated by nickname without a scan.
+    """
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()  # user_id -> AccessCacheEntry
+        self._by_nick = {}  # nickname -> set of user_ids
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, user_id):
+        return self.get(user_id) is not None
+
+    def get(self, user_id):
+        """
+        Get a live record and mark it as recently used
+
+        Args:
+            user_id: Telegram user ID
+
+        Returns:
+            UserRecord or None if missing or expired
+        """
+        entry = self._data.get(user_id)
+        if entry is None:
+            return None
+        if entry.expires_at <= time.time():
+            self.pop(user_id)
+            return None
+        self._data.move_to_end(user_id)
+        return entry.record
+
+    def set(self, record):
+        """
+        Add or refresh a record, evicting the least recently used one if full
+
+        Args:
+            record: UserRecord to cache under record.user_id
+        """
+        user_id = record.user_id
+        nickname = record.nickname
+        now = time.time()
+        old = self._data.get(user_id)
+        if old is not None:
+            self._data.move_to_end(user_id)
+            if old.record.nickname != nickname:
+                self._unindex(user_id, old.record.nickname)
+        else:
+            self._purge_oldest(now)
+            if len(self._data) >= self.maxsize:
+                self.pop(next(iter(self._data)))
+        self._data[user_id] = AccessCacheEntry(record, now + self.ttl)
+        self._by_nick.setdefault(nickname, set()).add(user_id)
+
+    def pop(self, user_id):
+        """
+        Remove an entry
+
+        Args:
+            user_id: Telegram user ID
+
+        Returns:
+            UserRecord or None if it was not cached
+        """
+        entry = self._data.pop(user_id, None)
+        if entry is None:
+            return None
+        self._unindex(user_id, entry.record.nickname)
+        return entry.record
+
+    def pop_by_nick(self, nickname):
+        """
+        Remove all entries cached under a nickname
+
+        Args:
+            nickname: User's nickname
+
+        Returns:
+            list: User IDs that were removed
+        """
+        user_ids = self._by_nick.pop(nickname, ())
+        for user_id in user_ids:
+            self._data.pop(user_id, None)
+        return list(user_ids)
+
+    def items(self):
+        """Snapshot of (user_id, record) pairs, including not yet purged ones"""
+        return [(user_id, entry.record) for user_id, entry in self._data.items()]
+
+    def clear(self):
+        """Drop all entries"""
+        self._data.clear()
+        self._by_nick.clear()
+
+    def _unindex(self, user_id, nickname):
+        """Drop user_id from the nickname index"""
+        user_ids = self._by_nick.get(nickname)
+        if user_ids is not None:
+            user_ids.discard(user_id)
+            if not user_ids:
+                del self._by_nick[nickname]
+
+    def _purge_oldest(self, now):
+        """Drop the LRU entry if it has already expired (amortized cleanup)"""
+        if self._data:
+            user_id = next(iter(self._data))
+            if self._data[user_id].expires_at <= now:
+                self.pop(user_id)
+
 
 # --- CACHE STORES ---
 spam_control = {}  # user_id -> timestamp
 banned_cache = set()  # Set of banned user IDs
 last_bot_msg = {}  # user_id -> message_id for deletion
 pending_cache = {}  # admin_id -> list of (nick, uid)
-access_cache = {}  # user_id -> (nickname, expires_at)
+undeliverable_chats = {}  # chat_id -> why messages can't reach it (blocked, deactivated, ...)
+# user_id -> UserRecord of users with at least one approved script
+access_cache = AccessCache(ACCESS_CACHE_MAX, ACCESS_CACHE_TTL)
+# user_id -> UserRecord of users without access (pending or not registered)
+access_negative_cache = AccessCache(ACCESS_NEGATIVE_CACHE_MAX, ACCESS_NEGATIVE_CACHE_TTL)
+
+
+def user_record_get(user_id):
+    """
+    Get a cached user record
+
+    Args:
+        user_id: Telegram user ID
+
+    Returns:
+        UserRecord or None if not cached
+    """
+    return access_cache.get(user_id) or access_negative_cache.get(user_id)
 
 
-def access_cache_cleanup():
-    """Remove expired entries from access cache"""
-    now = time.time()
-    for uid, val in list(access_cache.items()):
-        # Handle tuple values: (nick, expires_at, [scripts])
-        if len(val) >= 2:
-            expires_at = val[1]
-            if expires_at <= now:
-                access_cache.pop(uid, None)
+def user_record_put(record):
+    """
+    Cache a user record (write-through after a DB read or write)
 
+    Records with access go to the main cache, the rest to the short-lived
+    negative cache. A stale copy in the other cache is dropped.
 
-def access_cache_set(user_id, nickname, access_dict=None):
+    Args:
+        record: UserRecord
     """
-    Add or update user in access cache
-    
+    if record.has_access:
+        access_negative_cache.pop(record.user_id)
+        access_cache.set(record)
+    else:
+        access_cache.pop(record.user_id)
+        access_negative_cache.set(record)
+
+
+def access_cache_set(user_id, nickname, access_dict):
+    """
+    Cache the state of a user right after an admin approved or revoked access
+
     Args:
         user_id: Telegram user ID
-        nickname: User's approved nickname
-        access_dict: Dictionary of approved scripts (optional)
+        nickname: User's nickname
+        access_dict: Full dictionary of approved scripts
     """
-    access_cache_cleanup()
-    if len(access_cache) >= ACCESS_CACHE_MAX:
-        access_cache.pop(next(iter(access_cache)), None)
-    
-    # Store timestamp, nickname and access dict
-    # Structure: (nickname, expires_at, access_dict)
-    # Default access_dict to empty if not provided, though typically should be provided
-    access_cache[user_id] = (nickname, time.time() + ACCESS_CACHE_TTL, access_dict)
+    user_record_put(UserRecord(user_id, nickname, access_dict))
 
 
 def access_cache_remove(user_id):
     """
     Remove user from access cache by user ID
-    
+
     Args:
         user_id: Telegram user ID
     """
-    access_cache.pop(user_id, None)
+    access_cache.pop(user_id)
+    access_negative_cache.pop(user_id)
 
 
 def access_cache_remove_by_nick(nickname):
     """
     Remove user from access cache by nickname
-    
+
     Args:
         nickname: User's nickname
     """
-    for uid, val in list(access_cache.items()):
-        # Handle both 2-tuple (legacy) and 3-tuple (new) structures
-        if len(val) >= 1:
-            cached_nick = val[0]
-            if cached_nick == nickname:
-                access_cache.pop(uid, None)
+    access_cache.pop_by_nick(nickname)
+    access_negative_cache.pop_by_nick(nickname)
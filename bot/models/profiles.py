@@ -0,0 +1,101 @@
+"""
+Profiles module
+In-memory usernames and names of users, captured from incoming updates
+"""
+
+from collections import OrderedDict
+
+from bot.config import PROFILE_CACHE_MAX
+from .records import UserProfile
+
+
+class ProfileStore:
+    """
+    LRU map user_id -> UserProfile plus the changes not yet written to the DB
+    
+    capture() is called for every update and only touches memory; changed
+    profiles wait in a dirty map that the writer (bot/database/profiles.py)
+    flushes in batches. A user who changes their name twice between
+    flushes costs one row.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._profiles = OrderedDict()
+        self._dirty = {}
+        self.counters = {
+            'captured': 0,  # Changed profiles seen in updates
+            'written': 0,   # Profiles saved by the writer
+            'loaded': 0,    # Profiles read from the DB for listings
+        }
+
+    def __len__(self):
+        return len(self._profiles)
+
+    @property
+    def pending(self):
+        """Profiles waiting to be written"""
+        return len(self._dirty)
+
+    def get(self, user_id):
+        """Cached profile or None"""
+        profile = self._profiles.get(user_id)
+        if profile is not None:
+            self._profiles.move_to_end(user_id)
+        return profile
+
+    def put(self, user_id, profile):
+        """Cache a profile read from the DB (nothing to write)"""
+        self._profiles[user_id] = profile
+        self._profiles.move_to_end(user_id)
+        while len(self._profiles) > self.max_size:
+            self._profiles.popitem(last=False)
+
+    def capture(self, user_id, username, full_name):
+        """
+        Remember the profile of an update's sender
+        
+        Args:
+            user_id: Telegram user ID
+            username: Username without @, or None
+            full_name: First and last name
+            
+        Returns:
+            bool: True if the profile is new or changed (queued for writing)
+        """
+        profile = UserProfile(username, full_name)
+        if self.get(user_id) == profile:
+            return False
+        self.put(user_id, profile)
+        self._dirty[user_id] = profile
+        self.counters['captured'] += 1
+        return True
+
+    def take_dirty(self, limit):
+        """
+        Take up to `limit` profiles to write
+        
+        Returns:
+            list: (user_id, UserProfile) tuples
+        """
+        batch = []
+        for user_id in list(self._dirty)[:limit]:
+            batch.append((user_id, self._dirty.pop(user_id)))
+        return batch
+
+    def requeue(self, batch):
+        """Put back profiles whose write failed (newer captures win)"""
+        for user_id, profile in batch:
+            self._dirty.setdefault(user_id, profile)
+
+    def stats(self):
+        """
+        Get store metrics
+        
+        Returns:
+            dict: Sizes and counters
+        """
+        return {'cached': len(self._profiles), 'pending': len(self._dirty), 'counters': dict(self.counters)}
+
+
+profile_store = ProfileStore(PROFILE_CACHE_MAX)
@@ -0,0 +1,91 @@
+"""
+Records module
+Typed views of database rows shared by handlers and caches
+"""
+
+from .access import SCRIPT_NAMES
+
+
+class UserRecord:
+    """
+    Everything the bot knows about a user's access_list row
+
+    nickname is None when the user has no row (not registered).
+    access is a dict like {'mine': True, 'oskolki': False}, or None if the
+    user has no approved script.
+    """
+    __slots__ = ('user_id', 'nickname', 'access')
+
+    def __init__(self, user_id, nickname=None, access=None):
+        self.user_id = user_id
+        self.nickname = nickname
+        self.access = access
+
+    @property
+    def registered(self):
+        """True if the user has a row in access_list"""
+        return self.nickname is not None
+
+    @property
+    def has_access(self):
+        """True if at least one script is approved"""
+        return bool(self.access) and any(self.access.values())
+
+    @property
+    def scripts(self):
+        """List of approved script names"""
+        if not self.access:
+            return []
+        return [name for name in SCRIPT_NAMES if self.access.get(name)]
+
+    def __repr__(self):
+        return f"UserRecord(user_id={self.user_id!r}, nickname={self.nickname!r}, access={self.access!r})"
+
+
+class BroadcastJob:
+    """
+    A broadcast_jobs row
+
+    cursor_seq is the seq of the last recipient handed to the sender:
+    recipients above it are still to be sent, those at or below it were
+    attempted (a restart never sends to them again).
+    """
+    __slots__ = ('job_id', 'target', 'text', 'photo', 'document', 'admin_chat_id', 'status_message_id',
+                 'total', 'sent', 'failed', 'cursor_seq')
+
+    def __init__(self, job_id, target, text, photo, document, admin_chat_id, status_message_id,
+                 total=0, sent=0, failed=0, cursor_seq=0):
+        self.job_id = job_id
+        self.target = target
+        self.text = text
+        self.photo = photo
+        self.document = document
+        self.admin_chat_id = admin_chat_id
+        self.status_message_id = status_message_id
+        self.total = total
+        self.sent = sent
+        self.failed = failed
+        self.cursor_seq = cursor_seq
+
+    @property
+    def unconfirmed(self):
+        """Recipients without a recorded result (once finished: restart mid-chunk or a lost write)"""
+        return max(0, self.total - self.sent - self.failed)
+
+    def __repr__(self):
+        return f"BroadcastJob(job_id={self.job_id!r}, sent={self.sent!r}/{self.total!r})"
+
+
+class UserProfile:
+    """Telegram username and display name of a user, as last seen in an update"""
+    __slots__ = ('username', 'full_name')
+
+    def __init__(self, username, full_name):
+        self.username = username
+        self.full_name = full_name
+
+    def __eq__(self, other):
+        return isinstance(other, UserProfile) and (self.username, self.full_name) == (other.username, other.full_name)
+
+    def __repr__(self):
+        return f"UserProfile(username={self.username!r}, full_name={self.full_name!r})"
@@ -0,0 +1,344 @@
+"""
+Outbound scheduler module
+Rate-limited, prioritized delivery of messages to Telegram
+
+Telegram allows about 30 messages per second per bot and about one per
+second per chat; above that it answers 429 (RetryAfter). Every
+chat-bound send/edit of the bot goes through one OutboundScheduler:
+- a global limiter keeps the whole bot under the API ceiling,
+- per-chat limiters (with a small burst for quick interactive replies)
+  keep single chats under theirs; they pace new messages only: edits
+  (inline-menu navigation edits the same message on every tap) are paced
+  by the global limiter alone, so menus follow taps without queueing
+  behind the 1 msg/s chat limit,
+- a few workers send concurrently, so throughput is not capped by the
+  latency of one request,
+- RetryAfter pauses sending for the time Telegram asks and puts the
+  message back at the front of its lane,
+- interactive replies (the default lane) always go before bulk sends.
+"""
+
+import asyncio
+import contextvars
+import logging
+from collections import deque
+from functools import partial
+
+from aiogram import Bot
+from aiogram.utils.exceptions import RetryAfter
+
+from bot.deliverability import ChatUndeliverable, undeliverable_reason, note_send_failure
+from bot.config import (
+    OUTBOUND_GLOBAL_RATE, OUTBOUND_CHAT_RATE, OUTBOUND_CHAT_BURST, OUTBOUND_WORKERS,
+    OUTBOUND_MAX_RETRIES
+)
+
+logger = logging.getLogger(__name__)
+
+# Lanes, in the order they are served
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BULK = 1
+
+# Bot API methods that count against the per-chat and global limits
+RATE_LIMITED_METHODS = frozenset((
+    'sendMessage', 'sendPhoto', 'sendDocument', 'sendVideo', 'sendAnimation', 'sendAudio',
+    'sendVoice', 'sendSticker', 'sendMediaGroup', 'copyMessage', 'forwardMessage',
+    'editMessageText', 'editMessageCaption', 'editMessageMedia', 'editMessageReplyMarkup',
+))
+# Of those, the methods that skip the per-chat limiter (global limit only)
+UNPACED_METHODS = frozenset((
+    'editMessageText', 'editMessageCaption', 'editMessageMedia', 'editMessageReplyMarkup',
+))
+
+# Jobs looked at per lane when the head of a lane waits for its chat
+_SCAN_LIMIT = 64
+# Per-chat limiters kept before idle ones are dropped
+_CHAT_LIMITERS_MAX = 10000
+
+# Lane of sends made from the current task (broadcasts switch to PRIORITY_BULK)
+_priority = contextvars.ContextVar('outbound_priority', default=PRIORITY_INTERACTIVE)
+
+
+def set_outbound_priority(priority):
+    """
+    Put all further sends of the current task into a lane
+
+    Args:
+        priority: PRIORITY_INTERACTIVE or PRIORITY_BULK
+
+    Returns:
+        Token to restore the previous lane with reset_outbound_priority()
+    """
+    return _priority.set(priority)
+
+
+def reset_outbound_priority(token):
+    """Restore the lane saved by set_outbound_priority()"""
+    _priority.reset(token)
+
+
+class RateLimiter:
+    """
+    Token bucket in GCRA form (one timestamp instead of a token count)
+
+    `rate` sends per second on average, up to `burst` back to back.
+    """
+    __slots__ = ('interval', 'tolerance', 'tat')
+
+    def __init__(self, rate, burst):
+        self.interval = 1.0 / rate
+        self.tolerance = (burst - 1) * self.interval
+        self.tat = 0.0  # Theoretical arrival time of the next send
+
+    def ready_at(self):
+        """Earliest loop time the next send may start"""
+        return self.tat - self.tolerance
+
+    def reserve(self, now):
+        """
+        Book the next send slot
+
+        Args:
+            now: Current loop time
+
+        Returns:
+            float: Seconds to wait before sending (0 if a token is available now)
+        """
+        start = max(now, self.ready_at())
+        self.tat = max(self.tat, start) + self.interval
+        return start - now
+
+    def block_until(self, when):
+        """Allow no send before `when` (RetryAfter)"""
+        self.tat = max(self.tat, when + self.tolerance)
+
+
+class _Job:
+    """One queued API request"""
+    __slots__ = ('chat_id', 'call', 'future', 'priority', 'paced', 'retries')
+
+    def __init__(self, chat_id, call, future, priority, paced):
+        self.chat_id = chat_id
+        self.call = call  # Zero-argument coroutine function performing the request
+        self.future = future
+        self.priority = priority
+        self.paced = paced  # False: only the global limiter applies
+        self.retries = 0
+
+
+class OutboundScheduler:
+    """Queues, paces and sends chat-bound API requests (see module docstring)"""
+
+    def __init__(self, global_rate, chat_rate, chat_burst, workers, max_retries):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.worker_count = workers
+        self.max_retries = max_retries
+        self._lanes = (deque(), deque())
+        self._global = RateLimiter(global_rate, max(1, int(global_rate)))
+        self._chats = {}  # chat_id -> RateLimiter
+        self._paused_until = 0.0
+        self._wakeup = None
+        self._workers = []
+        self.counters = {
+            'sent': 0,
+            'failed': 0,
+            'retry_after': 0,  # 429 answers (message requeued)
+        }
+
+    @property
+    def running(self):
+        """True while workers are sending"""
+        return bool(self._workers)
+
+    @property
+    def queued(self):
+        """Requests waiting per lane"""
+        return {'interactive': len(self._lanes[PRIORITY_INTERACTIVE]), 'bulk': len(self._lanes[PRIORITY_BULK])}
+
+    def start(self):
+        """Start the workers (inside the running loop)"""
+        if self._workers:
+            return
+        self._wakeup = asyncio.Event()
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.worker_count)]
+
+    async def stop(self):
+        """Stop the workers and cancel requests still queued"""
+        workers, self._workers = self._workers, []
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        for lane in self._lanes:
+            while lane:
+                lane.popleft().future.cancel()
+
+    def submit(self, chat_id, call, priority=None, paced=True):
+        """
+        Queue a request
+
+        Args:
+            chat_id: Target chat
+            call: Zero-argument coroutine function performing the request
+            priority: Lane, default: the lane of the current task
+            paced: Whether the chat's own limiter applies (False for edits)
+
+        Returns:
+            asyncio.Future with the API result (or its exception)
+        """
+        if priority is None:
+            priority = _priority.get()
+        future = asyncio.get_running_loop().create_future()
+        self._lanes[priority].append(_Job(chat_id, call, future, priority, paced))
+        self._wakeup.set()
+        return future
+
+    def stats(self):
+        """
+        Get scheduler metrics
+
+        Returns:
+            dict: Queue lengths, counters and tracked chats
+        """
+        return {
+            'running': self.running,
+            'queued': self.queued,
+            'chats': len(self._chats),
+            'counters': dict(self.counters),
+        }
+
+    def _chat_limiter(self, chat_id):
+        """Limiter of a chat, created on first use"""
+        limiter = self._chats.get(chat_id)
+        if limiter is None:
+            if len(self._chats) >= _CHAT_LIMITERS_MAX:
+                self._prune_chats(asyncio.get_running_loop().time())
+            limiter = self._chats[chat_id] = RateLimiter(self.chat_rate, self.chat_burst)
+        return limiter
+
+    def _prune_chats(self, now):
+        """Forget limiters of chats that have been idle long enough to be full again"""
+        idle = [chat_id for chat_id, limiter in self._chats.items() if limiter.tat <= now]
+        for chat_id in idle:
+            del self._chats[chat_id]
+
+    def _pick(self, now):
+        """
+        Take the first job whose chat may receive a message now
+
+        Returns:
+            tuple: (job or None, seconds until some queued job becomes ready or None)
+        """
+        wait = None
+        for lane in self._lanes:
+            for index, job in enumerate(lane):
+                if index >= _SCAN_LIMIT:
+                    break
+                if job.future.done():
+                    continue  # Caller gave up; dropped below
+                if not job.paced:
+                    del lane[index]
+                    return job, None
+                limiter = self._chat_limiter(job.chat_id)
+                ready_in = limiter.ready_at() - now
+                if ready_in <= 0:
+                    del lane[index]
+                    limiter.reserve(now)
+                    return job, None
+                wait = ready_in if wait is None else min(wait, ready_in)
+            while lane and lane[0].future.done():
+                lane.popleft()
+        return None, wait
+
+    async def _take(self):
+        """Wait for a job that the chat and global limits allow to send"""
+        loop = asyncio.get_running_loop()
+        while True:
+            now = loop.time()
+            wait = self._paused_until - now
+            if wait <= 0:
+                job, wait = self._pick(now)
+                if job is not None:
+                    delay = self._global.reserve(now)
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                    return job
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), wait)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _worker(self):
+        """Send jobs until stopped"""
+        while True:
+            job = await self._take()
+            if job.future.done():
+                continue
+            try:
+                result = await job.call()
+            except RetryAfter as e:
+                self.counters['retry_after'] += 1
+                job.retries += 1
+                if job.retries > self.max_retries:
+                    self.counters['failed'] += 1
+                    if not job.future.done():
+                        job.future.set_exception(e)
+                    continue
+                # Telegram asked to slow down: pause everything, retry this one first
+                resume_at = asyncio.get_running_loop().time() + e.timeout
+                logger.warning(f"⏸ Telegram просит паузу {e.timeout} сек. (чат {job.chat_id})")
+                self._paused_until = max(self._paused_until, resume_at)
+                if job.paced:
+                    self._chat_limiter(job.chat_id).block_until(resume_at)
+                self._lanes[job.priority].appendleft(job)
+                self._wakeup.set()
+            except asyncio.CancelledError:
+                job.future.cancel()
+                raise
+            except Exception as e:
+                self.counters['failed'] += 1
+                if not job.future.done():
+                    job.future.set_exception(e)
+            else:
+                self.counters['sent'] += 1
+                if not job.future.done():
+                    job.future.set_result(result)
+
+
+outbound = OutboundScheduler(
+    OUTBOUND_GLOBAL_RATE, OUTBOUND_CHAT_RATE, OUTBOUND_CHAT_BURST, OUTBOUND_WORKERS, OUTBOUND_MAX_RETRIES
+)
+
+
+class ScheduledBot(Bot):
+    """
+    Bot whose chat-bound sends and edits go through the outbound scheduler
+
+    Handlers keep calling message.answer(), bot.send_photo() and so on;
+    only the transport is paced. Other methods (getUpdates,
+    answerCallbackQuery, ...) and everything before the scheduler is
+    started are sent directly. Sends to chats known to be dead fail with
+    ChatUndeliverable without a request (see bot/deliverability.py).
+    """
+
+    async def request(self, method, data=None, files=None, **kwargs):
+        chat_id = data.get('chat_id') if data else None
+        if chat_id is None or method not in RATE_LIMITED_METHODS:
+            return await super().request(method, data, files, **kwargs)
+        reason = undeliverable_reason(chat_id)
+        if reason is not None:
+            raise ChatUndeliverable(chat_id, reason)
+        call = partial(super().request, method, data, files, **kwargs)
+        try:
+            if outbound.running:
+                return await outbound.submit(chat_id, call, paced=method not in UNPACED_METHODS)
+            return await call()
+        except Exception as e:
+            note_send_failure(chat_id, e)
+            raise
+
+
+async def stop_outbound(app):
+    """Stop the outbound scheduler (aiohttp on_shutdown)"""
+    await outbound.stop()
@@ -0,0 +1,163 @@
+"""
+Username resolver module
+get_chat lookups for users whose profile was never captured
+
+Admin listings take profiles from profile_store / user_profiles first
+(bot/database/profiles.py). The rest are resolved here:
+- at most RESOLVER_CONCURRENCY get_chat calls run at once,
+- results (and failures) are cached for a while,
+- a user requested again while a lookup is running joins that lookup,
+- a listing waits at most RESOLVER_LISTING_BUDGET seconds and shows the
+  bare ID for what is not resolved yet; the lookups keep running and
+  the next listing finds them in the cache.
+Resolved profiles also go to profile_store, so they are persisted and
+never looked up again.
+"""
+
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+
+from bot.config import (
+    RESOLVER_CONCURRENCY, RESOLVER_TTL, RESOLVER_NEGATIVE_TTL, RESOLVER_CACHE_MAX, RESOLVER_LISTING_BUDGET
+)
+from bot.database.profiles import get_profiles
+from bot.models.profiles import profile_store
+from bot.models.records import UserProfile
+
+logger = logging.getLogger(__name__)
+
+
+class ProfileResolver:
+    """Bounded, cached, coalescing get_chat lookups (see module docstring)"""
+
+    def __init__(self, concurrency, ttl, negative_ttl, max_size):
+        self.concurrency = concurrency
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_size = max_size
+        self._semaphore = None  # Created lazily inside the running loop
+        self._cache = OrderedDict()  # user_id -> (UserProfile or None, expires_at)
+        self._inflight = {}  # user_id -> Task
+        self.counters = {
+            'hits': 0,
+            'coalesced': 0,  # Requests joined to a running lookup
+            'resolved': 0,
+            'failed': 0,
+            'over_budget': 0,  # Users shown without a name because the listing budget ran out
+        }
+
+    def _cached(self, user_id):
+        """
+        Cached lookup result
+        
+        Returns:
+            tuple: (found, profile) - profile is None for a cached failure
+        """
+        entry = self._cache.get(user_id)
+        if entry is None:
+            return False, None
+        if entry[1] <= time.monotonic():
+            del self._cache[user_id]
+            return False, None
+        self._cache.move_to_end(user_id)
+        return True, entry[0]
+
+    def _store(self, user_id, profile, ttl):
+        """Cache a lookup result"""
+        self._cache[user_id] = (profile, time.monotonic() + ttl)
+        self._cache.move_to_end(user_id)
+        while len(self._cache) > self.max_size:
+            self._cache.popitem(last=False)
+
+    async def _lookup(self, bot, user_id):
+        """One get_chat call, within the concurrency limit"""
+        try:
+            async with self._semaphore:
+                chat = await bot.get_chat(user_id)
+        except Exception as e:
+            self.counters['failed'] += 1
+            logger.debug(f"Не удалось получить профиль {user_id}: {e}")
+            self._store(user_id, None, self.negative_ttl)
+            return None
+        finally:
+            self._inflight.pop(user_id, None)
+        profile = UserProfile(chat.username, chat.full_name)
+        self.counters['resolved'] += 1
+        self._store(user_id, profile, self.ttl)
+        profile_store.capture(user_id, chat.username, chat.full_name)
+        return profile
+
+    async def resolve(self, bot, user_ids, budget):
+        """
+        Resolve profiles of several users within a time budget
+        
+        Args:
+            bot: Bot instance
+            user_ids: Telegram user IDs
+            budget: Seconds to wait for lookups
+            
+        Returns:
+            dict: user_id -> UserProfile for the users resolved in time
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        profiles = {}
+        tasks = {}
+        for user_id in set(user_ids):
+            found, profile = self._cached(user_id)
+            if found:
+                self.counters['hits'] += 1
+                if profile is not None:
+                    profiles[user_id] = profile
+                continue
+            task = self._inflight.get(user_id)
+            if task is None:
+                task = self._inflight[user_id] = asyncio.create_task(self._lookup(bot, user_id))
+            else:
+                self.counters['coalesced'] += 1
+            tasks[user_id] = task
+        if not tasks:
+            return profiles
+        
+        # Unfinished lookups are not cancelled: they fill the cache for the next listing
+        await asyncio.wait(tasks.values(), timeout=budget)
+        for user_id, task in tasks.items():
+            if not task.done():
+                self.counters['over_budget'] += 1
+            elif task.result() is not None:
+                profiles[user_id] = task.result()
+        return profiles
+
+    def stats(self):
+        """
+        Get resolver metrics
+        
+        Returns:
+            dict: Cache size, running lookups and counters
+        """
+        return {'cached': len(self._cache), 'inflight': len(self._inflight), 'counters': dict(self.counters)}
+
+
+profile_resolver = ProfileResolver(RESOLVER_CONCURRENCY, RESOLVER_TTL, RESOLVER_NEGATIVE_TTL, RESOLVER_CACHE_MAX)
+
+
+async def get_listing_profiles(bot, user_ids, budget=RESOLVER_LISTING_BUDGET):
+    """
+    Profiles for an admin listing: captured ones, then get_chat for the rest
+    
+    Args:
+        bot: Bot instance
+        user_ids: Telegram user IDs (None entries are ignored)
+        budget: Seconds to wait for get_chat lookups
+        
+    Returns:
+        dict: user_id -> UserProfile (users missing from it are shown by ID)
+    """
+    user_ids = [user_id for user_id in user_ids if user_id is not None]
+    profiles = await get_profiles(user_ids)
+    missing = [user_id for user_id in user_ids if user_id not in profiles]
+    if missing:
+        profiles.update(await profile_resolver.resolve(bot, missing, budget))
+    return profiles
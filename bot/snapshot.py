@@ -0,0 +1,210 @@
+"""
+Allow-list snapshot module
+Versioned snapshot file shared by the bot process and the /check workers
+
+File layout:
+    MAGIC | header length (uint32 LE) | header JSON | data
+
+The header holds the version, the script bits, and for every script the
+ETag and (offset, length) of its JSON body and gzipped body in the data
+area, plus the span of a {nickname: access_mask} JSON object. The bot
+rewrites the whole file atomically (write + os.replace); workers mmap it
+and serve bodies as memoryview slices, without copying.
+
+This module must stay importable without aiogram: worker processes only
+load the reader part.
+"""
+
+import json
+import logging
+import mmap
+import os
+import struct
+import time
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"PZAL1\n"
+_HEADER_LEN = struct.Struct("<I")
+
+
+def write_snapshot(path, version, bits, payloads, masks):
+    """
+    Atomically replace the snapshot file
+
+    Args:
+        path: Snapshot file path
+        version: Allow-list version
+        bits: {script_name: bit}
+        payloads: {script_name: CheckPayload}
+        masks: {nickname: access_mask}
+    """
+    chunks = []
+    offset = 0
+
+    def add(data):
+        nonlocal offset
+        span = [offset, len(data)]
+        chunks.append(data)
+        offset += len(data)
+        return span
+
+    scripts = {}
+    for name, payload in payloads.items():
+        scripts[name] = {
+            'etag': payload.etag,
+            'body': add(payload.body),
+            'gzip': add(payload.gzipped) if payload.gzipped is not None else None,
+        }
+    header = json.dumps({
+        'version': version,
+        'bits': bits,
+        'scripts': scripts,
+        'masks': add(json.dumps(masks).encode()),
+    }).encode()
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(_HEADER_LEN.pack(len(header)))
+        f.write(header)
+        for chunk in chunks:
+            f.write(chunk)
+    os.replace(tmp_path, path)
+
+
+def write_allowlist_snapshot(path):
+    """
+    Write the current in-memory allow-list to the snapshot file
+
+    Args:
+        path: Snapshot file path
+    """
+    from bot.models.access import SCRIPT_BITS
+    from bot.models.allowlist import allowlist
+
+    payloads = {name: allowlist.payload(name) for name in SCRIPT_BITS}
+    write_snapshot(path, allowlist.version, SCRIPT_BITS, payloads, allowlist.masks())
+
+
+async def snapshot_writer_loop(path):
+    """
+    Keep the snapshot file in sync with the allow-list (bot process)
+
+    Sleeps on the allow-list's change notifier, so it costs nothing while
+    access does not change. Stops when the notifier is closed on shutdown.
+
+    Args:
+        path: Snapshot file path
+    """
+    from bot.models.allowlist import allowlist
+
+    written = None
+    while True:
+        if allowlist.loaded and allowlist.version != written:
+            try:
+                version = allowlist.version
+                write_allowlist_snapshot(path)
+                written = version
+            except OSError as e:
+                logger.error(f"Ошибка записи снапшота списков доступа: {e}")
+        if not await allowlist.notifier.wait(60) and allowlist.notifier.closed:
+            return
+
+
+class Snapshot:
+    """One mapped version of the snapshot file"""
+
+    def __init__(self, mm):
+        self._mm = mm
+        self._view = memoryview(mm)
+        if bytes(self._view[:len(MAGIC)]) != MAGIC:
+            raise ValueError("Not an allow-list snapshot")
+        start = len(MAGIC) + _HEADER_LEN.size
+        (header_len,) = _HEADER_LEN.unpack_from(mm, len(MAGIC))
+        header = json.loads(bytes(self._view[start:start + header_len]))
+        self._data = start + header_len
+        self.version = header['version']
+        self.bits = header['bits']
+        self.scripts = header['scripts']
+        self._masks_span = header['masks']
+        self._masks = None
+
+    def _slice(self, span):
+        """Zero-copy view of a span of the data area"""
+        offset, length = span
+        return self._view[self._data + offset:self._data + offset + length]
+
+    def payload(self, script_name):
+        """
+        Serialized list of a script
+
+        Args:
+            script_name: Script identifier
+
+        Returns:
+            tuple: (etag, body, gzipped or None) as memoryviews, or None for an unknown script
+        """
+        script = self.scripts.get(script_name)
+        if script is None:
+            return None
+        gzipped = self._slice(script['gzip']) if script['gzip'] else None
+        return script['etag'], self._slice(script['body']), gzipped
+
+    def allowed(self, nickname, script_name):
+        """
+        Check one nickname (the mask index is parsed once per version)
+
+        Args:
+            nickname: User's nickname
+            script_name: Script identifier
+
+        Returns:
+            bool: True if the nickname may use the script
+        """
+        if self._masks is None:
+            self._masks = json.loads(bytes(self._slice(self._masks_span)))
+        return bool(self._masks.get(nickname, 0) & self.bits.get(script_name, 0))
+
+
+class SnapshotReader:
+    """
+    Maps the newest snapshot file (worker processes)
+
+    The file is stat()ed at most every `recheck` seconds. A new inode
+    means the bot replaced it; the old mapping is dropped and closed by
+    the GC once no response is still sending from it.
+    """
+
+    def __init__(self, path, recheck):
+        self.path = path
+        self.recheck = recheck
+        self._snapshot = None
+        self._file_id = None
+        self._checked_at = 0.0
+
+    def current(self):
+        """
+        Get the newest snapshot
+
+        Returns:
+            Snapshot or None if the bot has not written one yet
+        """
+        now = time.monotonic()
+        if now - self._checked_at < self.recheck:
+            return self._snapshot
+        self._checked_at = now
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return self._snapshot
+        file_id = (st.st_ino, st.st_mtime_ns, st.st_size)
+        if file_id != self._file_id:
+            try:
+                with open(self.path, 'rb') as f:
+                    mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                self._snapshot = Snapshot(mm)
+                self._file_id = file_id
+            except (OSError, ValueError) as e:
+                logger.error(f"Ошибка чтения снапшота списков доступа: {e}")
+        return self._snapshot
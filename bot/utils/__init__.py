@@ -4,11 +4,12 @@ Helper functions and utilities
 """
 
 from .ui import send_ui, get_menu_markup, get_help_text
-from .helpers import delete_after_delay
+from .helpers import delete_after_delay, split_message
 
 __all__ = [
     'send_ui',
     'get_menu_markup',
     'get_help_text',
     'delete_after_delay',
+    'split_message',
 ]
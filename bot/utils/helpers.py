@@ -20,3 +20,32 @@ async def delete_after_delay(message: types.Message, delay: int):
         await message.delete()
     except:
         pass
+
+
+def split_message(text, limit=4096):
+    """
+    Split a long text into Telegram-sized messages at line breaks
+    
+    Args:
+        text: Message text (lines must not carry HTML tags across line breaks)
+        limit: Maximum message length
+        
+    Returns:
+        list: Message texts
+    """
+    parts = []
+    current = ""
+    for line in text.splitlines(keepends=True):
+        while len(line) > limit:
+            if current:
+                parts.append(current)
+                current = ""
+            parts.append(line[:limit])
+            line = line[limit:]
+        if len(current) + len(line) > limit:
+            parts.append(current)
+            current = ""
+        current += line
+    if current or not parts:
+        parts.append(current)
+    return parts
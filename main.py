@@ -4,8 +4,13 @@ Main entry point for Podzemka Bot
 
 import os
 import asyncio
+import logging
 from aiohttp import web
 from bot.app import create_app
+from bot.config import CHECK_WORKERS, CHECK_WORKERS_PORT, CHECK_SNAPSHOT_PATH
+from bot.check_worker import start_check_workers
+
+logger = logging.getLogger(__name__)
 
 
 def main():
@@ -14,6 +19,13 @@ def main():
     if os.name == 'nt':
         asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
     
+    # Optional: serve /check from separate processes (Linux, SO_REUSEPORT)
+    if CHECK_WORKERS > 0:
+        if os.name == 'nt':
+            logger.warning("⚠️ CHECK_WORKERS не поддерживается на Windows, /check обслуживает бот")
+        else:
+            start_check_workers(CHECK_WORKERS, CHECK_WORKERS_PORT, CHECK_SNAPSHOT_PATH)
+    
     # Create application
     app, bot, dp = create_app()
     
@@ -0,0 +1,104 @@
+"""
+AccessCache tests
+Random operation sequences checked against the cache's own invariants
+"""
+
+import random
+
+import pytest
+
+from bot.models import cache as cache_module
+from bot.models.cache import AccessCache
+from bot.models.records import UserRecord
+
+MAXSIZE = 8
+TTL = 10.0
+USER_IDS = range(1, 21)
+NICKNAMES = ('Alpha', 'Bravo', 'Charlie', 'Delta', 'Echo')
+
+
+class FakeClock:
+    """Manually advanced replacement for time.time()"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(cache_module.time, 'time', fake.time)
+    return fake
+
+
+def assert_indexes_agree(cache):
+    """_data and _by_nick describe the same entries, both ways"""
+    assert len(cache._data) <= cache.maxsize
+    for user_id, entry in cache._data.items():
+        assert user_id == entry.record.user_id
+        assert user_id in cache._by_nick.get(entry.record.nickname, ())
+    for nickname, user_ids in cache._by_nick.items():
+        assert user_ids, f"empty index set left for {nickname!r}"
+        for user_id in user_ids:
+            assert user_id in cache._data
+            assert cache._data[user_id].record.nickname == nickname
+
+
+@pytest.mark.parametrize('seed', range(50))
+def test_random_operations_keep_indexes_in_sync(clock, seed):
+    rng = random.Random(seed)
+    cache = AccessCache(MAXSIZE, TTL)
+    for _ in range(500):
+        op = rng.random()
+        user_id = rng.choice(USER_IDS)
+        if op < 0.45:
+            cache.set(UserRecord(user_id, rng.choice(NICKNAMES), {'mine': True}))
+        elif op < 0.65:
+            record = cache.get(user_id)
+            assert record is None or record.user_id == user_id
+        elif op < 0.75:
+            cache.pop(user_id)
+        elif op < 0.85:
+            nickname = rng.choice(NICKNAMES)
+            removed = cache.pop_by_nick(nickname)
+            assert nickname not in cache._by_nick
+            assert not any(uid in cache._data for uid in removed)
+        else:
+            clock.now += rng.uniform(0, TTL / 2)
+        assert_indexes_agree(cache)
+
+
+def test_expired_entry_is_dropped_from_both_indexes(clock):
+    cache = AccessCache(MAXSIZE, TTL)
+    cache.set(UserRecord(1, 'Alpha'))
+    clock.now += TTL
+    assert cache.get(1) is None
+    assert 1 not in cache._data
+    assert 'Alpha' not in cache._by_nick
+    assert_indexes_agree(cache)
+
+
+def test_lru_eviction_unindexes_evicted_user(clock):
+    cache = AccessCache(2, TTL)
+    cache.set(UserRecord(1, 'Alpha'))
+    cache.set(UserRecord(2, 'Bravo'))
+    cache.get(1)
+    cache.set(UserRecord(3, 'Charlie'))
+    assert set(cache._data) == {1, 3}
+    assert 'Bravo' not in cache._by_nick
+    assert_indexes_agree(cache)
+
+
+def test_reset_with_new_nickname_moves_index(clock):
+    cache = AccessCache(MAXSIZE, TTL)
+    cache.set(UserRecord(1, 'Alpha'))
+    cache.set(UserRecord(2, 'Alpha'))
+    cache.set(UserRecord(1, 'Bravo'))
+    assert cache._by_nick['Alpha'] == {2}
+    assert cache._by_nick['Bravo'] == {1}
+    assert cache.pop_by_nick('Alpha') == [2]
+    assert cache.get(1).nickname == 'Bravo'
+    assert_indexes_agree(cache)
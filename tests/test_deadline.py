@@ -0,0 +1,26 @@
+"""
+Update budget tests
+"""
+
+import asyncio
+
+from bot.database.deadline import start_budget, end_budget, budget_remaining, create_detached_task
+
+
+def test_detached_task_runs_without_the_update_budget():
+    async def background():
+        return budget_remaining()
+
+    async def handler():
+        token = start_budget(5)
+        try:
+            inherited = await asyncio.ensure_future(background())
+            detached = await create_detached_task(background())
+            return inherited, detached, budget_remaining()
+        finally:
+            end_budget(token)
+
+    inherited, detached, own = asyncio.run(handler())
+    assert inherited is not None and inherited > 0
+    assert detached is None
+    assert own is not None
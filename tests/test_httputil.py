@@ -0,0 +1,34 @@
+"""
+HTTP helper tests
+"""
+
+import pytest
+
+from bot.httputil import accepts_gzip, etag_matches
+
+
+@pytest.mark.parametrize('header, expected', [
+    (None, False),
+    ('', False),
+    ('gzip', True),
+    ('gzip, deflate, br', True),
+    ('deflate, GZIP;q=0.5', True),
+    ('x-gzip', True),
+    ('gzip;q=0', False),
+    ('gzip; q=0.0, deflate', False),
+    ('gzip;q=abc', False),
+    ('*', True),
+    ('*;q=0', False),
+    ('gzip;q=0, *', False),
+    ('br, identity', False),
+    ('gzipped', False),
+])
+def test_accepts_gzip(header, expected):
+    assert accepts_gzip(header) is expected
+
+
+def test_etag_matches_weak_and_list():
+    assert etag_matches('W/"a", "b"', '"a"')
+    assert etag_matches('*', '"a"')
+    assert not etag_matches('"b"', '"a"')
+    assert not etag_matches(None, '"a"')